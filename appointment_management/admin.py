@@ -1,5 +1,20 @@
 from django.contrib import admin
-from .models import Appointment, Seizure, Incident, Medication, BodyMap
+from .models import Appointment, AppointmentSeries, Seizure, Incident, Medication, BodyMap
+
+
+class ChecklistCompletionFilter(admin.SimpleListFilter):
+    """Visits below a checklist completion threshold, served by the appt_checklist_idx index"""
+    title = 'checklist completion'
+    parameter_name = 'checklist_below'
+
+    def lookups(self, request, model_admin):
+        return [('25', 'Below 25%'), ('50', 'Below 50%'), ('75', 'Below 75%'), ('100', 'Incomplete')]
+
+    def queryset(self, request, queryset):
+        if self.value() in {value for value, _ in self.lookup_choices}:
+            return queryset.filter(checklist_completion_percentage__lt=int(self.value()))
+        return queryset
+
 
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
@@ -19,6 +34,8 @@ class AppointmentAdmin(admin.ModelAdmin):
         'status', 
         'frequency', 
         'assigned_staff',
+        'location_flag',
+        ChecklistCompletionFilter,
         'start_time', 
         'created_at'
     ]
@@ -29,7 +46,7 @@ class AppointmentAdmin(admin.ModelAdmin):
         'client__last_name',
         'assigned_staff__user__username'
     ]
-    readonly_fields = ['created_at', 'updated_at', 'duration_minutes', 'checklist_completion_percentage', 'available_checklist_items']
+    readonly_fields = ['created_at', 'updated_at', 'duration_minutes', 'checklist_completed_count', 'checklist_completion_percentage', 'available_checklist_items', 'location_flag']
     fieldsets = (
         ('Appointment Details', {
             'fields': ('title', 'description', 'client', 'start_time', 'end_time', 'status', 'assigned_staff')
@@ -39,10 +56,10 @@ class AppointmentAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Checklist & Care', {
-            'fields': ('checklist_items', 'available_checklist_items', 'checklist_completion_percentage')
+            'fields': ('checklist_items', 'available_checklist_items', 'checklist_completed_count', 'checklist_completion_percentage')
         }),
         ('Timestamps', {
-            'fields': ('created_at', 'updated_at', 'duration_minutes'),
+            'fields': ('created_at', 'updated_at', 'duration_minutes', 'location_flag'),
             'classes': ('collapse',)
         }),
     )
@@ -51,6 +68,32 @@ class AppointmentAdmin(admin.ModelAdmin):
         percentage = obj.checklist_completion_percentage
         return f"{percentage:.1f}%"
     checklist_completion_display.short_description = 'Checklist %'
+    checklist_completion_display.admin_order_field = 'checklist_completion_percentage'
+
+
+@admin.register(AppointmentSeries)
+class AppointmentSeriesAdmin(admin.ModelAdmin):
+    list_display = [
+        'title',
+        'client',
+        'assigned_staff',
+        'frequency',
+        'interval',
+        'start_time',
+        'until',
+        'count'
+    ]
+    list_filter = [
+        'frequency',
+        'assigned_staff',
+        'start_time'
+    ]
+    search_fields = [
+        'title',
+        'client__first_name',
+        'client__last_name'
+    ]
+    readonly_fields = ['created_at', 'updated_at']
 
 
 @admin.register(Seizure)
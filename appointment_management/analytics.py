@@ -0,0 +1,201 @@
+"""
+Visit compliance analytics.
+
+Punctuality, duration shortfall, checklist completion and geofence adherence
+are computed by the database: each visit's metrics are annotations (the
+equivalent of Appointment.duration_minutes as SQL expressions, and the stored
+checklist_completion_percentage) and a report is a single GROUP BY query by
+carer, client or week, so no visit is loaded into Python however long the period.
+
+Only visits that took place count: punctuality over started visits, duration
+and checklist over completed ones (those with an actual end time), and
+geofence adherence over started visits, a visit being adherent when its
+location_flag is blank.
+"""
+from datetime import timedelta
+
+from django.db.models import Avg, Count, F, FloatField, Func, Max, Q, Sum
+from django.db.models.functions import Coalesce, Least, TruncWeek
+from django.utils import timezone
+
+from .models import Appointment
+from .utils import day_bounds
+
+# A visit started more than this after its scheduled time is late
+LATE_START_GRACE = timedelta(minutes=15)
+# A completed visit shorter than scheduled by more than this is short
+SHORT_VISIT_GRACE = timedelta(minutes=5)
+
+DEFAULT_PERIOD_DAYS = 28
+
+
+class SecondsBetween(Func):
+    """
+    Seconds from the second datetime expression to the first, as a float.
+
+    Unlike subtracting DateTimeFields, which SQLite evaluates with a Python
+    function per row, this is native SQL on every backend.
+    """
+    arity = 2
+    output_field = FloatField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, template='EXTRACT(EPOCH FROM (%(expressions)s))', arg_joiner=' - ', **extra_context
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, template='((JULIANDAY(%(expressions)s)) * 86400.0)', arg_joiner=') - JULIANDAY(',
+            **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        clone = self.copy()
+        clone.set_source_expressions(self.get_source_expressions()[::-1])
+        return Func.as_sql(
+            clone, compiler, connection, template='(TIMESTAMPDIFF(MICROSECOND, %(expressions)s) / 1000000.0)',
+            **extra_context
+        )
+
+
+def _minutes(seconds):
+    return None if seconds is None else round(seconds / 60, 1)
+
+
+def _percentage(part, whole):
+    return round(100 * part / whole, 1) if whole else None
+
+
+# group -> (values() fields identifying a row, label fields added to each row, ordering)
+GROUPS = {
+    'carer': (['assigned_staff'], {
+        'carer_username': F('assigned_staff__username'),
+        'carer_first_name': F('assigned_staff__first_name'),
+        'carer_last_name': F('assigned_staff__last_name'),
+    }, ['assigned_staff']),
+    'client': (['client'], {
+        'client_first_name': F('client__first_name'),
+        'client_last_name': F('client__last_name'),
+    }, ['client']),
+    'week': (['week'], {}, ['week']),
+    'all': ([], {}, []),
+}
+
+
+def visit_metrics(queryset=None):
+    """Visits annotated with their compliance metrics (durations in seconds), computed by the database"""
+    if queryset is None:
+        queryset = Appointment.objects.all()
+    return queryset.annotate(
+        start_delay=SecondsBetween('actual_start_time', 'start_time'),
+        scheduled_duration=SecondsBetween('end_time', 'start_time'),
+        # As Appointment.duration_minutes: up to the scheduled end, from the actual start if known
+        actual_duration=SecondsBetween(Least('actual_end_time', 'end_time'), Coalesce('actual_start_time', 'start_time')),
+    )
+
+
+def report(group='carer', start=None, end=None, carer_ids=None, client_ids=None, checklist_threshold=100):
+    """
+    Compliance figures of the visits scheduled in [start, end) (local dates,
+    default the last DEFAULT_PERIOD_DAYS days), one row per `group` value.
+    Completed visits below `checklist_threshold` percent count as checklist gaps.
+
+    Raises ValueError for an unknown group or an empty period.
+    """
+    if group not in GROUPS:
+        raise ValueError(f'group must be one of {", ".join(GROUPS)}')
+    if end is None:
+        end = timezone.localdate() + timedelta(days=1)
+    if start is None:
+        start = end - timedelta(days=DEFAULT_PERIOD_DAYS)
+    if start >= end:
+        raise ValueError('start must be before end')
+
+    window_start, window_end = day_bounds(start, days=(end - start).days)
+    queryset = Appointment.objects.filter(start_time__gte=window_start, start_time__lt=window_end).exclude(
+        status='cancelled'
+    )
+    if carer_ids:
+        queryset = queryset.filter(assigned_staff_id__in=carer_ids)
+    if client_ids:
+        queryset = queryset.filter(client_id__in=client_ids)
+    queryset = visit_metrics(queryset)
+    if group == 'week':
+        queryset = queryset.annotate(week=TruncWeek('start_time'))
+
+    fields, labels, ordering = GROUPS[group]
+    started = Q(actual_start_time__isnull=False)
+    completed = Q(actual_end_time__isnull=False)
+    aggregates = dict(
+        visits=Count('pk'),
+        started=Count('pk', filter=started),
+        completed=Count('pk', filter=completed),
+        late_starts=Count('pk', filter=Q(start_delay__gt=LATE_START_GRACE.total_seconds())),
+        average_start_delay=Avg('start_delay'),
+        max_start_delay=Max('start_delay'),
+        short_visits=Count('pk', filter=completed & Q(
+            actual_duration__lt=F('scheduled_duration') - SHORT_VISIT_GRACE.total_seconds()
+        )),
+        scheduled_time=Sum('scheduled_duration', filter=completed),
+        delivered_time=Sum('actual_duration', filter=completed),
+        average_checklist_completion=Avg('checklist_completion_percentage', filter=completed),
+        checklist_gaps=Count('pk', filter=completed & Q(checklist_completion_percentage__lt=checklist_threshold)),
+        geofence_flagged=Count('pk', filter=started & ~Q(location_flag='')),
+    )
+    if fields:
+        rows = queryset.values(*fields).annotate(**labels, **aggregates).order_by(*ordering)
+    else:
+        rows = [queryset.aggregate(**aggregates)]
+    return {
+        'group': group,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'rows': [_row(group, row) for row in rows if row['visits']],
+    }
+
+
+def _row(group, row):
+    """Report row with durations in minutes and the derived rates"""
+    result = {field: row[field] for field in _keys(group)}
+    if group == 'week':
+        result['week'] = timezone.localtime(row['week']).date().isoformat()
+    shortfall = None
+    if row['scheduled_time'] is not None:
+        shortfall = max(row['scheduled_time'] - (row['delivered_time'] or 0), 0)
+    result.update({
+        'visits': row['visits'],
+        'started': row['started'],
+        'completed': row['completed'],
+        'late_starts': row['late_starts'],
+        'late_start_rate': _percentage(row['late_starts'], row['started']),
+        'average_start_delay_minutes': _minutes(row['average_start_delay']),
+        'max_start_delay_minutes': _minutes(row['max_start_delay']),
+        'short_visits': row['short_visits'],
+        'short_visit_rate': _percentage(row['short_visits'], row['completed']),
+        'scheduled_minutes': _minutes(row['scheduled_time']),
+        'delivered_minutes': _minutes(row['delivered_time']),
+        'shortfall_minutes': _minutes(shortfall),
+        'average_checklist_completion': (
+            None if row['average_checklist_completion'] is None else round(row['average_checklist_completion'], 1)
+        ),
+        'checklist_gaps': row['checklist_gaps'],
+        'geofence_flagged': row['geofence_flagged'],
+        'geofence_adherence': _percentage(row['started'] - row['geofence_flagged'], row['started']),
+    })
+    return result
+
+
+def _keys(group):
+    fields, labels, _ = GROUPS[group]
+    return fields + list(labels)
+
+
+def columns(group):
+    """CSV header of a report"""
+    return _keys(group) + [
+        'visits', 'started', 'completed', 'late_starts', 'late_start_rate', 'average_start_delay_minutes',
+        'max_start_delay_minutes', 'short_visits', 'short_visit_rate', 'scheduled_minutes', 'delivered_minutes',
+        'shortfall_minutes', 'average_checklist_completion', 'checklist_gaps', 'geofence_flagged',
+        'geofence_adherence',
+    ]
@@ -0,0 +1,277 @@
+"""
+Bulk appointment engine.
+
+Applies one operation - create, reschedule, reassign or cancel - to a batch of
+up to MAX_ITEMS appointments. Every client, staff member and appointment the
+batch refers to is loaded with one query each, ownership and double-bookings
+are checked for the whole batch at once (see conflicts.find_conflicts), and
+the valid items are written with bulk_create / bulk_update in a single
+transaction. Each item gets its own result; with atomic=True nothing is
+written unless every item is valid.
+
+A created item with a frequency starts a series of DEFAULT_REPEAT_COUNT
+visits, as the appointment form does, and every one of those visits is
+checked for double-bookings.
+"""
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from search import index as search_index
+from .checklist import checklist_sizes, set_completion
+from .conflicts import find_conflicts
+from .dashboard import invalidate_staff_dashboard
+from .forms import DEFAULT_REPEAT_COUNT
+from .models import Appointment, AppointmentSeries, SyncTombstone
+from .recurrence import new_series, occurrence_starts
+from .serializers import (
+    BulkCreateItemSerializer, BulkRescheduleItemSerializer, BulkReassignItemSerializer,
+    BulkCancelItemSerializer, ConflictSerializer
+)
+
+User = get_user_model()
+
+MAX_ITEMS = 5000
+BATCH_SIZE = 500
+
+# operation -> (item serializer, fields written by bulk_update, result status)
+OPERATIONS = {
+    'create': (BulkCreateItemSerializer, None, 'created'),
+    'reschedule': (BulkRescheduleItemSerializer, ['start_time', 'end_time'], 'rescheduled'),
+    'reassign': (BulkReassignItemSerializer, ['assigned_staff'], 'reassigned'),
+    'cancel': (BulkCancelItemSerializer, ['status'], 'cancelled'),
+}
+
+# Operations only admins may run; staff members act on their own visits only
+ADMIN_OPERATIONS = {'reassign'}
+
+
+class BulkOperationError(ValueError):
+    pass
+
+
+def is_admin(user):
+    return user.is_superuser or user.role == 'admin'
+
+
+class BulkAppointmentEngine:
+    """Validate and apply one bulk operation for a user (None for internal callers, with admin rights)"""
+
+    def __init__(self, user, operation, items, atomic=False):
+        if operation not in OPERATIONS:
+            raise BulkOperationError(f'Unknown operation: {operation}')
+        if not isinstance(items, list):
+            raise BulkOperationError('appointments must be a list')
+        if len(items) > MAX_ITEMS:
+            raise BulkOperationError(f'At most {MAX_ITEMS} appointments can be sent at once')
+        self.user = user
+        self.operation = operation
+        self.items = items
+        self.atomic = atomic
+        self.is_admin = user is None or is_admin(user)
+        self.results = [{'index': index, 'status': None} for index in range(len(items))]
+        self.appointments = {}
+        self.staff = {}
+        self.clients = {}
+        self.previous_staff = {}
+
+    def _fail(self, index, errors):
+        self.results[index] = {'index': index, 'status': 'error', 'errors': errors}
+
+    def _validate(self):
+        """(index, validated data) of every well-formed item"""
+        serializer_class = OPERATIONS[self.operation][0]
+        valid = []
+        for index, item in enumerate(self.items):
+            serializer = serializer_class(data=item)
+            if not serializer.is_valid():
+                self._fail(index, serializer.errors)
+                continue
+            data = dict(serializer.validated_data)
+            if self.operation == 'create' and self.user is not None:
+                data.setdefault('assigned_staff', self.user.pk)
+            valid.append((index, data))
+        return valid
+
+    def _load(self, valid):
+        """Fetch every appointment, staff member and client the batch refers to, one query each"""
+        ids = {data['id'] for _, data in valid if 'id' in data}
+        if ids:
+            self.appointments = Appointment.objects.in_bulk(ids)
+        staff_ids = {data['assigned_staff'] for _, data in valid if 'assigned_staff' in data}
+        if staff_ids:
+            self.staff = User.objects.filter(is_active=True, is_staff_member=True).in_bulk(staff_ids)
+        client_ids = {data['client'] for _, data in valid if 'client' in data}
+        if client_ids:
+            # client id -> length of its care checklist, for the stored completion counters
+            self.clients = checklist_sizes(client_ids)
+
+    def _staff_error(self, staff_id):
+        if staff_id not in self.staff:
+            return {'assigned_staff': ['Staff member not found.']}
+        if not self.is_admin and staff_id != self.user.pk:
+            return {'assigned_staff': ['You can only schedule your own appointments.']}
+        return None
+
+    def _owned_appointment(self, appointment_id):
+        """Return (appointment, errors) for an id taken from the payload"""
+        appointment = self.appointments.get(appointment_id)
+        if appointment is None or not (self.is_admin or appointment.assigned_staff_id == self.user.pk):
+            return None, {'id': ['Appointment not found.']}
+        if appointment.actual_start_time or appointment.status in ('completed', 'cancelled'):
+            return None, {'id': [f'A {"started" if appointment.actual_start_time else appointment.status} visit cannot be changed.']}
+        return appointment, None
+
+    def _prepare(self, valid):
+        """(index, appointment) with the item applied, for every item that passes the lookups"""
+        prepared = []
+        seen = set()
+        for index, data in valid:
+            if self.operation == 'create':
+                errors = self._staff_error(data.get('assigned_staff'))
+                if data['client'] not in self.clients:
+                    errors = dict(errors or {}, client=['Client not found.'])
+                if errors:
+                    self._fail(index, errors)
+                    continue
+                prepared.append((index, Appointment(
+                    title=data['title'],
+                    description=data.get('description'),
+                    client_id=data['client'],
+                    assigned_staff_id=data['assigned_staff'],
+                    start_time=data['start_time'],
+                    end_time=data['end_time'],
+                    frequency=data.get('frequency'),
+                    checklist_items=data.get('checklist_items', []),
+                )))
+                continue
+
+            if data['id'] in seen:
+                self._fail(index, {'id': ['Appointment appears more than once in the batch.']})
+                continue
+            seen.add(data['id'])
+            appointment, errors = self._owned_appointment(data['id'])
+            if errors is None and self.operation == 'reassign':
+                errors = self._staff_error(data['assigned_staff'])
+            if errors:
+                self._fail(index, errors)
+                continue
+            if self.operation == 'reschedule':
+                appointment.start_time = data['start_time']
+                appointment.end_time = data['end_time']
+            elif self.operation == 'reassign':
+                self.previous_staff[appointment.pk] = appointment.assigned_staff_id
+                appointment.assigned_staff_id = data['assigned_staff']
+            else:
+                appointment.status = 'cancelled'
+            prepared.append((index, appointment))
+        return prepared
+
+    def _check_conflicts(self, prepared):
+        """Drop the items that would double-book a staff member"""
+        if self.operation == 'cancel' or not prepared:
+            return prepared
+        # Each item is followed by the later visits of the series it starts, and
+        # owners maps every proposal back to its item's position in `prepared`
+        proposals, owners = [], []
+        for position, (_, appointment) in enumerate(prepared):
+            visits = [appointment]
+            if self.operation == 'create':
+                visits += self._repeat_visits(appointment)
+            proposals += visits
+            owners += [position] * len(visits)
+        failed = defaultdict(list)
+        for conflict in find_conflicts(proposals):
+            position = owners[conflict.index]
+            other_position = None if conflict.other_index is None else owners[conflict.other_index]
+            # Clashes with an item that is not written anyway do not count
+            if other_position is not None and (other_position in failed or other_position == position):
+                continue
+            other_index = None if other_position is None else prepared[other_position][0]
+            failed[position].append(conflict._replace(index=prepared[position][0], other_index=other_index))
+        for position, conflicts in failed.items():
+            self._fail(prepared[position][0], {
+                'non_field_errors': ['This staff member already has an appointment during this time.'],
+                'conflicts': ConflictSerializer(conflicts, many=True).data,
+            })
+        return [entry for position, entry in enumerate(prepared) if position not in failed]
+
+    @staticmethod
+    def _repeat_visits(appointment):
+        """Unsaved later visits of the series a created item with a frequency starts"""
+        if not appointment.frequency:
+            return []
+        starts = occurrence_starts(new_series(appointment, count=DEFAULT_REPEAT_COUNT))
+        next(starts)  # the first visit itself
+        duration = appointment.end_time - appointment.start_time
+        return [
+            Appointment(assigned_staff_id=appointment.assigned_staff_id, start_time=start, end_time=start + duration)
+            for start in starts
+        ]
+
+    @staticmethod
+    def _start_series(instances):
+        """Make every unsaved appointment with a frequency the first visit of a new series"""
+        repeating = [appointment for appointment in instances if appointment.frequency]
+        series = [new_series(appointment, count=DEFAULT_REPEAT_COUNT) for appointment in repeating]
+        AppointmentSeries.objects.bulk_create(series, batch_size=BATCH_SIZE)
+        for appointment, new in zip(repeating, series):
+            appointment.series = new
+            appointment.occurrence_start = appointment.start_time
+
+    def _write(self, instances):
+        _, fields, _ = OPERATIONS[self.operation]
+        staff_ids = {appointment.assigned_staff_id for appointment in instances}
+        # The previous assignee's device must drop a reassigned visit
+        tombstones = [
+            SyncTombstone(model='appointments', object_id=appointment.pk, staff_id=self.previous_staff[appointment.pk])
+            for appointment in instances
+            if self.previous_staff.get(appointment.pk, appointment.assigned_staff_id) != appointment.assigned_staff_id
+        ]
+        staff_ids.update(self.previous_staff.values())
+
+        with transaction.atomic():
+            if self.operation == 'create':
+                set_completion(instances, self.clients)
+                self._start_series(instances)
+                Appointment.objects.bulk_create(instances, batch_size=BATCH_SIZE)
+            else:
+                # bulk_update does not touch auto_now fields
+                now = timezone.now()
+                for appointment in instances:
+                    appointment.updated_at = now
+                Appointment.objects.bulk_update(instances, fields + ['updated_at'], batch_size=BATCH_SIZE)
+            if tombstones:
+                SyncTombstone.objects.bulk_create(tombstones, batch_size=BATCH_SIZE)
+            # Bulk writes skip model signals, so the search entries (and those of a
+            # reassigned visit's notes and incidents) are written here too
+            search_index.index(Appointment, instances, fields, created=self.operation == 'create')
+
+        # Bulk writes skip model signals, so clear the dashboard snapshots here
+        invalidate_staff_dashboard(*staff_ids)
+
+    def run(self):
+        """Apply the batch and return the summary with one result per item"""
+        valid = self._validate()
+        self._load(valid)
+        prepared = self._check_conflicts(self._prepare(valid))
+
+        failed = len(self.items) - len(prepared)
+        applied = []
+        if prepared and not (self.atomic and failed):
+            self._write([appointment for _, appointment in prepared])
+            applied = prepared
+        status = OPERATIONS[self.operation][2]
+        for index, appointment in prepared:
+            if applied:
+                self.results[index] = {'index': index, 'status': status, 'id': appointment.pk}
+            else:
+                self.results[index] = {'index': index, 'status': 'skipped', 'id': appointment.pk}
+        return {
+            'operation': self.operation,
+            'applied': len(applied),
+            'failed': failed,
+            'results': self.results,
+        }
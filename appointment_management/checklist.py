@@ -0,0 +1,102 @@
+"""
+Stored checklist completion counters.
+
+Appointment.checklist_completed_count and checklist_completion_percentage are
+denormalized from the visit's checklist_items and its client's care_checklist
+so that completion can be filtered and sorted by the database (see the
+appt_checklist_idx index) without loading clients. They are kept up to date by:
+
+- the pre_save hook in appointment_management.signals for saved appointments;
+- the Client post_save hook there, which rewrites the percentage of the
+  client's visits with one UPDATE when the length of the care checklist changes;
+- set_completion() in the bulk write paths, which skip model signals.
+
+The checklist length is always read from the database (checklist_sizes()), never
+from the reference cache: a cached checklist can be stale in this process, and
+a percentage computed from it would be stored until the next backfill.
+
+Rows written before the counters existed, or by queryset update(), are brought
+back in line by the backfill_checklist_completion command (backfill()).
+"""
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Func, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
+
+from client_management.models import Client
+from .models import Appointment
+
+BATCH_SIZE = 1000
+
+
+class JSONArrayLength(Func):
+    """Number of elements of a JSON array column"""
+    function = 'JSON_ARRAY_LENGTH'
+    output_field = IntegerField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='JSONB_ARRAY_LENGTH', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='JSON_LENGTH', **extra_context)
+
+
+def completion_expression(completed, available):
+    """Appointment.set_checklist_completion as a database expression"""
+    return Case(
+        When(GreaterThan(available, 0), then=ExpressionWrapper(completed * 100.0 / available, output_field=FloatField())),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def checklist_sizes(client_ids):
+    """Length of each client's care checklist, counted by the database"""
+    return dict(
+        Client.objects.filter(pk__in=client_ids)
+        .annotate(size=Coalesce(JSONArrayLength('care_checklist'), Value(0)))
+        .values_list('pk', 'size')
+    )
+
+
+def set_completion(appointments, sizes=None):
+    """
+    Set the counters of unsaved or bulk-updated appointments from their clients'
+    care checklists; `sizes` is checklist_sizes() of their clients if already read.
+    """
+    if sizes is None:
+        sizes = checklist_sizes({appointment.client_id for appointment in appointments})
+    for appointment in appointments:
+        appointment.set_checklist_completion(sizes.get(appointment.client_id, 0))
+
+
+def refresh_client(client):
+    """Recompute the percentage of a client's visits after its care checklist changed"""
+    available = len(client.care_checklist or [])
+    return Appointment.objects.filter(client=client).update(
+        checklist_completion_percentage=completion_expression(F('checklist_completed_count'), Value(available))
+    )
+
+
+def backfill(queryset=None, batch_size=BATCH_SIZE):
+    """
+    Recompute the counters of `queryset` (default every visit) in the database,
+    one UPDATE per batch of ids. Returns the number of visits updated.
+    """
+    if queryset is None:
+        queryset = Appointment.objects.all()
+    completed = Coalesce(JSONArrayLength('checklist_items'), Value(0))
+    available = Coalesce(Subquery(
+        Client.objects.filter(pk=OuterRef('client_id')).annotate(
+            available=JSONArrayLength('care_checklist')
+        ).values('available')[:1]
+    ), Value(0))
+    updated = last = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return updated
+        updated += Appointment.objects.filter(pk__in=ids).update(
+            checklist_completed_count=completed,
+            checklist_completion_percentage=completion_expression(completed, available),
+        )
+        last = ids[-1]
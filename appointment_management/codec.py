@@ -0,0 +1,114 @@
+"""
+Delta codec for packed visit traces (VisitTrace.data).
+
+A packed trace is a format version byte followed by one record per point, in
+time order:
+
+    zigzag varint   timestamp, milliseconds since the previous point
+    zigzag varint   latitude, microdegrees from the previous point
+    zigzag varint   longitude, microdegrees from the previous point
+    varint          distance from the client in decimetres << 1 | within geofence
+
+The first point is encoded against zero; a fix a few seconds and metres from
+the previous one takes 6-8 bytes. Points are appended to a trace knowing only
+its last point (see encode), and decode is a generator, so a reader that stops
+early never decodes the rest. The within geofence bit of a point that was
+never evaluated is stored as 0.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import NamedTuple, Optional
+
+FORMAT_VERSION = 1
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+COORDINATE_SCALE = 10 ** 6  # microdegrees, about 11 cm of latitude
+DISTANCE_SCALE = 10  # decimetres
+
+
+class Point(NamedTuple):
+    timestamp: datetime
+    latitude: float
+    longitude: float
+    distance_from_client: float
+    within_geofence: Optional[bool]
+
+
+def _integers(point):
+    timestamp, latitude, longitude, distance, within = point
+    return (
+        (timestamp - EPOCH) // MILLISECOND,
+        round(latitude * COORDINATE_SCALE),
+        round(longitude * COORDINATE_SCALE),
+        round(distance * DISTANCE_SCALE) << 1 | bool(within),
+    )
+
+
+def _write_varint(value, out):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def encode(points, previous=None):
+    """
+    Bytes for `points` in time order. With `previous` - the last point already
+    in a trace - the result continues that trace and is appended to its data;
+    without, it is a complete trace starting with the version byte.
+    """
+    out = bytearray()
+    if previous is None:
+        out.append(FORMAT_VERSION)
+        last_ms = last_latitude = last_longitude = 0
+    else:
+        last_ms, last_latitude, last_longitude, _ = _integers(previous)
+    for point in points:
+        ms, latitude, longitude, distance = _integers(point)
+        if ms < last_ms:
+            raise ValueError('Trace points must be in time order')
+        _write_varint(_zigzag(ms - last_ms), out)
+        _write_varint(_zigzag(latitude - last_latitude), out)
+        _write_varint(_zigzag(longitude - last_longitude), out)
+        _write_varint(distance, out)
+        last_ms, last_latitude, last_longitude = ms, latitude, longitude
+    return bytes(out)
+
+
+def decode(data):
+    """Yield the Points of a packed trace in time order"""
+    data = bytes(data)
+    if not data:
+        return
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f'Unknown trace format {data[0]}')
+    position, size = 1, len(data)
+    ms = latitude = longitude = 0
+    while position < size:
+        values = []
+        for _ in range(4):
+            value = shift = 0
+            while True:
+                if position >= size:
+                    raise ValueError('Truncated trace')
+                byte = data[position]
+                position += 1
+                value |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            values.append(value)
+        ms += (values[0] >> 1) ^ -(values[0] & 1)
+        latitude += (values[1] >> 1) ^ -(values[1] & 1)
+        longitude += (values[2] >> 1) ^ -(values[2] & 1)
+        yield Point(
+            EPOCH + ms * MILLISECOND,
+            latitude / COORDINATE_SCALE,
+            longitude / COORDINATE_SCALE,
+            (values[3] >> 1) / DISTANCE_SCALE,
+            bool(values[3] & 1),
+        )
@@ -0,0 +1,155 @@
+"""
+Double-booking detection.
+
+A batch of proposed appointments (unsaved or rescheduled Appointment
+instances - a form submission, the occurrences of a new series, an import or
+a rota copy) is checked in one pass. The bookings of every staff member in
+the batch are loaded for the window it spans with one query, plus the
+occurrences of their recurring series, and put in an IntervalIndex per staff
+member together with the batch itself. Each proposal is then a tree lookup,
+so every conflict is reported instead of stopping at the first one.
+
+Cancelled visits never conflict. A proposal with a pk replaces that row, and
+one with series / occurrence_start replaces that occurrence; a batch that
+replaces the later visits of a series (a split, see recurrence.split_series)
+names the series and the first occurrence it replaces.
+"""
+from collections import defaultdict
+from typing import NamedTuple, Optional
+
+from .models import Appointment, AppointmentSeries
+from .recurrence import expand
+
+INACTIVE_STATUSES = ('cancelled',)
+
+
+class IntervalIndex:
+    """
+    Static interval tree over half-open [start, end) intervals.
+
+    Items are kept in a sorted array read as an implicit balanced binary search
+    tree, each node holding the latest end of its subtree, so a lookup costs
+    O(log n + k) for k matches.
+    """
+
+    def __init__(self, items, bounds=lambda item: (item.start_time, item.end_time)):
+        entries = sorted(((*bounds(item), n) for n, item in enumerate(items)))
+        self._items = list(items)
+        self._starts = [entry[0] for entry in entries]
+        self._ends = [entry[1] for entry in entries]
+        self._order = [entry[2] for entry in entries]
+        self._max_end = list(self._ends)
+        self._build(0, len(entries))
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > self._max_end[mid]:
+                self._max_end[mid] = child
+        return self._max_end[mid]
+
+    def __len__(self):
+        return len(self._items)
+
+    def overlapping(self, start, end):
+        """Items whose interval overlaps [start, end), in start order"""
+        matches = []
+        stack = [(0, len(self._starts))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._max_end[mid] <= start:
+                continue
+            stack.append((lo, mid))
+            # The right subtree only holds intervals starting at or after this one
+            if self._starts[mid] < end:
+                if self._ends[mid] > start:
+                    matches.append(mid)
+                stack.append((mid + 1, hi))
+        return [self._items[self._order[i]] for i in sorted(matches)]
+
+
+class Conflict(NamedTuple):
+    index: int  # position of the proposal in the batch
+    proposal: Appointment
+    other: Appointment  # booked row, series occurrence or another proposal
+    other_index: Optional[int] = None  # position of `other` when it is in the batch
+
+
+def _active(appointment):
+    return (appointment.status not in INACTIVE_STATUSES
+            and appointment.assigned_staff_id is not None
+            and appointment.start_time is not None
+            and appointment.end_time is not None)
+
+
+def load_bookings(staff_ids, window_start, window_end, exclude_ids=()):
+    """Booked rows and series occurrences of the staff members overlapping the window"""
+    rows = list(
+        Appointment.objects.filter(
+            assigned_staff_id__in=staff_ids,
+            start_time__lt=window_end,
+            end_time__gt=window_start,
+        ).exclude(status__in=INACTIVE_STATUSES).exclude(pk__in=exclude_ids)
+    )
+    series = list(AppointmentSeries.objects.filter(assigned_staff_id__in=staff_ids, start_time__lt=window_end))
+    if series:
+        longest = max(s.duration for s in series)
+        rows += [
+            occurrence for occurrence in expand(series, window_start - longest, window_end)
+            if occurrence.end_time > window_start
+        ]
+    return rows
+
+
+def find_conflicts(proposals, replaces_series=None):
+    """
+    Every conflict of a batch of proposed appointments, in batch order.
+    `replaces_series` is (series id, occurrence start) when the batch replaces
+    that occurrence of a series and every later one.
+    """
+    proposals = list(proposals)
+    batch = [(n, p) for n, p in enumerate(proposals) if _active(p)]
+    if not batch:
+        return []
+
+    window_start = min(p.start_time for _, p in batch)
+    window_end = max(p.end_time for _, p in batch)
+    replaced_rows = {p.pk for _, p in batch if p.pk}
+    replaced_occurrences = {(p.series_id, p.occurrence_start) for _, p in batch if p.series_id}
+
+    staff_ids = {p.assigned_staff_id for _, p in batch}
+    booked = defaultdict(list)
+    for row in load_bookings(staff_ids, window_start, window_end, exclude_ids=replaced_rows):
+        if row.pk is None and (row.series_id, row.occurrence_start) in replaced_occurrences:
+            continue
+        if (replaces_series is not None and row.series_id == replaces_series[0]
+                and row.occurrence_start >= replaces_series[1]):
+            continue
+        booked[row.assigned_staff_id].append(row)
+    booked_index = {staff_id: IntervalIndex(rows) for staff_id, rows in booked.items()}
+
+    by_staff = defaultdict(list)
+    for n, proposal in batch:
+        by_staff[proposal.assigned_staff_id].append((n, proposal))
+    batch_index = {
+        staff_id: IntervalIndex(entries, bounds=lambda entry: (entry[1].start_time, entry[1].end_time))
+        for staff_id, entries in by_staff.items()
+    }
+
+    conflicts = []
+    for n, proposal in batch:
+        staff_id = proposal.assigned_staff_id
+        if staff_id in booked_index:
+            for other in booked_index[staff_id].overlapping(proposal.start_time, proposal.end_time):
+                conflicts.append(Conflict(n, proposal, other))
+        # Pairs within the batch are reported once, on the later proposal
+        for m, other in batch_index[staff_id].overlapping(proposal.start_time, proposal.end_time):
+            if m < n:
+                conflicts.append(Conflict(n, proposal, other, m))
+    return conflicts
+
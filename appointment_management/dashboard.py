@@ -0,0 +1,122 @@
+"""
+Staff dashboard engine.
+
+Builds the payload served by StaffDashboardAPIView from one query per model
+(plus one for the materialized occurrences when the staff member has recurring
+series) and keeps a per-staff snapshot in the cache. The snapshot is dropped by
+the signal handlers in appointment_management.signals whenever an appointment,
+series, incident or seizure belonging to the staff member is written.
+
+Invalidation only reaches other workers when the default cache is shared
+(CACHE_URL); with the local-memory backend a snapshot lives for
+LOCAL_CACHE_TIMEOUT seconds so other processes catch up quickly.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import BooleanField, Case, Q, Value, When
+from django.utils import timezone
+
+from reference_cache.accessors import staff_profile
+from .models import Appointment, AppointmentSeries, Incident, Seizure
+from .recurrence import expand
+from .serializers import AppointmentSerializer, IncidentSerializer, SeizureSerializer
+from .utils import today_bounds
+
+CACHE_KEY_PREFIX = 'staff-dashboard'
+DEFAULT_CACHE_TIMEOUT = 300  # seconds
+LOCAL_CACHE_TIMEOUT = 60  # seconds, for a per-process cache
+
+
+def _cache_key(staff_id, day=None):
+    day = day or timezone.localdate()
+    return f'{CACHE_KEY_PREFIX}:{staff_id}:{day.isoformat()}'
+
+
+def _cache_timeout():
+    timeout = getattr(settings, 'STAFF_DASHBOARD_CACHE_TIMEOUT', None)
+    if timeout is None:
+        timeout = LOCAL_CACHE_TIMEOUT if isinstance(caches['default'], LocMemCache) else DEFAULT_CACHE_TIMEOUT
+    return timeout
+
+
+def build_staff_dashboard(user):
+    """Compute the dashboard payload for a staff member straight from the database"""
+    now = timezone.now()
+    today_start, today_end = today_bounds()
+    week_ahead = now + timedelta(days=7)
+    week_ago = now - timedelta(days=7)
+
+    today_q = Q(start_time__gte=today_start, start_time__lt=today_end)
+    in_progress_q = Q(status='in_progress')
+    upcoming_q = Q(start_time__gte=now, start_time__lte=week_ahead)
+
+    # One pass over the staff member's appointments; each row is flagged with
+    # the dashboard sections it belongs to so the lists are split in memory.
+    appointments = list(
+        Appointment.objects.filter(assigned_staff=user)
+        .filter(today_q | in_progress_q | upcoming_q)
+        .annotate(
+            is_today=Case(When(today_q, then=Value(True)), default=Value(False), output_field=BooleanField()),
+            is_upcoming=Case(When(upcoming_q, then=Value(True)), default=Value(False), output_field=BooleanField()),
+        )
+        .order_by('start_time')
+    )
+    # Recurring series occurrences not materialized yet, over the same window
+    series = list(AppointmentSeries.objects.filter(assigned_staff=user))
+    occurrences = expand(series, min(today_start, now), max(today_end, week_ahead + timedelta(microseconds=1)))
+    for occurrence in occurrences:
+        occurrence.is_today = today_start <= occurrence.start_time < today_end
+        occurrence.is_upcoming = now <= occurrence.start_time <= week_ahead
+    if occurrences:
+        appointments = sorted(appointments + occurrences, key=lambda a: a.start_time)
+
+    today_appointments = [a for a in appointments if a.is_today]
+    in_progress_appointments = [a for a in appointments if a.status == 'in_progress']
+    upcoming_appointments = [a for a in appointments if a.is_upcoming]
+
+    recent_incidents = list(
+        Incident.objects.filter(appointment__assigned_staff=user, time__gte=week_ago)
+        .select_related('appointment')
+        .order_by('-time')
+    )
+    recent_seizures = list(
+        Seizure.objects.filter(appointment__assigned_staff=user, start_time__gte=week_ago)
+        .select_related('appointment')
+        .order_by('-start_time')
+    )
+
+    return {
+        'staff': staff_profile(user),
+        'today_appointments': AppointmentSerializer(today_appointments, many=True).data,
+        'in_progress_appointments': AppointmentSerializer(in_progress_appointments, many=True).data,
+        'upcoming_appointments': AppointmentSerializer(upcoming_appointments, many=True).data,
+        'recent_incidents': IncidentSerializer(recent_incidents, many=True).data,
+        'recent_seizures': SeizureSerializer(recent_seizures, many=True).data,
+        'stats': {
+            'today_count': len(today_appointments),
+            'in_progress_count': len(in_progress_appointments),
+            'upcoming_count': len(upcoming_appointments),
+            'recent_incidents_count': len(recent_incidents),
+            'recent_seizures_count': len(recent_seizures),
+        }
+    }
+
+
+def get_staff_dashboard(user):
+    """Return the cached dashboard snapshot for a staff member, building it on a miss"""
+    key = _cache_key(user.id)
+    data = cache.get(key)
+    if data is None:
+        data = build_staff_dashboard(user)
+        cache.set(key, data, _cache_timeout())
+    return data
+
+
+def invalidate_staff_dashboard(*staff_ids):
+    """Drop the cached snapshot of each given staff member"""
+    keys = [_cache_key(staff_id) for staff_id in staff_ids if staff_id]
+    if keys:
+        cache.delete_many(keys)
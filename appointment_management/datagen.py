@@ -0,0 +1,214 @@
+"""
+Synthetic dataset generator used by the generate_dataset and explain_hot_queries
+management commands.
+
+Rows are written with bulk_create in chunks of appointments (each chunk in its
+own transaction together with its child records), so memory use stays flat no
+matter how many appointments are requested.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from client_management.models import Client
+from visit_notes.models import Note
+from .geo import haversine
+from .models import Appointment, Seizure, Incident, Medication, BodyMap, VisitLocationLog
+
+User = get_user_model()
+
+DEFAULT_PASSWORD = 'loadtest123'
+
+# Share of appointments that get each kind of child record
+DEFAULT_RATES = {
+    'seizures': 0.02,
+    'incidents': 0.03,
+    'medications': 0.30,
+    'body_maps': 0.05,
+    'notes': 0.20,
+}
+
+CHECKLIST_KEYS = [key for key, _ in Client.CHECKLIST_CHOICES]
+MEDICATIONS = [('Paracetamol', 500), ('Ibuprofen', 400), ('Metformin', 850), ('Amlodipine', 10), ('Sertraline', 50)]
+
+
+class DatasetGenerator:
+    """Generate staff, clients and a year of visits with their clinical records"""
+
+    def __init__(self, clients=5000, staff=500, appointments=2000000, days=365,
+                 chunk_size=5000, prefix='load', seed=42, rates=None, log=None):
+        self.client_count = clients
+        self.staff_count = staff
+        self.appointment_count = appointments
+        self.days = days
+        self.chunk_size = chunk_size
+        self.prefix = prefix
+        self.rng = random.Random(seed)
+        self.rates = dict(DEFAULT_RATES, **(rates or {}))
+        self.log = log or (lambda message: None)
+        self.counts = {}
+
+    def run(self):
+        self.staff = self.create_staff()
+        self.clients = self.create_clients()
+        created = 0
+        while created < self.appointment_count:
+            size = min(self.chunk_size, self.appointment_count - created)
+            with transaction.atomic():
+                appointments = self.create_appointments(size, offset=created)
+                self.create_visit_records(appointments)
+            created += size
+            self.log(f'{created}/{self.appointment_count} appointments')
+        return self.counts
+
+    def _count(self, key, rows):
+        self.counts[key] = self.counts.get(key, 0) + len(rows)
+        return rows
+
+    def create_staff(self):
+        # Hash once; every generated carer shares the same password
+        password = make_password(DEFAULT_PASSWORD)
+        users = [
+            User(
+                username=f'{self.prefix}_carer_{i}',
+                first_name='Carer',
+                last_name=str(i),
+                email=f'{self.prefix}_carer_{i}@example.com',
+                password=password,
+                role='nurse',
+            )
+            for i in range(self.staff_count)
+        ]
+        return self._count('staff', User.objects.bulk_create(users, batch_size=self.chunk_size))
+
+    def create_clients(self):
+        rng = self.rng
+        clients = [
+            Client(
+                first_name=f'Client{i}',
+                last_name=self.prefix.title(),
+                address=f'{i} {rng.choice(["High", "Church", "Station", "Mill"])} Street',
+                email=f'{self.prefix}_client_{i}@example.com',
+                # Spread roughly 50km around a town centre
+                latitude=52.0 + rng.uniform(-0.45, 0.45),
+                longitude=-1.0 + rng.uniform(-0.7, 0.7),
+                care_checklist=rng.sample(CHECKLIST_KEYS, rng.randint(2, 6)),
+            )
+            for i in range(self.client_count)
+        ]
+        return self._count('clients', Client.objects.bulk_create(clients, batch_size=self.chunk_size))
+
+    def create_appointments(self, size, offset=0):
+        rng = self.rng
+        now = timezone.now()
+        window_start = (now - timedelta(days=self.days // 2)).replace(minute=0, second=0, microsecond=0)
+        slots = self.days * 24 * 4  # quarter-hour slots
+        appointments = []
+        for i in range(size):
+            client = rng.choice(self.clients)
+            start = window_start + timedelta(minutes=15 * rng.randrange(slots))
+            end = start + timedelta(minutes=rng.choice([15, 30, 45, 60]))
+            appointment = Appointment(
+                title=rng.choice(['Morning call', 'Lunch call', 'Tea call', 'Bedtime call']),
+                client=client,
+                assigned_staff=rng.choice(self.staff),
+                start_time=start,
+                end_time=end,
+                status='scheduled',
+            )
+            if end < now:
+                if rng.random() < 0.05:
+                    appointment.status = 'cancelled'
+                else:
+                    appointment.status = 'completed'
+                    appointment.actual_start_time = start + timedelta(minutes=rng.randint(-5, 20))
+                    appointment.actual_end_time = end + timedelta(minutes=rng.randint(-15, 5))
+                    appointment.checklist_items = rng.sample(
+                        client.care_checklist, rng.randint(0, len(client.care_checklist))
+                    )
+                    appointment.set_checklist_completion(len(client.care_checklist))
+            elif start < now:
+                appointment.status = 'in_progress'
+                appointment.actual_start_time = start
+            appointments.append(appointment)
+        return self._count('appointments', Appointment.objects.bulk_create(appointments, batch_size=self.chunk_size))
+
+    def _sample(self, appointments, key):
+        return [a for a in appointments if self.rng.random() < self.rates[key]]
+
+    def create_visit_records(self, appointments):
+        rng = self.rng
+        visited = [a for a in appointments if a.actual_start_time]
+
+        seizures = [
+            Seizure(appointment=a, start_time=a.actual_start_time + timedelta(minutes=5),
+                    end_time=a.actual_start_time + timedelta(minutes=5, seconds=rng.randint(30, 300)))
+            for a in self._sample(visited, 'seizures')
+        ]
+        incidents = [
+            Incident(
+                appointment=a,
+                time=a.actual_start_time + timedelta(minutes=10),
+                persons_involved='Carer and service user',
+                addresses_of_persons_involved=a.client.address,
+                incident_details=rng.choice(['Slip in bathroom', 'Verbal abuse', 'Medication refused', 'Fall from chair']),
+                incident_classification=[rng.choice(['minor_injury', 'verbal_abuse', 'other'])],
+                remediation_taken='Documented and family informed',
+            )
+            for a in self._sample(visited, 'incidents')
+        ]
+        medications = []
+        for a in self._sample(visited, 'medications'):
+            name, strength = rng.choice(MEDICATIONS)
+            medications.append(Medication(
+                appointment=a, name=name, strength=strength, dose=strength,
+                frequency=rng.choice(['once_daily', 'twice_daily', 'three_times_daily']),
+                administration_times=['morning'], route='oral',
+            ))
+        body_maps = [
+            BodyMap(
+                appointment=a, practitioner_id=a.assigned_staff_id, consent_given=True, consent_type='verbal',
+                injuries=[{'location': 'left_arm', 'type': 'bruise', 'serious': rng.random() < 0.1}],
+            )
+            for a in self._sample(visited, 'body_maps')
+        ]
+        notes = [
+            Note(appointment=a, uploaded_by_id=a.assigned_staff_id,
+                 content=rng.choice(['Client in good spirits', 'Ate well', 'Declined shower', 'GP visit due']))
+            for a in self._sample(visited, 'notes')
+        ]
+        location_logs = []
+        for a in visited:
+            location_logs.append(self._location_log(a, 'start'))
+            if a.actual_end_time:
+                location_logs.append(self._location_log(a, 'end'))
+
+        for key, model, rows in [
+            ('seizures', Seizure, seizures),
+            ('incidents', Incident, incidents),
+            ('medications', Medication, medications),
+            ('body_maps', BodyMap, body_maps),
+            ('notes', Note, notes),
+            ('location_logs', VisitLocationLog, location_logs),
+        ]:
+            self._count(key, model.objects.bulk_create(rows, batch_size=self.chunk_size))
+
+    def _location_log(self, appointment, log_type):
+        # Most fixes land within ~50m of the client's home
+        client = appointment.client
+        jitter = self.rng.gauss(0, 0.0004)
+        latitude, longitude = client.latitude + jitter, client.longitude + jitter
+        distance = haversine(client.latitude, client.longitude, latitude, longitude)
+        return VisitLocationLog(
+            appointment=appointment,
+            log_type=log_type,
+            latitude=latitude,
+            longitude=longitude,
+            distance_from_client=distance,
+            within_geofence=distance <= settings.VISIT_GEOFENCE_RADIUS_M,
+        )
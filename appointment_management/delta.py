@@ -0,0 +1,154 @@
+"""
+Delta sync engine.
+
+Returns the rows a staff member's device has not seen yet. The cursor is an
+opaque, URL-safe token holding one (updated_at, id) watermark per model plus
+the id of the last tombstone delivered. Rows are read in (updated_at, id)
+order, so a page that stops part-way through equal timestamps resumes exactly
+where it left off.
+
+updated_at is set when a row is written, not when its transaction commits, so
+a slow transaction can commit a row older than one already delivered. The
+watermark is therefore never moved past SYNC_COMMIT_LAG seconds ago (unless a
+full page forces it on): rows changed within the lag are sent again on the
+next pull, and devices apply rows idempotently by id.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from visit_notes.models import Note
+from visit_notes.serializers import NoteSerializer
+from .models import Appointment, AppointmentSeries, Seizure, Incident, Medication, BodyMap, SyncTombstone
+from .serializers import (
+    AppointmentSerializer, AppointmentSeriesSerializer, SeizureSerializer, IncidentSerializer,
+    MedicationSerializer, BodyMapSerializer
+)
+from .utils import decode_token, encode_token
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 2000
+DEFAULT_COMMIT_LAG = 5  # seconds
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _appointments(user):
+    return Appointment.objects.filter(assigned_staff=user)
+
+
+def _series(user):
+    return AppointmentSeries.objects.filter(assigned_staff=user)
+
+
+def _visit_records(model, *related):
+    def queryset(user):
+        return model.objects.filter(appointment__assigned_staff=user).select_related('appointment', *related)
+    return queryset
+
+
+# sync key -> (queryset factory, serializer)
+DELTA_MODELS = {
+    'appointments': (_appointments, AppointmentSerializer),
+    'series': (_series, AppointmentSeriesSerializer),
+    'seizures': (_visit_records(Seizure), SeizureSerializer),
+    'incidents': (_visit_records(Incident), IncidentSerializer),
+    'medications': (_visit_records(Medication), MedicationSerializer),
+    'body_maps': (_visit_records(BodyMap), BodyMapSerializer),
+    'notes': (_visit_records(Note, 'uploaded_by'), NoteSerializer),
+}
+
+
+def encode_cursor(state):
+    return encode_token(state)
+
+
+def decode_cursor(cursor):
+    """Turn a cursor token back into its watermark dict, raising InvalidCursor if malformed"""
+    try:
+        state = decode_token(cursor)
+    except ValueError:
+        raise InvalidCursor('Invalid sync cursor')
+    if not isinstance(state, dict):
+        raise InvalidCursor('Invalid sync cursor')
+    for key in DELTA_MODELS:
+        mark = state.get(key)
+        if mark is None:
+            continue
+        if not isinstance(mark, list) or len(mark) != 2 or not isinstance(mark[1], int):
+            raise InvalidCursor(f'Invalid sync cursor watermark for {key}')
+        try:
+            since = parse_datetime(str(mark[0]))
+        except ValueError:
+            # Well formed but impossible, e.g. month 13
+            since = None
+        if since is None:
+            raise InvalidCursor(f'Invalid sync cursor watermark for {key}')
+    if not isinstance(state.get('tombstones', 0), int):
+        raise InvalidCursor('Invalid sync cursor tombstone watermark')
+    return state
+
+
+def get_changes(user, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Collect the rows changed since the cursor for a staff member.
+
+    Without a cursor every row is returned and no tombstones are sent, since
+    the device has nothing to delete yet.
+    """
+    state = decode_cursor(cursor) if cursor else {}
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    has_more = False
+    payload = {}
+    next_state = {}
+    horizon = timezone.now() - timedelta(seconds=getattr(settings, 'SYNC_COMMIT_LAG', DEFAULT_COMMIT_LAG))
+
+    for key, (queryset_for, serializer_class) in DELTA_MODELS.items():
+        queryset = queryset_for(user)
+        mark = state.get(key)
+        since = None
+        if mark:
+            since, last_id = parse_datetime(mark[0]), mark[1]
+            queryset = queryset.filter(Q(updated_at__gt=since) | Q(updated_at=since, id__gt=last_id))
+        rows = list(queryset.order_by('updated_at', 'id')[:page_size + 1])
+        full = len(rows) > page_size
+        if full:
+            has_more = True
+            rows = rows[:page_size]
+        payload[key] = serializer_class(rows, many=True).data
+        if not rows:
+            next_state[key] = mark
+        elif full or rows[-1].updated_at <= horizon:
+            next_state[key] = [rows[-1].updated_at.isoformat(), rows[-1].id]
+        elif since is None or since < horizon:
+            next_state[key] = [horizon.isoformat(), 0]
+        else:
+            next_state[key] = mark
+
+    tombstones = SyncTombstone.objects.filter(staff=user)
+    if cursor:
+        rows = list(
+            tombstones.filter(id__gt=state.get('tombstones', 0))
+            .order_by('id')
+            .values_list('id', 'model', 'object_id')[:page_size + 1]
+        )
+        if len(rows) > page_size:
+            has_more = True
+            rows = rows[:page_size]
+        deleted = {key: [] for key in DELTA_MODELS}
+        for _, model, object_id in rows:
+            deleted[model].append(object_id)
+        next_state['tombstones'] = rows[-1][0] if rows else state.get('tombstones', 0)
+    else:
+        deleted = {key: [] for key in DELTA_MODELS}
+        next_state['tombstones'] = tombstones.aggregate(last=Max('id'))['last'] or 0
+
+    payload['deleted'] = deleted
+    payload['cursor'] = encode_cursor({k: v for k, v in next_state.items() if v is not None})
+    payload['has_more'] = has_more
+    return payload
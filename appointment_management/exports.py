@@ -0,0 +1,181 @@
+"""
+Streaming record exports.
+
+Appointments and the visit records (seizures, incidents, medications, body
+maps) are exported as CSV or newline-delimited JSON. Rows are read as tuples
+with values_list().iterator(chunk_size=...) - a server-side cursor on
+PostgreSQL, chunked fetches elsewhere - and encoded into chunks of
+FLUSH_ROWS rows as they arrive, so an export of any size is produced in
+constant memory, by the export API (StreamingHttpResponse) and the
+export_records command alike.
+
+Each row has the model's own columns followed by the visit's client and carer,
+and the filters select by visit: its local start date, client and carer.
+"""
+import csv
+import json
+
+from django.utils import timezone
+
+from .models import Appointment, BodyMap, Incident, Medication, Seizure
+from .utils import day_bounds
+
+CHUNK_SIZE = 2000
+FLUSH_ROWS = 500
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# dataset -> (model, path from the model to its appointment)
+DATASETS = {
+    'appointments': (Appointment, ''),
+    'seizures': (Seizure, 'appointment__'),
+    'incidents': (Incident, 'appointment__'),
+    'medications': (Medication, 'appointment__'),
+    'body_maps': (BodyMap, 'appointment__'),
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def columns(dataset):
+    """(header, values_list lookup) of each exported column"""
+    model, visit = DATASETS[dataset]
+    own = [(field.attname, field.attname) for field in model._meta.concrete_fields]
+    context = [
+        ('client_first_name', f'{visit}client__first_name'),
+        ('client_last_name', f'{visit}client__last_name'),
+        ('carer_username', f'{visit}assigned_staff__username'),
+    ]
+    if visit:
+        context = [
+            ('visit_start_time', f'{visit}start_time'),
+            ('client_id', f'{visit}client_id'),
+            ('carer_id', f'{visit}assigned_staff_id'),
+        ] + context
+    return own + context
+
+
+def queryset(dataset, start=None, end=None, client_ids=None, carer_ids=None):
+    """
+    The rows of `dataset` for visits starting on local dates [start, end) of the
+    given clients and carers, as values_list tuples in id order.
+    """
+    if dataset not in DATASETS:
+        raise ExportError(f'dataset must be one of {", ".join(DATASETS)}')
+    if start is not None and end is not None and start >= end:
+        raise ExportError('start must be before end')
+    model, visit = DATASETS[dataset]
+    rows = model.objects.all()
+    if start is not None:
+        rows = rows.filter(**{f'{visit}start_time__gte': day_bounds(start)[0]})
+    if end is not None:
+        rows = rows.filter(**{f'{visit}start_time__lt': day_bounds(end)[0]})
+    if client_ids:
+        rows = rows.filter(**{f'{visit}client_id__in': client_ids})
+    if carer_ids:
+        rows = rows.filter(**{f'{visit}assigned_staff_id__in': carer_ids})
+    return rows.order_by('pk').values_list(*(lookup for _, lookup in columns(dataset)))
+
+
+def _field(model, lookup):
+    """Model field a values_list lookup ends at"""
+    *relations, name = lookup.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def _converters(dataset, file_format):
+    """
+    One function per column turning a value into its exported form, matching
+    the API's representation; chosen once per export rather than per cell.
+    """
+    tz = timezone.get_current_timezone()
+
+    def local_datetime(value):
+        return None if value is None else value.astimezone(tz).isoformat()
+
+    def text(value):
+        return None if value is None else str(value)
+
+    def json_text(value):
+        return None if value is None else json.dumps(value)
+
+    model, _ = DATASETS[dataset]
+    converters = []
+    for _, lookup in columns(dataset):
+        field_type = _field(model, lookup).get_internal_type()
+        if field_type == 'DateTimeField':
+            converters.append(local_datetime)
+        elif field_type in ('DateField', 'DecimalField', 'DurationField'):
+            converters.append(text)
+        elif field_type == 'JSONField' and file_format == 'csv':
+            converters.append(json_text)
+        else:
+            converters.append(None)
+    return converters
+
+
+class _Lines:
+    """File-like target for csv.writer that keeps what is written until taken"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def take(self):
+        text = ''.join(self.parts)
+        self.parts.clear()
+        return text
+
+
+def _convert(row, converters):
+    return [value if convert is None else convert(value) for value, convert in zip(row, converters)]
+
+
+def stream(dataset, file_format, **filters):
+    """
+    Yield the export of `dataset` in `file_format` ('csv' or 'ndjson') as text
+    chunks. Raises ExportError for an unknown dataset or format before the
+    first chunk, so callers can report it.
+    """
+    if file_format not in FORMATS:
+        raise ExportError(f'format must be one of {", ".join(FORMATS)}')
+    rows = queryset(dataset, **filters)
+    headers = [header for header, _ in columns(dataset)]
+    converters = _converters(dataset, file_format)
+    if file_format == 'csv':
+        return _csv(rows, headers, converters)
+    return _ndjson(rows, headers, converters)
+
+
+def _csv(rows, headers, converters):
+    out = _Lines()
+    writer = csv.writer(out)
+    writer.writerow(headers)
+    pending = 0
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        writer.writerow(_convert(row, converters))
+        pending += 1
+        if pending == FLUSH_ROWS:
+            yield out.take()
+            pending = 0
+    yield out.take()
+
+
+def _ndjson(rows, headers, converters):
+    lines = []
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        lines.append(json.dumps(dict(zip(headers, _convert(row, converters))), separators=(',', ':')))
+        if len(lines) == FLUSH_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines.clear()
+    if lines:
+        yield '\n'.join(lines) + '\n'
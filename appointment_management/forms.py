@@ -1,11 +1,40 @@
+from itertools import islice
+
 from django import forms
+from .conflicts import find_conflicts
 from .models import Appointment, Seizure, Incident, Medication, BodyMap
+from .recurrence import following_series, new_series, occurrence_starts
 from django.utils import timezone
 
+# Visits in a repeating appointment created without an end date
+DEFAULT_REPEAT_COUNT = 6
+# Later visits of a series checked for double-bookings when an edit applies to them
+FOLLOWING_CHECK_VISITS = 52
+
+# Whether a change to a visit of a series applies to it alone or to the later visits too
+SERIES_SCOPE_CHOICES = [
+    ('visit', 'This visit only'),
+    ('following', 'This and all later visits of the series'),
+]
+
+
 class AppointmentForm(forms.ModelForm):
+    repeat_until = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}),
+        help_text='Last day of a repeating appointment. Leave blank for the next 5 visits.',
+    )
+    apply_to = forms.ChoiceField(
+        choices=SERIES_SCOPE_CHOICES,
+        initial='visit',
+        required=False,
+        widget=forms.RadioSelect,
+        help_text='For a visit of a repeating appointment.',
+    )
+
     class Meta:
         model = Appointment
-        fields = '__all__'
+        exclude = ['series', 'occurrence_start']
         widgets = {
             'start_time': forms.DateTimeInput(attrs={'type': 'datetime-local', 'class': 'form-control'}),
             'end_time': forms.DateTimeInput(attrs={'type': 'datetime-local', 'class': 'form-control'}),
@@ -26,19 +55,65 @@ class AppointmentForm(forms.ModelForm):
         if start_time and end_time:
             if end_time <= start_time:
                 self.add_error('end_time', 'End time must be after start time.')
-        # Double-booking check
-        if assigned_staff and start_time and end_time:
-            qs = Appointment.objects.filter(assigned_staff=assigned_staff)
-            if self.instance.pk:
-                qs = qs.exclude(pk=self.instance.pk)
-            overlap = qs.filter(
-                start_time__lt=end_time,
-                end_time__gt=start_time
-            ).exists()
-            if overlap:
-                raise forms.ValidationError('Warning: This staff member already has an appointment during this time!')
+        repeat_until = cleaned_data.get('repeat_until')
+        if repeat_until and start_time and repeat_until < timezone.localtime(start_time).date():
+            self.add_error('repeat_until', 'Repeat until must not be before the first visit.')
+        # Double-booking check, over every visit of a new repeating appointment
+        if assigned_staff and start_time and end_time and not self.errors:
+            self.check_conflicts(cleaned_data)
         return cleaned_data
 
+    def applies_to_following(self):
+        """Whether the edit of a series visit should also change its later visits"""
+        return bool(self.instance.series_id) and self.cleaned_data.get('apply_to') == 'following'
+
+    def repeat_rule(self):
+        """start_series() arguments for a new repeating appointment, or None"""
+        data = self.cleaned_data
+        # Existing visits, and occurrences of a series being saved, do not start a series
+        if self.instance.pk or self.instance.series_id or not data.get('frequency') or data.get('status') == 'completed':
+            return None
+        until = data.get('repeat_until')
+        return {'until': until, 'count': None if until else DEFAULT_REPEAT_COUNT}
+
+    def check_conflicts(self, cleaned_data):
+        visit = Appointment(
+            pk=self.instance.pk,
+            assigned_staff=cleaned_data['assigned_staff'],
+            start_time=cleaned_data['start_time'],
+            end_time=cleaned_data['end_time'],
+            status=cleaned_data.get('status') or 'scheduled',
+            frequency=cleaned_data.get('frequency'),
+            series_id=self.instance.series_id,
+            occurrence_start=self.instance.occurrence_start,
+        )
+        proposals = [visit]
+        rule = self.repeat_rule()
+        starts = replaces_series = None
+        if rule is not None:
+            starts = occurrence_starts(new_series(visit, **rule))
+        elif self.applies_to_following():
+            visit.series = self.instance.series
+            starts = islice(occurrence_starts(following_series(visit)), FOLLOWING_CHECK_VISITS)
+            replaces_series = (visit.series_id, visit.occurrence_start)
+        if starts is not None:
+            duration = visit.end_time - visit.start_time
+            next(starts)  # the first visit itself
+            proposals += [
+                Appointment(assigned_staff=visit.assigned_staff, start_time=start, end_time=start + duration)
+                for start in starts
+            ]
+        conflicts = find_conflicts(proposals, replaces_series)
+        if not conflicts:
+            return
+        if conflicts[0].index == 0:
+            raise forms.ValidationError('Warning: This staff member already has an appointment during this time!')
+        days = sorted({timezone.localtime(conflict.proposal.start_time).date() for conflict in conflicts})
+        raise forms.ValidationError(
+            'Warning: This staff member already has an appointment during the repeat visits on %s.'
+            % ', '.join(day.strftime('%d %b %Y') for day in days)
+        )
+
 
 class SeizureForm(forms.ModelForm):
     class Meta:
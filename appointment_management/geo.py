@@ -0,0 +1,73 @@
+"""
+Great-circle distances and geofences.
+
+The batch functions take sequences of (latitude, longitude) pairs and return
+plain Python lists. They are pure Python; distance_matrix converts each point
+to radians and takes the destination cosines once rather than per pair.
+"""
+import math
+
+EARTH_RADIUS_M = 6371000
+
+
+def _radians(points):
+    return [(math.radians(lat), math.radians(lon)) for lat, lon in points]
+
+
+def distance_matrix(origins, destinations=None):
+    """Haversine distance in metres from every origin to every destination (default: the origins)"""
+    origins = list(origins)
+    destinations = origins if destinations is None else list(destinations)
+    if not origins or not destinations:
+        return [[] for _ in origins]
+
+    b = [(lat, lon, math.cos(lat)) for lat, lon in _radians(destinations)]
+    matrix = []
+    for lat1, lon1 in _radians(origins):
+        cos1 = math.cos(lat1)
+        row = []
+        for lat2, lon2, cos2 in b:
+            h = math.sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * math.sin((lon2 - lon1) / 2) ** 2
+            row.append(2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, h))))
+        matrix.append(row)
+    return matrix
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Distance in metres between two points"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, h)))
+
+
+def distances(points, centres):
+    """
+    Haversine distance in metres from each point to its centre.
+
+    `centres` is either one (latitude, longitude) pair shared by every point or
+    a sequence with one centre per point.
+    """
+    points = list(points)
+    if not points:
+        return []
+    if len(centres) == 2 and not isinstance(centres[0], (list, tuple)):
+        centres = [centres] * len(points)
+    elif len(centres) != len(points):
+        raise ValueError('Expected one centre per point')
+
+    return [haversine(lat1, lon1, lat2, lon2) for (lat1, lon1), (lat2, lon2) in zip(points, centres)]
+
+
+def geofence(points, centres, radii):
+    """
+    (distances, inside) for each point against the circle around its centre.
+
+    `centres` is as for distances(); `radii` is one radius in metres or one per
+    point. A point exactly on the boundary is inside.
+    """
+    measured = distances(points, centres)
+    if isinstance(radii, (int, float)):
+        return measured, [d <= radii for d in measured]
+    if len(radii) != len(measured):
+        raise ValueError('Expected one radius per point')
+    return measured, [d <= r for d, r in zip(measured, radii)]
@@ -0,0 +1,172 @@
+"""
+Visit geofence engine.
+
+Location logs are measured against a circle around the client's residence -
+client.geofence_radius metres, VISIT_GEOFENCE_RADIUS_M by default - in batches
+with geo.geofence. Each log stores its distance and whether it was inside, and
+a visit is flagged (Appointment.location_flag) when it has start or end logs
+and none of them was inside, so a carer who logs again from the doorstep after
+a poor first fix is not flagged.
+
+The same code serves the live log_location action and uploaded traces
+(record_logs), and the nightly scan_visit_locations command (scan), which
+re-measures logs after a client moves or their radius changes.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .geo import geofence
+from .models import Appointment, VisitLocationLog
+
+FLAGGED_LOG_TYPES = ('start', 'end')
+BATCH_SIZE = 500
+
+# Distances are stored to the centimetre; smaller drift is not a change
+DISTANCE_EPSILON_M = 0.01
+
+
+class GeofenceError(ValueError):
+    pass
+
+
+def client_radius(client):
+    return client.geofence_radius or settings.VISIT_GEOFENCE_RADIUS_M
+
+
+def has_location(client):
+    return client.latitude is not None and client.longitude is not None
+
+
+def location_flag(outside_types):
+    """Appointment.location_flag for the set of log types that were only logged outside the geofence"""
+    return '_'.join(log_type for log_type in FLAGGED_LOG_TYPES if log_type in outside_types)
+
+
+def _flags(rows):
+    """{appointment id: location_flag} from (appointment id, log type, within_geofence) rows"""
+    inside = {}
+    for appointment_id, log_type, within in rows:
+        if log_type not in FLAGGED_LOG_TYPES:
+            continue
+        # Logs not evaluated yet (None) do not flag a visit
+        key = (appointment_id, log_type)
+        inside[key] = inside.get(key, False) or within is not False
+    outside = {}
+    for (appointment_id, log_type), any_inside in inside.items():
+        types = outside.setdefault(appointment_id, set())
+        if not any_inside:
+            types.add(log_type)
+    return {appointment_id: location_flag(types) for appointment_id, types in outside.items()}
+
+
+def _write_flags(flags, current=None):
+    """Store location flags, one UPDATE per flag value; returns how many visits changed"""
+    by_flag = defaultdict(list)
+    for appointment_id, flag in flags.items():
+        if current is None or current.get(appointment_id) != flag:
+            by_flag[flag].append(appointment_id)
+    changed = 0
+    # update() leaves updated_at alone, so flagging does not resend visits through delta sync
+    for flag, ids in by_flag.items():
+        changed += Appointment.objects.filter(pk__in=ids).exclude(location_flag=flag).update(location_flag=flag)
+    return changed
+
+
+def refresh_flags(appointment_ids):
+    """Recompute the location flag of the given visits from their stored logs"""
+    rows = VisitLocationLog.objects.filter(
+        appointment_id__in=appointment_ids, log_type__in=FLAGGED_LOG_TYPES
+    ).values_list('appointment_id', 'log_type', 'within_geofence')
+    flags = dict.fromkeys(appointment_ids, '')
+    flags.update(_flags(rows))
+    return _write_flags(flags)
+
+
+def build_logs(appointment, entries):
+    """
+    Unsaved VisitLocationLog rows for a visit, measured against the client's geofence.
+
+    Each entry is a dict with log_type, latitude and longitude, plus any other
+    VisitLocationLog field. Raises GeofenceError if the client has no location.
+    """
+    client = appointment.client
+    if not has_location(client):
+        raise GeofenceError('The client does not have a valid location set.')
+    entries = list(entries)
+    measured, inside = geofence(
+        [(entry['latitude'], entry['longitude']) for entry in entries],
+        (client.latitude, client.longitude),
+        client_radius(client),
+    )
+    return [
+        VisitLocationLog(appointment=appointment, distance_from_client=distance, within_geofence=within, **entry)
+        for entry, distance, within in zip(entries, measured, inside)
+    ]
+
+
+def record_logs(appointment, entries):
+    """Save location logs for a visit (see build_logs) and update its location flag"""
+    logs = build_logs(appointment, entries)
+    with transaction.atomic():
+        logs = VisitLocationLog.objects.bulk_create(logs, batch_size=BATCH_SIZE)
+        if any(log.log_type in FLAGGED_LOG_TYPES for log in logs):
+            refresh_flags([appointment.pk])
+    return logs
+
+
+def _scan_batch(appointments, summary):
+    current = dict(appointments)
+    rows = list(
+        VisitLocationLog.objects.filter(appointment_id__in=current).values_list(
+            'pk', 'appointment_id', 'log_type', 'latitude', 'longitude',
+            'distance_from_client', 'within_geofence',
+            'appointment__client__latitude', 'appointment__client__longitude',
+            'appointment__client__geofence_radius',
+        )
+    )
+    measurable = [row for row in rows if row[7] is not None and row[8] is not None]
+    measured, inside = geofence(
+        [(row[3], row[4]) for row in measurable],
+        [(row[7], row[8]) for row in measurable],
+        [row[9] or settings.VISIT_GEOFENCE_RADIUS_M for row in measurable],
+    )
+
+    evaluated = {}
+    changed = []
+    for row, distance, within in zip(measurable, measured, inside):
+        evaluated[row[0]] = within
+        if abs(row[5] - distance) > DISTANCE_EPSILON_M or row[6] is not within:
+            changed.append(VisitLocationLog(pk=row[0], distance_from_client=distance, within_geofence=within))
+
+    flags = dict.fromkeys(current, '')
+    flags.update(_flags((row[1], row[2], evaluated.get(row[0], row[6])) for row in rows))
+    with transaction.atomic():
+        VisitLocationLog.objects.bulk_update(changed, ['distance_from_client', 'within_geofence'])
+        summary['changed'] += _write_flags(flags, current)
+
+    summary['visits'] += len(current)
+    summary['logs'] += len(rows)
+    summary['updated_logs'] += len(changed)
+    summary['unmeasured_logs'] += len(rows) - len(measurable)
+    summary['flagged'] += sum(1 for flag in flags.values() if flag)
+
+
+def scan(queryset=None, batch_size=BATCH_SIZE):
+    """
+    Re-measure the location logs of every visit in `queryset` (default: all
+    visits) and update their location flags, batch_size visits at a time.
+    """
+    if queryset is None:
+        queryset = Appointment.objects.all()
+    summary = dict.fromkeys(['visits', 'logs', 'updated_logs', 'unmeasured_logs', 'flagged', 'changed'], 0)
+    queryset = queryset.order_by('pk').values_list('pk', 'location_flag')
+    last = 0
+    # Walk the visits by primary key rather than holding a cursor open while writing
+    while True:
+        batch = list(queryset.filter(pk__gt=last)[:batch_size])
+        if not batch:
+            return summary
+        _scan_batch(batch, summary)
+        last = batch[-1][0]
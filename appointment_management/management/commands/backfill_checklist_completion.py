@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from appointment_management.checklist import BATCH_SIZE, backfill
+from appointment_management.models import Appointment
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the stored checklist completion of visits from their checklist items and "
+        "their client's care checklist; run once after migrating, and after bulk changes made with update()"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client', type=int, action='append', help='Only visits of this client (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Visits updated per statement')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        queryset = Appointment.objects.all()
+        if options['client']:
+            queryset = queryset.filter(client_id__in=options['client'])
+        updated = backfill(queryset, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed the checklist completion of {updated} visits'))
@@ -0,0 +1,163 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client as HttpClient
+from django.utils import timezone
+
+from appointment_management.datagen import DEFAULT_PASSWORD
+from appointment_management.models import Appointment
+from authentication.tokens import issue
+
+User = get_user_model()
+
+
+class QueryCounter:
+    """Database execute wrapper counting queries without keeping them, so large pages can be measured"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Time every staff API, auth API, notes API and HTML dashboard endpoint in-process and '
+        'write p50/p95 latency and query counts to a JSON report'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Staff member to benchmark as (default: the one with most appointments)')
+        parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Password of that staff member, for the login endpoint')
+        parser.add_argument('--requests', type=int, default=20, help='Requests per endpoint')
+        parser.add_argument('--output', default='benchmark_results.json', help='Path of the JSON report')
+        parser.add_argument('--only', action='append', default=[],
+                            help='Only run endpoints whose name contains this text (repeatable)')
+        parser.add_argument('--skip', action='append', default=[],
+                            help='Skip endpoints whose name contains this text (repeatable)')
+
+    def handle(self, *args, **options):
+        staff = self.get_staff(options['username'])
+        appointment = Appointment.objects.filter(assigned_staff=staff).order_by('-start_time').first()
+        if appointment is None:
+            raise CommandError(f'{staff.username} has no appointments to benchmark against.')
+        _, token = issue(staff, device_id='benchmark_endpoints')
+
+        api = HttpClient(HTTP_AUTHORIZATION=f'Token {token}')
+        browser = HttpClient()
+        browser.force_login(staff)
+
+        results = []
+        for name, client, method, path, data in self.endpoints(staff, appointment, options['password'], api, browser):
+            if options['only'] and not any(text in name for text in options['only']):
+                continue
+            if any(text in name for text in options['skip']):
+                continue
+            result = self.measure(client, method, path, data, options['requests'])
+            result.update({'name': name, 'method': method.upper(), 'path': path})
+            results.append(result)
+            self.stdout.write(
+                f"{name:<40} {result['status']:>4}  p50 {result['p50_ms']:>8.1f} ms  "
+                f"p95 {result['p95_ms']:>8.1f} ms  queries {result['queries']}"
+            )
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'staff': staff.username,
+            'requests_per_endpoint': options['requests'],
+            'endpoints': results,
+        }
+        with open(options['output'], 'w') as fh:
+            json.dump(report, fh, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"\nReport written to {options['output']}"))
+
+    def get_staff(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User {username} does not exist.')
+        staff = (
+            User.objects.filter(is_staff_member=True, is_active=True)
+            .annotate(appointment_count=Count('appointments'))
+            .order_by('-appointment_count')
+            .first()
+        )
+        if staff is None:
+            raise CommandError('No staff members found. Run generate_dataset first.')
+        return staff
+
+    def endpoints(self, staff, appointment, password, api, browser):
+        """(name, client, method, path, data) for every benchmarked endpoint"""
+        staff_api = '/appointments/api/staff'
+        pk = appointment.pk
+        return [
+            # Staff appointment API
+            ('appointments list', api, 'get', f'{staff_api}/appointments/', None),
+            ('appointments today', api, 'get', f'{staff_api}/appointments/today/', None),
+            ('appointments upcoming', api, 'get', f'{staff_api}/appointments/upcoming/', None),
+            ('appointments in_progress', api, 'get', f'{staff_api}/appointments/in_progress/', None),
+            ('appointments week', api, 'get', f'{staff_api}/appointments/week/', None),
+            ('appointment detail', api, 'get', f'{staff_api}/appointments/{pk}/', None),
+            ('appointment details', api, 'get', f'{staff_api}/appointments/{pk}/details/', None),
+            ('appointment seizures', api, 'get', f'{staff_api}/appointments/{pk}/seizures/', None),
+            ('appointment location_logs', api, 'get', f'{staff_api}/appointments/{pk}/location_logs/', None),
+            ('seizures list', api, 'get', f'{staff_api}/seizures/', None),
+            ('incidents list', api, 'get', f'{staff_api}/incidents/', None),
+            ('incidents recent', api, 'get', f'{staff_api}/incidents/recent/', None),
+            ('medications list', api, 'get', f'{staff_api}/medications/', None),
+            ('body maps list', api, 'get', f'{staff_api}/body-maps/', None),
+            ('staff dashboard', api, 'get', f'{staff_api}/dashboard/', None),
+            ('delta sync', api, 'get', f'{staff_api}/sync/changes/', None),
+            # Auth API
+            ('auth check-user', api, 'post', '/api/auth/check-user/', {'username': staff.username}),
+            ('auth login', api, 'post', '/api/auth/login/', {'username': staff.username, 'password': password}),
+            ('auth user', api, 'get', '/api/auth/user/', None),
+            # Notes API
+            ('notes list', api, 'get', '/api/notes/', None),
+            ('notes by_appointment', api, 'get', f'/api/notes/by_appointment/?appointment_id={pk}', None),
+            # HTML dashboards
+            ('html dashboard', browser, 'get', '/', None),
+            ('html appointments', browser, 'get', '/appointments/', None),
+            ('html clients', browser, 'get', '/clients/', None),
+            ('html appointment detail', browser, 'get', f'/appointments/{pk}/', None),
+        ]
+
+    def measure(self, client, method, path, data, requests):
+        timings = []
+        query_counts = []
+        status_code = None
+        for _ in range(requests):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                if method == 'post':
+                    response = client.post(path, data, content_type='application/json')
+                else:
+                    response = client.get(path)
+                timings.append((time.perf_counter() - started) * 1000)
+            query_counts.append(counter.count)
+            status_code = response.status_code
+        return {
+            'status': status_code,
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'mean_ms': round(statistics.mean(timings), 2),
+            'queries': int(statistics.median(query_counts)),
+            'max_queries': max(query_counts),
+        }
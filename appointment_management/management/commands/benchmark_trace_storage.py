@@ -0,0 +1,152 @@
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from appointment_management.codec import Point
+from appointment_management.geo import haversine
+from appointment_management.management.commands.benchmark_endpoints import percentile
+from appointment_management.models import Appointment, VisitLocationLog, VisitTrace
+from client_management.models import Client
+
+User = get_user_model()
+
+
+def storage_bytes():
+    """Bytes used by the location log and trace tables (PostgreSQL) or the whole database (SQLite)"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            total = 0
+            for model in (VisitLocationLog, VisitTrace):
+                cursor.execute('SELECT pg_total_relation_size(%s)', [model._meta.db_table])
+                total += cursor.fetchone()[0]
+            return total
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA page_count')
+            pages = cursor.fetchone()[0]
+            cursor.execute('PRAGMA page_size')
+            return pages * cursor.fetchone()[0]
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare storage size and location_logs read latency of GPS traces stored as rows and packed '
+        'into delta-encoded blobs; the synthetic data is rolled back afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--visits', type=int, default=20, help='Visits per storage mode')
+        parser.add_argument('--points', type=int, default=2000, help='Trace points per visit')
+        parser.add_argument('--requests', type=int, default=20, help='Timed reads per measurement')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the results as JSON to this path')
+
+    def handle(self, *args, **options):
+        if options['visits'] < 1 or options['points'] < 1 or options['requests'] < 1:
+            raise CommandError('--visits, --points and --requests must be at least 1.')
+        with transaction.atomic():
+            report = self.run(options)
+            transaction.set_rollback(True)
+
+        for mode in ('rows', 'packed'):
+            result = report[mode]
+            size = 'n/a' if result['bytes'] is None else f"{result['bytes'] / 1024:.0f} KiB ({result['bytes_per_point']:.1f} B/point)"
+            self.stdout.write(
+                f"{mode:<7} storage {size:<28} first page p50 {result['first_page_p50_ms']:>7.1f} ms  "
+                f"p95 {result['first_page_p95_ms']:>7.1f} ms  full trace p50 {result['full_trace_p50_ms']:>8.1f} ms"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        staff = User.objects.create_user(username=f'trace-benchmark-{time.time_ns()}', is_staff_member=True)
+        client = Client.objects.create(first_name='Trace', last_name='Benchmark', address='Benchmark',
+                                       latitude=51.5, longitude=-0.1)
+        start = timezone.now() - timedelta(days=1)
+        visits = {}
+        for mode in ('rows', 'packed'):
+            visits[mode] = Appointment.objects.bulk_create([
+                Appointment(title='Trace benchmark', client=client, assigned_staff=staff,
+                            start_time=start, end_time=start + timedelta(hours=3))
+                for _ in range(options['visits'])
+            ])
+        traces = {
+            mode: [self.trace(rng, client, start, options['points']) for _ in appointments]
+            for mode, appointments in visits.items()
+        }
+
+        before = storage_bytes()
+        VisitLocationLog.objects.bulk_create([
+            VisitLocationLog(appointment=appointment, log_type='trace', **point._asdict())
+            for appointment, points in zip(visits['rows'], traces['rows'])
+            for point in points
+        ], batch_size=1000)
+        rows_bytes = None if before is None else storage_bytes() - before
+
+        before = storage_bytes()
+        packed = []
+        for appointment, points in zip(visits['packed'], traces['packed']):
+            trace = VisitTrace(appointment=appointment)
+            trace.append(points)
+            packed.append(trace)
+        VisitTrace.objects.bulk_create(packed)
+        packed_bytes = None if before is None else storage_bytes() - before
+
+        api = APIClient()
+        api.force_authenticate(user=staff)
+        total_points = options['visits'] * options['points']
+        report = {
+            'database': connection.vendor,
+            'visits': options['visits'],
+            'points_per_visit': options['points'],
+            'blob_bytes': sum(len(trace.data) for trace in packed),
+        }
+        for mode, size in (('rows', rows_bytes), ('packed', packed_bytes)):
+            first_page = self.measure(api, visits[mode], options['requests'], follow=False)
+            full_trace = self.measure(api, visits[mode], options['requests'], follow=True)
+            report[mode] = {
+                'bytes': size,
+                'bytes_per_point': None if size is None else size / total_points,
+                'first_page_p50_ms': round(statistics.median(first_page), 2),
+                'first_page_p95_ms': round(percentile(first_page, 95), 2),
+                'full_trace_p50_ms': round(statistics.median(full_trace), 2),
+                'full_trace_p95_ms': round(percentile(full_trace, 95), 2),
+            }
+        return report
+
+    def trace(self, rng, client, start, count):
+        """A carer's fixes every 5 s, wandering around the client's home"""
+        points = []
+        latitude, longitude = client.latitude, client.longitude
+        for n in range(count):
+            latitude += rng.gauss(0, 0.00003)
+            longitude += rng.gauss(0, 0.00003)
+            distance = haversine(client.latitude, client.longitude, latitude, longitude)
+            points.append(Point(start + timedelta(seconds=5 * n, milliseconds=rng.randrange(1000)),
+                                latitude, longitude, distance, distance <= 150))
+        return points
+
+    def measure(self, api, appointments, requests, follow):
+        """Milliseconds to read the first page (or every page) of location_logs, cycling through the visits"""
+        timings = []
+        for n in range(requests):
+            url = f'/appointments/api/staff/appointments/{appointments[n % len(appointments)].pk}/location_logs/?page_size=200'
+            started = time.perf_counter()
+            while url:
+                response = api.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'location_logs returned {response.status_code}')
+                url = response.json()['next'] if follow else None
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
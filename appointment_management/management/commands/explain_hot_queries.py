@@ -0,0 +1,127 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from appointment_management.datagen import DatasetGenerator
+from appointment_management.models import Appointment, Seizure, Incident, VisitLocationLog
+from appointment_management.utils import today_bounds, week_bounds
+
+HOT_QUERY_MODELS = [Appointment, Seizure, Incident, VisitLocationLog]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Show query plans and timings for the hot appointment queries with and without '
+        'the composite indexes. Runs inside a transaction that is always rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=20000,
+                            help='Appointments to seed before measuring (0 to use existing data)')
+        parser.add_argument('--staff', type=int, default=50, help='Staff members to seed')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query')
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        try:
+            with transaction.atomic():
+                if options['appointments']:
+                    self.seed(options['appointments'], options['staff'])
+                self.analyze()
+                staff = Appointment.objects.values_list('assigned_staff', flat=True).first()
+                appointment = Appointment.objects.filter(assigned_staff=staff).order_by('start_time').first()
+                if appointment is None:
+                    self.stdout.write(self.style.ERROR('No appointments to measure. Use --appointments to seed some.'))
+                    raise Rollback
+                queries = self.hot_queries(staff, appointment)
+
+                with_indexes = {label: self.measure(build) for label, build in queries}
+                self.drop_indexes()
+                without_indexes = {label: self.measure(build) for label, build in queries}
+
+                for label, _ in queries:
+                    self.report(label, with_indexes[label], without_indexes[label])
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(self.style.SUCCESS('Done - all seeded data and index changes were rolled back.'))
+
+    def hot_queries(self, staff, appointment):
+        """(label, queryset factory) pairs mirroring the staff API and dashboard query shapes"""
+        now = timezone.now()
+        day_start, day_end = today_bounds()
+        week_start, week_end = week_bounds()
+        staff_appointments = Appointment.objects.filter(assigned_staff=staff)
+        return [
+            ('today (start_time__date, old shape)',
+             lambda: staff_appointments.filter(start_time__date=timezone.localdate()).order_by('start_time')),
+            ('today (half-open range)',
+             lambda: staff_appointments.filter(start_time__gte=day_start, start_time__lt=day_end).order_by('start_time')),
+            ('week (half-open range)',
+             lambda: staff_appointments.filter(start_time__gte=week_start, start_time__lt=week_end).order_by('start_time')),
+            ('upcoming',
+             lambda: staff_appointments.filter(start_time__gte=now).order_by('start_time')[:10]),
+            ('in progress',
+             lambda: staff_appointments.filter(status='in_progress').order_by('start_time')),
+            ('admin dashboard active appointments',
+             lambda: Appointment.objects.filter(status='scheduled', start_time__gte=day_start)),
+            ('recent incidents',
+             lambda: Incident.objects.filter(appointment__assigned_staff=staff, time__gte=now - timedelta(days=7))),
+            ('appointment seizures',
+             lambda: Seizure.objects.filter(appointment=appointment).order_by('start_time')),
+            ('appointment location logs',
+             lambda: VisitLocationLog.objects.filter(appointment=appointment).order_by('timestamp')),
+        ]
+
+    def measure(self, build):
+        queryset = build()
+        plan = queryset.explain()
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            list(queryset.all())
+            timings.append((time.perf_counter() - started) * 1000)
+        return {'plan': plan, 'median_ms': statistics.median(timings)}
+
+    def report(self, label, with_indexes, without_indexes):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{label}'))
+        self.stdout.write(
+            f"  with indexes: {with_indexes['median_ms']:.2f} ms   "
+            f"without: {without_indexes['median_ms']:.2f} ms"
+        )
+        self.stdout.write('  plan with indexes:')
+        for line in with_indexes['plan'].splitlines():
+            self.stdout.write(f'    {line}')
+        self.stdout.write('  plan without:')
+        for line in without_indexes['plan'].splitlines():
+            self.stdout.write(f'    {line}')
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def drop_indexes(self):
+        """Drop the composite indexes declared on the hot models (rolled back with the transaction)"""
+        with connection.cursor() as cursor:
+            for model in HOT_QUERY_MODELS:
+                for index in model._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+        self.analyze()
+
+    def seed(self, appointment_count, staff_count):
+        self.stdout.write(f'Seeding {appointment_count} appointments for {staff_count} staff members...')
+        DatasetGenerator(
+            clients=max(1, appointment_count // 20),
+            staff=staff_count,
+            appointments=appointment_count,
+            days=360,
+            prefix=f'explain_{int(time.time())}',
+        ).run()
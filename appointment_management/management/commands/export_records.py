@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from appointment_management.exports import DATASETS, FORMATS, ExportError, stream
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream appointments or visit records (seizures, incidents, medications, body maps) '
+        'as CSV or NDJSON, in constant memory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(DATASETS))
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--start', help='First visit date, YYYY-MM-DD')
+        parser.add_argument('--end', help='Visit date to stop before, YYYY-MM-DD')
+        parser.add_argument('--client', type=int, action='append', help='Only visits of this client (repeatable)')
+        parser.add_argument('--carer', type=int, action='append', help='Only visits of this carer (repeatable)')
+        parser.add_argument('--output', help='Write to this path instead of standard output')
+
+    def handle(self, *args, **options):
+        filters = {'client_ids': options['client'], 'carer_ids': options['carer']}
+        for option in ('start', 'end'):
+            if options[option]:
+                filters[option] = parse_date(options[option])
+                if filters[option] is None:
+                    raise CommandError(f'--{option} must be YYYY-MM-DD.')
+        try:
+            chunks = stream(options['dataset'], options['format'], **filters)
+        except ExportError as exc:
+            raise CommandError(str(exc))
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as fh:
+                fh.writelines(chunks)
+            self.stderr.write(self.style.SUCCESS(f"Export written to {options['output']}"))
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
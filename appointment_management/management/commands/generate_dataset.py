@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from appointment_management.datagen import DEFAULT_PASSWORD, DatasetGenerator
+
+
+class Command(BaseCommand):
+    help = 'Generate a large synthetic dataset (carers, clients, visits and their records) for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=5000, help='Number of clients')
+        parser.add_argument('--staff', type=int, default=500, help='Number of carers')
+        parser.add_argument('--appointments', type=int, default=2000000, help='Number of appointments')
+        parser.add_argument('--days', type=int, default=365, help='Days spanned by the appointments, centred on today')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Appointments written per transaction')
+        parser.add_argument('--prefix', default='load',
+                            help='Prefix for generated usernames and emails; change it to generate a second dataset')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed')
+
+    def handle(self, *args, **options):
+        generator = DatasetGenerator(
+            clients=options['clients'],
+            staff=options['staff'],
+            appointments=options['appointments'],
+            days=options['days'],
+            chunk_size=options['chunk_size'],
+            prefix=options['prefix'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+        started = time.perf_counter()
+        counts = generator.run()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(f'\nDataset generated in {elapsed:.1f}s'))
+        for key, count in counts.items():
+            self.stdout.write(f'  {key}: {count}')
+        self.stdout.write(f"\nCarers log in as {options['prefix']}_carer_<n> with password '{DEFAULT_PASSWORD}'")
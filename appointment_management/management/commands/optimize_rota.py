@@ -0,0 +1,73 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from appointment_management.rota import DEFAULT_TIME_LIMIT, apply_plan, optimize_day
+
+
+class Command(BaseCommand):
+    help = (
+        "Assign a day's scheduled visits to carers so total travel distance is minimised, "
+        "respecting visit times, shifts and travel time; prints the plan and optionally applies it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to plan, YYYY-MM-DD (default: tomorrow)')
+        parser.add_argument('--carer', type=int, action='append', default=[],
+                            help='Carer id to plan for (repeatable; default: every active staff member). '
+                                 'Without --visit only these carers\' own visits are moved')
+        parser.add_argument('--visit', type=int, action='append', default=[],
+                            help='Appointment id to (re)assign (repeatable; default: every scheduled visit of the day)')
+        parser.add_argument('--shift', action='append', default=[],
+                            help='Working hours of a carer as ID=HH:MM-HH:MM (repeatable; default: all day)')
+        parser.add_argument('--time-limit', type=float, default=DEFAULT_TIME_LIMIT, help='Seconds of local search')
+        parser.add_argument('--apply', action='store_true', help='Write the reassignments')
+        parser.add_argument('--output', help='Write the plan as JSON to this path')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            day = parse_date(options['date'])
+            if day is None:
+                raise CommandError('--date must be YYYY-MM-DD.')
+        else:
+            day = timezone.localdate() + timedelta(days=1)
+
+        shifts = {}
+        for value in options['shift']:
+            try:
+                carer_id, hours = value.split('=')
+                start, end = hours.split('-')
+                shifts[int(carer_id)] = (start, end)
+            except ValueError:
+                raise CommandError(f'Invalid --shift {value!r}, expected ID=HH:MM-HH:MM.')
+
+        try:
+            plan = optimize_day(
+                day, carer_ids=options['carer'], visit_ids=options['visit'],
+                shifts=shifts, time_limit=options['time_limit'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(
+            f"{plan['date']}: {plan['visits']} visits, {plan['carers']} carers, "
+            f"{len(plan['assignments'])} reassignments, {len(plan['unassigned'])} unassignable"
+        )
+        self.stdout.write(
+            f"Travel {plan['distance_before_m'] / 1000:.1f} km -> {plan['distance_after_m'] / 1000:.1f} km "
+            f"(planned in {plan['elapsed_ms']} ms)"
+        )
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(plan, fh, indent=2)
+            self.stdout.write(f"Plan written to {options['output']}")
+
+        if options['apply']:
+            result = apply_plan(plan)
+            if result['failed']:
+                errors = [r for r in result['results'] if r['status'] == 'error']
+                raise CommandError(f'Plan not applied, {len(errors)} reassignments failed: {errors[:5]}')
+            self.stdout.write(self.style.SUCCESS(f"Applied {result['applied']} reassignments"))
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from appointment_management.models import VisitLocationLog
+from appointment_management.traces import pack
+
+
+class Command(BaseCommand):
+    help = (
+        "Move 'trace' location log rows into packed per-visit traces (VisitTrace); "
+        "run after setting VISIT_TRACE_STORAGE=packed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Visits packed per transaction')
+        parser.add_argument('--limit', type=int, help='Stop after this many visits')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        if settings.VISIT_TRACE_STORAGE != 'packed':
+            self.stdout.write(self.style.WARNING(
+                'VISIT_TRACE_STORAGE is not "packed", so new uploads will still be stored as rows.'
+            ))
+
+        pending = VisitLocationLog.objects.filter(log_type='trace').order_by('appointment_id')
+        visits = rows = 0
+        last = 0
+        while options['limit'] is None or visits < options['limit']:
+            size = options['batch_size']
+            if options['limit'] is not None:
+                size = min(size, options['limit'] - visits)
+            # Walk the visits by id so each batch is read after the previous one was deleted
+            ids = list(
+                pending.filter(appointment_id__gt=last).values_list('appointment_id', flat=True).distinct()[:size]
+            )
+            if not ids:
+                break
+            rows += pack(ids)
+            visits += len(ids)
+            last = ids[-1]
+            self.stdout.write(f'Packed {visits} visits ({rows} rows)')
+
+        self.stdout.write(self.style.SUCCESS(f'Packed {rows} trace rows of {visits} visits'))
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from appointment_management.geofence import BATCH_SIZE, scan
+from appointment_management.models import Appointment
+from appointment_management.utils import day_bounds
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-measure visit location logs against each client's geofence and flag visits "
+        "started or ended outside it; run nightly"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Last day to scan, YYYY-MM-DD (default: yesterday)')
+        parser.add_argument('--days', type=int, default=1, help='Number of days to scan, ending on --date')
+        parser.add_argument('--all', action='store_true', help='Scan every visit, ignoring --date and --days')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Visits read per batch')
+
+    def handle(self, *args, **options):
+        queryset = Appointment.objects.exclude(status='cancelled')
+        if not options['all']:
+            if options['date']:
+                day = parse_date(options['date'])
+                if day is None:
+                    raise CommandError('--date must be YYYY-MM-DD.')
+            else:
+                day = timezone.localdate() - timedelta(days=1)
+            if options['days'] < 1:
+                raise CommandError('--days must be at least 1.')
+            start, end = day_bounds(day - timedelta(days=options['days'] - 1), days=options['days'])
+            queryset = queryset.filter(start_time__gte=start, start_time__lt=end)
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        summary = scan(queryset, batch_size=options['batch_size'])
+        self.stdout.write(
+            f"Scanned {summary['visits']} visits and {summary['logs']} location logs: "
+            f"{summary['updated_logs']} logs re-measured, {summary['unmeasured_logs']} without a client location"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['flagged']} visits outside their geofence ({summary['changed']} flags changed)"
+        ))
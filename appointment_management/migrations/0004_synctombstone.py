@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment_management', '0003_visitlocationlog'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(choices=[('appointments', 'Appointment'), ('seizures', 'Seizure'), ('incidents', 'Incident'), ('medications', 'Medication'), ('body_maps', 'Body Map'), ('notes', 'Note')], max_length=20)),
+                ('object_id', models.BigIntegerField(help_text='Primary key of the deleted row')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('staff', models.ForeignKey(help_text='Staff member whose device must drop the row', on_delete=django.db.models.deletion.CASCADE, related_name='sync_tombstones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Sync Tombstone',
+                'verbose_name_plural': 'Sync Tombstones',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['staff', 'id'], name='tombstone_staff_id_idx')],
+            },
+        ),
+    ]
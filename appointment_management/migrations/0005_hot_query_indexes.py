@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """
+    AddIndex that builds the index with CREATE INDEX CONCURRENTLY on PostgreSQL,
+    so the appointment tables stay writable while the index is built. Other
+    backends get a plain CREATE INDEX.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            if schema_editor.connection.vendor == 'postgresql':
+                schema_editor.add_index(model, self.index, concurrently=True)
+            else:
+                schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            if schema_editor.connection.vendor == 'postgresql':
+                schema_editor.remove_index(model, self.index, concurrently=True)
+            else:
+                schema_editor.remove_index(model, self.index)
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('appointment_management', '0004_synctombstone'),
+        ('client_management', '0002_client_latitude_client_longitude'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(fields=['assigned_staff', 'start_time'], name='appt_staff_start_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(fields=['assigned_staff', 'status'], name='appt_staff_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(fields=['status', 'start_time'], name='appt_status_start_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(fields=['start_time'], name='appt_start_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('status', 'in_progress')), fields=['assigned_staff', 'start_time'], name='appt_in_progress_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='incident',
+            index=models.Index(fields=['appointment', 'time'], name='incident_appt_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='seizure',
+            index=models.Index(fields=['appointment', 'start_time'], name='seizure_appt_start_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='visitlocationlog',
+            index=models.Index(fields=['appointment', 'timestamp'], name='locationlog_appt_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment_management', '0005_hot_query_indexes'),
+        ('client_management', '0002_client_latitude_client_longitude'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='occurrence_start',
+            field=models.DateTimeField(blank=True, help_text='Scheduled start of the series occurrence this visit replaces', null=True),
+        ),
+        migrations.AlterField(
+            model_name='synctombstone',
+            name='model',
+            field=models.CharField(choices=[('appointments', 'Appointment'), ('seizures', 'Seizure'), ('incidents', 'Incident'), ('medications', 'Medication'), ('body_maps', 'Body Map'), ('notes', 'Note'), ('series', 'Appointment Series')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='AppointmentSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=200)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('frequency', models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=20)),
+                ('interval', models.PositiveSmallIntegerField(default=1, help_text='Repeat every N days, weeks or months')),
+                ('by_weekday', models.JSONField(blank=True, default=list, help_text='Weekdays (0 = Monday) of a weekly series; empty for the weekday of the first visit')),
+                ('start_time', models.DateTimeField(help_text='Start of the first visit')),
+                ('end_time', models.DateTimeField(help_text='End of the first visit; sets the length of every visit')),
+                ('until', models.DateTimeField(blank=True, help_text='No visits start after this time', null=True)),
+                ('count', models.PositiveIntegerField(blank=True, help_text='Total number of visits', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('assigned_staff', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='appointment_series', to=settings.AUTH_USER_MODEL)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='appointment_series', to='client_management.client')),
+            ],
+            options={
+                'verbose_name': 'Appointment Series',
+                'verbose_name_plural': 'Appointment Series',
+            },
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='series',
+            field=models.ForeignKey(blank=True, help_text='Recurring series this visit was materialized from', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='occurrences', to='appointment_management.appointmentseries'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('series', 'occurrence_start'), name='appt_series_occurrence_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentseries',
+            index=models.Index(fields=['assigned_staff', 'start_time'], name='series_staff_start_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment_management', '0006_appointment_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='location_flag',
+            field=models.CharField(blank=True, choices=[('', 'Within geofence'), ('start', 'Started outside geofence'), ('end', 'Ended outside geofence'), ('start_end', 'Started and ended outside geofence')], default='', help_text="Whether the visit's start or end location was outside the client's geofence", max_length=10),
+        ),
+        migrations.AddField(
+            model_name='visitlocationlog',
+            name='within_geofence',
+            field=models.BooleanField(help_text="Whether the location was within the client's geofence (unknown for logs not yet evaluated)", null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment_management', '0007_visit_geofence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='visitlocationlog',
+            name='log_type',
+            field=models.CharField(choices=[('start', 'Start'), ('end', 'End'), ('deviation', 'Deviation'), ('trace', 'Trace')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='visitlocationlog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='When the device recorded the location'),
+        ),
+    ]
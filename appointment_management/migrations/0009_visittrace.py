@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment_management', '0008_visitlocationlog_trace'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitTrace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField(default=bytes)),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('last_latitude', models.FloatField(blank=True, null=True)),
+                ('last_longitude', models.FloatField(blank=True, null=True)),
+                ('last_distance_from_client', models.FloatField(blank=True, null=True)),
+                ('last_within_geofence', models.BooleanField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('appointment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='trace', to='appointment_management.appointment')),
+            ],
+        ),
+    ]
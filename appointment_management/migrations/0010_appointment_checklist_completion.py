@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment_management', '0009_visittrace'),
+        ('client_management', '0003_client_geofence_radius'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='checklist_completed_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of checklist items completed'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='checklist_completion_percentage',
+            field=models.FloatField(default=0.0, editable=False, help_text="Percentage of the client's care checklist completed"),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['checklist_completion_percentage', 'start_time'], name='appt_checklist_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointment_management', '0010_appointment_checklist_completion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointmentseries',
+            name='excluded_starts',
+            field=models.JSONField(blank=True, default=list, help_text='Start times (ISO 8601) of deleted occurrences, which are no longer expanded'),
+        ),
+    ]
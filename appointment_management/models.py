@@ -1,5 +1,8 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+from .codec import Point, decode, encode
 
 # Create your models here.
 
@@ -39,6 +42,36 @@ class Appointment(models.Model):
     )
     
     assigned_staff = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=False, blank=False, related_name='appointments', help_text="Staff member assigned to this appointment")
+
+    # Set when this row is a materialized occurrence of a recurring series
+    series = models.ForeignKey(
+        'AppointmentSeries',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='occurrences',
+        help_text="Recurring series this visit was materialized from"
+    )
+    occurrence_start = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text="Scheduled start of the series occurrence this visit replaces"
+    )
+
+    # Set by appointment_management.geofence from the visit's start/end location logs
+    LOCATION_FLAG_CHOICES = [
+        ('', 'Within geofence'),
+        ('start', 'Started outside geofence'),
+        ('end', 'Ended outside geofence'),
+        ('start_end', 'Started and ended outside geofence'),
+    ]
+    location_flag = models.CharField(
+        max_length=10,
+        choices=LOCATION_FLAG_CHOICES,
+        blank=True,
+        default='',
+        help_text="Whether the visit's start or end location was outside the client's geofence"
+    )
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -46,6 +79,25 @@ class Appointment(models.Model):
     class Meta:
         verbose_name = "Appointment"
         verbose_name_plural = "Appointments"
+        constraints = [
+            # An occurrence is materialized at most once
+            models.UniqueConstraint(fields=['series', 'occurrence_start'], name='appt_series_occurrence_uniq'),
+        ]
+        indexes = [
+            # Staff app lists (today / week / upcoming) and the admin dashboard
+            models.Index(fields=['assigned_staff', 'start_time'], name='appt_staff_start_idx'),
+            models.Index(fields=['assigned_staff', 'status'], name='appt_staff_status_idx'),
+            models.Index(fields=['status', 'start_time'], name='appt_status_start_idx'),
+            models.Index(fields=['start_time'], name='appt_start_idx'),
+            # Visits below a checklist completion threshold
+            models.Index(fields=['checklist_completion_percentage', 'start_time'], name='appt_checklist_idx'),
+            # Only a handful of visits are ever in progress at once
+            models.Index(
+                fields=['assigned_staff', 'start_time'],
+                name='appt_in_progress_idx',
+                condition=models.Q(status='in_progress'),
+            ),
+        ]
 
     VISIT_STATUS_CHOICES = [
         ('scheduled', 'Scheduled'),
@@ -69,6 +121,17 @@ class Appointment(models.Model):
         default=list,
         help_text="List of checklist items from the client's care plan"
     )
+    # Denormalized from checklist_items and the client's care checklist (see appointment_management.checklist)
+    checklist_completed_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Number of checklist items completed"
+    )
+    checklist_completion_percentage = models.FloatField(
+        default=0.0,
+        editable=False,
+        help_text="Percentage of the client's care checklist completed"
+    )
     
     @property
     def duration_minutes(self):
@@ -87,19 +150,75 @@ class Appointment(models.Model):
         """Get the client's care checklist items that can be completed"""
         return self.client.care_checklist if self.client else []
 
-    @property
-    def checklist_completion_percentage(self):
-        """Calculate the percentage of client checklist items completed"""
-        if not self.available_checklist_items:
-            return 0
-        completed_count = len(self.checklist_items)
-        total_count = len(self.available_checklist_items)
-        return (completed_count / total_count) * 100 if total_count > 0 else 0
+    def set_checklist_completion(self, available_count):
+        """Update the stored checklist counters against a care checklist of `available_count` items"""
+        self.checklist_completed_count = len(self.checklist_items or [])
+        self.checklist_completion_percentage = (
+            self.checklist_completed_count * 100.0 / available_count if available_count else 0.0
+        )
 
     def __str__(self):
         return f"{self.title} - {self.client.full_name} - {self.start_time.strftime('%Y-%m-%d %H:%M')}"
 
 
+class AppointmentSeries(models.Model):
+    """
+    A recurring visit, stored once and expanded into occurrences when read
+    (see appointment_management.recurrence).
+
+    The rule is a subset of RFC 5545 RRULE: FREQ (frequency), INTERVAL,
+    BYDAY for weekly series (by_weekday), an optional UNTIL or COUNT, and
+    EXDATE (excluded_starts) for occurrences that were deleted.
+    Occurrences keep the wall-clock time of the first visit across DST changes.
+    """
+    title = models.CharField(max_length=200)
+    description = models.TextField(blank=True, null=True)
+    client = models.ForeignKey(
+        'client_management.Client',
+        on_delete=models.CASCADE,
+        related_name='appointment_series',
+    )
+    assigned_staff = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.PROTECT,
+        related_name='appointment_series',
+    )
+
+    frequency = models.CharField(max_length=20, choices=Appointment.FREQUENCY_CHOICES)
+    interval = models.PositiveSmallIntegerField(default=1, help_text="Repeat every N days, weeks or months")
+    by_weekday = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Weekdays (0 = Monday) of a weekly series; empty for the weekday of the first visit"
+    )
+    start_time = models.DateTimeField(help_text="Start of the first visit")
+    end_time = models.DateTimeField(help_text="End of the first visit; sets the length of every visit")
+    until = models.DateTimeField(blank=True, null=True, help_text="No visits start after this time")
+    count = models.PositiveIntegerField(blank=True, null=True, help_text="Total number of visits")
+    excluded_starts = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Start times (ISO 8601) of deleted occurrences, which are no longer expanded"
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Appointment Series"
+        verbose_name_plural = "Appointment Series"
+        indexes = [
+            models.Index(fields=['assigned_staff', 'start_time'], name='series_staff_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.client.full_name} ({self.get_frequency_display()})"
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time
+
+
 class Seizure(models.Model):
     start_time = models.DateTimeField(help_text="When the seizure started")
     end_time = models.DateTimeField(blank=True, null=True, help_text="When the seizure ended")
@@ -116,6 +235,9 @@ class Seizure(models.Model):
         verbose_name = "Seizure"
         verbose_name_plural = "Seizures"
         ordering = ['-start_time']
+        indexes = [
+            models.Index(fields=['appointment', 'start_time'], name='seizure_appt_start_idx'),
+        ]
 
     @property
     def duration_seconds(self):
@@ -210,6 +332,9 @@ class Incident(models.Model):
         verbose_name = "Incident"
         verbose_name_plural = "Incidents"
         ordering = ['-time']
+        indexes = [
+            models.Index(fields=['appointment', 'time'], name='incident_appt_time_idx'),
+        ]
 
     def __str__(self):
         return f"Incident for {self.appointment.client.full_name} on {self.time.strftime('%Y-%m-%d %H:%M')}"
@@ -546,16 +671,101 @@ class VisitLocationLog(models.Model):
         ('start', 'Start'),
         ('end', 'End'),
         ('deviation', 'Deviation'),
+        ('trace', 'Trace'),
     ]
     appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='location_logs')
     log_type = models.CharField(max_length=10, choices=LOG_TYPE_CHOICES)
     latitude = models.FloatField()
     longitude = models.FloatField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, help_text="When the device recorded the location")
     distance_from_client = models.FloatField(help_text='Distance from client residence in meters')
+    within_geofence = models.BooleanField(
+        null=True,
+        help_text="Whether the location was within the client's geofence (unknown for logs not yet evaluated)"
+    )
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['appointment', 'timestamp'], name='locationlog_appt_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_log_type_display()} log for {self.appointment} at {self.timestamp}"
+
+
+class VisitTrace(models.Model):
+    """
+    The 'trace' location logs of a visit packed into one delta-encoded blob
+    (see appointment_management.codec), used instead of one VisitLocationLog
+    row per point when VISIT_TRACE_STORAGE is 'packed'.
+    """
+    appointment = models.OneToOneField(Appointment, on_delete=models.CASCADE, related_name='trace')
+    data = models.BinaryField(default=bytes)
+    point_count = models.PositiveIntegerField(default=0)
+    # The last point, as stored, so new points can be delta-encoded onto the blob without decoding it
+    last_timestamp = models.DateTimeField(blank=True, null=True)
+    last_latitude = models.FloatField(blank=True, null=True)
+    last_longitude = models.FloatField(blank=True, null=True)
+    last_distance_from_client = models.FloatField(blank=True, null=True)
+    last_within_geofence = models.BooleanField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Trace of {self.appointment_id} ({self.point_count} points)"
+
+    @property
+    def last_point(self):
+        if self.last_timestamp is None:
+            return None
+        return Point(self.last_timestamp, self.last_latitude, self.last_longitude,
+                     self.last_distance_from_client, self.last_within_geofence)
+
+    def points(self):
+        """Decode the trace lazily, yielding codec.Point tuples in time order"""
+        return decode(self.data)
+
+    def append(self, points):
+        """Encode codec.Point tuples, in time order and after the last point, onto the blob"""
+        if not points:
+            return
+        if self.last_point is None:
+            self.data = encode(points)
+        else:
+            self.data = bytes(self.data) + encode(points, previous=self.last_point)
+        self.point_count += len(points)
+        (self.last_timestamp, self.last_latitude, self.last_longitude,
+         self.last_distance_from_client, self.last_within_geofence) = points[-1]
+
+
+class SyncTombstone(models.Model):
+    """Record of a deleted (or reassigned) row, served to the mobile app by the delta sync API"""
+    MODEL_CHOICES = [
+        ('appointments', 'Appointment'),
+        ('seizures', 'Seizure'),
+        ('incidents', 'Incident'),
+        ('medications', 'Medication'),
+        ('body_maps', 'Body Map'),
+        ('notes', 'Note'),
+        ('series', 'Appointment Series'),
+    ]
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField(help_text="Primary key of the deleted row")
+    staff = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='sync_tombstones',
+        help_text="Staff member whose device must drop the row"
+    )
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Sync Tombstone"
+        verbose_name_plural = "Sync Tombstones"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['staff', 'id'], name='tombstone_staff_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_model_display()} {self.object_id} removed for {self.staff} at {self.deleted_at}"
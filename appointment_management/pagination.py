@@ -0,0 +1,179 @@
+"""
+Keyset (cursor) pagination for the staff APIs.
+
+Pages are read with a range condition on the ordering columns - e.g.
+(start_time, id) > (last start_time, last id) - instead of an OFFSET, so a deep
+page costs the same index range scan as the first one and no COUNT(*) is run.
+The cursor is an opaque token holding the ordering values of the row a page
+ends (or, for previous links, starts) at.
+
+Rows that are not in the queryset (recurring series occurrences that have not
+been materialized) can be merged into a page by passing an `extra` provider;
+such rows expose their ordering values as `keyset_<field>` attributes when the
+model field is unset (e.g. keyset_id for unsaved rows).
+"""
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .utils import decode_token, encode_token
+
+
+class KeysetPagination(BasePagination):
+    """
+    Orders by the view's `keyset_ordering` (the last field must be unique,
+    normally 'id' or '-id') and pages with `cursor` / `page_size` parameters.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE or 20
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None, ordering=None, page_size=None, extra=None):
+        """
+        Return the requested page of `queryset`.
+
+        `extra(position, reverse, limit)` may return up to `limit` additional rows
+        past `position` in page order; they are merged with the queryset rows.
+        Merging assumes every ordering field runs in the same direction.
+        """
+        self.request = request
+        self.ordering = tuple(ordering or getattr(view, 'keyset_ordering', self.ordering))
+        self.page_size = self.get_page_size(request, page_size or self.page_size)
+        position, reverse = self.decode_cursor(queryset.model, request)
+
+        queryset = queryset.order_by(*(_flip(field) if reverse else field for field in self.ordering))
+        if position is not None:
+            queryset = queryset.filter(self.after(position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        if extra is not None:
+            rows += extra(position, reverse, self.page_size + 1)
+            descending = self.ordering[0].startswith('-') != reverse
+            rows.sort(key=self.values, reverse=descending)
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_position = self.position(rows[-1]) if has_next and rows else None
+        self.previous_position = self.position(rows[0]) if has_previous and rows else None
+        return rows
+
+    def get_page_size(self, request, default):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return default
+        return max(1, min(size, self.max_page_size))
+
+    def after(self, position, reverse=False):
+        """Condition selecting the rows past `position` in the (possibly reversed) ordering"""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            condition |= equal & Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def values(self, row):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = getattr(row, name)
+            values.append(getattr(row, f'keyset_{name}') if value is None else value)
+        return tuple(values)
+
+    def position(self, row):
+        return [value.isoformat() if isinstance(value, datetime) else value for value in self.values(row)]
+
+    def decode_cursor(self, model, request):
+        """(ordering values, reverse) of the request's cursor, or (None, False) for the first page"""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            state = decode_token(token)
+            values = state['p']
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return position, bool(state.get('r'))
+        except (ValueError, TypeError, KeyError, ValidationError) as exc:
+            raise NotFound(self.invalid_cursor_message) from exc
+
+    def encode_cursor(self, position, reverse=False):
+        state = {'p': position}
+        if reverse:
+            state['r'] = 1
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_token(state))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class KeysetListMixin:
+    """
+    Viewset helpers paginating every list and custom list action by keyset.
+
+    Views set `keyset_ordering`; actions over another model pass their own.
+    """
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-created_at', '-id')
+
+    def keyset_response(self, queryset, serializer_class=None, ordering=None, page_size=None, extra=None):
+        page = self.paginator.paginate_queryset(
+            queryset, self.request, view=self, ordering=ordering, page_size=page_size, extra=extra
+        )
+        if serializer_class is None:
+            serializer = self.get_serializer(page, many=True)
+        else:
+            serializer = serializer_class(page, many=True, context=self.get_serializer_context())
+        return self.paginator.get_paginated_response(serializer.data)
@@ -0,0 +1,33 @@
+import io
+import zlib
+
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.parsers import JSONParser
+
+# Cap on the inflated size of a compressed body, so a small upload cannot expand without bound
+MAX_DECOMPRESSED_BYTES = 16 * 1024 * 1024
+
+
+class CompressedJSONParser(JSONParser):
+    """JSON body, optionally sent with Content-Encoding: gzip or deflate"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get('request')
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower() if request else ''
+        if encoding in ('gzip', 'deflate'):
+            stream = io.BytesIO(self.decompress(stream.read(), encoding))
+        elif encoding not in ('', 'identity'):
+            raise UnsupportedMediaType(media_type, detail=f'Unsupported Content-Encoding "{encoding}".')
+        return super().parse(stream, media_type, parser_context)
+
+    @staticmethod
+    def decompress(data, encoding):
+        # wbits 16+ reads a gzip header, 32+ detects zlib or gzip; raw deflate is not accepted
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding == 'gzip' else 32 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(data, MAX_DECOMPRESSED_BYTES)
+        except zlib.error as exc:
+            raise ParseError(f'Invalid {encoding} body - {exc}')
+        if inflater.unconsumed_tail:
+            raise ParseError(f'Decompressed body is larger than {MAX_DECOMPRESSED_BYTES} bytes.')
+        return body
@@ -0,0 +1,303 @@
+"""
+Recurring appointment series engine.
+
+A series is one AppointmentSeries row, expanded into occurrences only for the
+window being read. Occurrences are unsaved Appointment instances (id None,
+series and occurrence_start set). An occurrence becomes a real Appointment row
+only when it is started, edited or cancelled - see materialize(). Those rows
+are the exceptions of their series: expansion skips every occurrence that has
+one, and the row is listed in its place at its (possibly rescheduled) time.
+Deleting such a row records its occurrence in the series' excluded_starts
+(EXDATE, see exclude_occurrence()), so the occurrence does not come back.
+end_series() and split_series() apply deletions and edits to an occurrence
+and every later one.
+
+Occurrences are ordered by (start_time, keyset_id), where keyset_id is the
+negated series id, so they interleave deterministically with real rows ordered
+by (start_time, id) in the keyset paginated staff lists.
+"""
+import calendar
+import heapq
+from datetime import datetime, timedelta
+from itertools import count, islice
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Appointment, AppointmentSeries
+
+
+def _daily_dates(series, base_date, from_date):
+    step = series.interval
+    n = max(0, (from_date - base_date).days // step) if from_date else 0
+    for k in count(n):
+        yield base_date + timedelta(days=k * step)
+
+
+def _weekly_dates(series, base_date, from_date):
+    weekdays = sorted({int(day) for day in series.by_weekday}) or [base_date.weekday()]
+    first_monday = base_date - timedelta(days=base_date.weekday())
+    step = 7 * series.interval
+    n = max(0, (from_date - first_monday).days // step) if from_date else 0
+    for k in count(n):
+        monday = first_monday + timedelta(days=k * step)
+        for weekday in weekdays:
+            day = monday + timedelta(days=weekday)
+            if day >= base_date:
+                yield day
+
+
+def _monthly_dates(series, base_date, from_date):
+    step = series.interval
+    months = (from_date.year - base_date.year) * 12 + from_date.month - base_date.month if from_date else 0
+    for k in count(max(0, months // step)):
+        year, month = divmod(base_date.month - 1 + k * step, 12)
+        year += base_date.year
+        # Months without the day (e.g. the 31st) are skipped, as RRULE does
+        if base_date.day <= calendar.monthrange(year, month + 1)[1]:
+            yield base_date.replace(year=year, month=month + 1)
+
+
+DATE_GENERATORS = {
+    'daily': _daily_dates,
+    'weekly': _weekly_dates,
+    'monthly': _monthly_dates,
+}
+
+
+def occurrence_starts(series, from_date=None):
+    """
+    Start times of a series in ascending order.
+
+    With from_date (a local date) the expansion jumps to the period containing it
+    instead of walking from the first visit; COUNT-limited series are always
+    walked from the start so the limit is applied correctly. The generator is
+    endless for series without UNTIL or COUNT.
+    """
+    base = timezone.localtime(series.start_time)
+    wall_clock = base.time().replace(tzinfo=None)
+    if series.count:
+        from_date = None
+    dates = DATE_GENERATORS[series.frequency](series, base.date(), from_date)
+    if series.count:
+        dates = islice(dates, series.count)
+    for day in dates:
+        start = timezone.make_aware(datetime.combine(day, wall_clock))
+        if series.until and start > series.until:
+            return
+        yield start
+
+
+def excluded(series):
+    """Start times of the deleted occurrences of a series"""
+    return {parse_datetime(value) for value in series.excluded_starts}
+
+
+def is_occurrence(series, start):
+    """Whether `start` is the start time of one of the series' occurrences"""
+    if start in excluded(series):
+        return False
+    for candidate in occurrence_starts(series, from_date=timezone.localtime(start).date()):
+        if candidate >= start:
+            return candidate == start
+    return False
+
+
+def build_occurrence(series, start):
+    """Unsaved Appointment for the occurrence of a series starting at `start`"""
+    occurrence = Appointment(
+        title=series.title,
+        description=series.description,
+        client_id=series.client_id,
+        assigned_staff_id=series.assigned_staff_id,
+        start_time=start,
+        end_time=start + series.duration,
+        status='scheduled',
+        frequency=series.frequency,
+        series=series,
+        occurrence_start=start,
+    )
+    occurrence.keyset_id = -series.pk
+    return occurrence
+
+
+def expand(series_list, window_start, window_end=None, after=None, reverse=False, limit=None):
+    """
+    Unmaterialized occurrences of the given series starting in [window_start, window_end).
+
+    Returned in (start_time, keyset_id) order, descending when `reverse`. With a
+    keyset position `after` = (start_time, id), only occurrences past it in that
+    order are returned. Reverse expansion needs a window_end or a position.
+    """
+    if not series_list:
+        return []
+    if reverse and window_end is None and after is None:
+        raise ValueError('Reverse expansion needs an upper bound')
+    upper = window_end
+    if after is not None:
+        after = (after[0], after[1])
+        if reverse:
+            bound = after[0] + timedelta(microseconds=1)
+            upper = bound if upper is None else min(upper, bound)
+        else:
+            window_start = max(window_start, after[0])
+
+    materialized = Appointment.objects.filter(series__in=series_list, occurrence_start__gte=window_start)
+    if upper is not None:
+        materialized = materialized.filter(occurrence_start__lt=upper)
+    materialized = set(materialized.values_list('series_id', 'occurrence_start'))
+
+    def keys(series):
+        from_date = timezone.localtime(window_start).date()
+        skipped = excluded(series)
+        for start in occurrence_starts(series, from_date=from_date):
+            if upper is not None and start >= upper:
+                return
+            if start < window_start or (series.pk, start) in materialized or start in skipped:
+                continue
+            key = (start, -series.pk)
+            if after is not None and (key >= after if reverse else key <= after):
+                continue
+            yield key
+
+    series_by_id = {series.pk: series for series in series_list}
+    if reverse:
+        streams = [sorted(keys(series), reverse=True) for series in series_list]
+    else:
+        streams = [keys(series) for series in series_list]
+    merged = heapq.merge(*streams, reverse=reverse)
+    if limit is not None:
+        merged = islice(merged, limit)
+    return [build_occurrence(series_by_id[-series_key], start) for start, series_key in merged]
+
+
+def new_series(appointment, until=None, count=None):
+    """
+    Unsaved series repeating an appointment at its frequency, ending on the
+    local date `until` (inclusive) or after `count` visits.
+    """
+    if until is not None:
+        until = timezone.make_aware(datetime.combine(until + timedelta(days=1), datetime.min.time()))
+        until -= timedelta(microseconds=1)
+    return AppointmentSeries(
+        title=appointment.title,
+        description=appointment.description,
+        client_id=appointment.client_id,
+        assigned_staff_id=appointment.assigned_staff_id,
+        frequency=appointment.frequency,
+        start_time=appointment.start_time,
+        end_time=appointment.end_time,
+        until=until,
+        count=count,
+    )
+
+
+def start_series(appointment, until=None, count=None):
+    """Turn a saved appointment into the first occurrence of a new series (see new_series)"""
+    series = new_series(appointment, until=until, count=count)
+    series.save()
+    appointment.series = series
+    appointment.occurrence_start = appointment.start_time
+    appointment.save(update_fields=['series', 'occurrence_start', 'updated_at'])
+    return series
+
+
+def materialize(series, occurrence_start, **changes):
+    """
+    Return (appointment, created) for an occurrence, creating its row with
+    `changes` applied if it has not been materialized yet.
+
+    Raises ValueError if `occurrence_start` is not an occurrence of the series.
+    """
+    existing = series.occurrences.filter(occurrence_start=occurrence_start).first()
+    if existing is not None:
+        return existing, False
+    if not is_occurrence(series, occurrence_start):
+        raise ValueError('Not an occurrence of this series')
+    appointment = build_occurrence(series, occurrence_start)
+    for field, value in changes.items():
+        setattr(appointment, field, value)
+    try:
+        with transaction.atomic():
+            appointment.save()
+    except IntegrityError:
+        # Materialized concurrently by another request
+        return series.occurrences.get(occurrence_start=occurrence_start), False
+    return appointment, True
+
+
+def exclude_occurrence(series_id, occurrence_start):
+    """Stop expanding an occurrence of a series whose row was deleted (if the series still has it)"""
+    with transaction.atomic():
+        series = AppointmentSeries.objects.select_for_update().filter(pk=series_id).first()
+        if series is None or (series.until and occurrence_start > series.until):
+            return
+        if occurrence_start not in excluded(series):
+            series.excluded_starts = series.excluded_starts + [occurrence_start.isoformat()]
+            series.save(update_fields=['excluded_starts', 'updated_at'])
+
+
+def end_series(series, occurrence_start):
+    """
+    Drop an occurrence of a series and every later one. Their rows are
+    deleted unless the visit was started, and the series ends just before
+    `occurrence_start` - or is deleted, when that was its first visit.
+    Returns the number of rows deleted.
+    """
+    with transaction.atomic():
+        later = list(
+            series.occurrences.filter(occurrence_start__gte=occurrence_start)
+            .exclude(status__in=['in_progress', 'completed']).values_list('pk', flat=True)
+        )
+        if occurrence_start <= series.start_time:
+            series.delete()
+        else:
+            until = occurrence_start - timedelta(microseconds=1)
+            if series.until is None or series.until > until:
+                series.until = until
+                series.save()
+        Appointment.objects.filter(pk__in=later).delete()
+    return len(later)
+
+
+def following_series(appointment):
+    """
+    Unsaved series continuing the series of an edited occurrence from it: the
+    old rule, moved by as much as the visit was, with the visit's details.
+    """
+    old = appointment.series
+    shift = appointment.start_time - appointment.occurrence_start
+    count = None
+    if old.count:
+        done = sum(1 for start in occurrence_starts(old) if start < appointment.occurrence_start)
+        count = max(old.count - done, 1)
+    series = new_series(appointment, count=count)
+    series.frequency = appointment.frequency or old.frequency
+    series.interval = old.interval
+    days = (timezone.localtime(appointment.start_time).date()
+            - timezone.localtime(appointment.occurrence_start).date()).days
+    series.by_weekday = sorted({(day + days) % 7 for day in old.by_weekday})
+    series.until = old.until + shift if old.until else None
+    series.excluded_starts = [
+        (start + shift).isoformat() for start in excluded(old) if start > appointment.occurrence_start
+    ]
+    return series
+
+
+def split_series(appointment):
+    """
+    Apply the edit of an occurrence (already saved) to the later ones too: the
+    occurrence becomes the first visit of a new series (see following_series)
+    and the old series ends before it (see end_series). Returns the new series.
+    """
+    old = appointment.series
+    occurrence_start = appointment.occurrence_start
+    with transaction.atomic():
+        series = following_series(appointment)
+        series.save()
+        appointment.series = series
+        appointment.occurrence_start = appointment.start_time
+        appointment.save(update_fields=['series', 'occurrence_start', 'updated_at'])
+        end_series(old, occurrence_start)
+    return series
@@ -0,0 +1,341 @@
+"""
+Rota optimizer.
+
+Assigns a day's visits to carers so the total distance travelled between
+consecutive visits is as small as possible. Visits keep their scheduled times,
+which act as their time windows. A carer can take a visit when it falls inside
+their shift, does not overlap their other stops, and leaves enough time to
+travel from the previous stop and on to the next one at ROTA_TRAVEL_SPEED_KMH.
+
+The carers' other bookings that day stay where they are but count as stops on
+their routes. These are started or completed visits, visits left out of the
+run, and series occurrences.
+
+The optimizer works in two phases:
+- Construction is greedy in start-time order: each visit goes to the carer
+  with the cheapest feasible insertion, which amounts to nearest neighbour
+  along the time line.
+- Local search then relocates single visits to other carers, and swaps
+  overlapping visits between carers, while that shortens the total distance.
+  It stops when no move helps or the time limit is reached.
+
+Distances come from one haversine matrix, computed up front, over the client
+coordinates (see geo.distance_matrix). Visits of clients without coordinates
+add no distance.
+"""
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from client_management.models import Client
+from .bulk import BulkAppointmentEngine
+from .conflicts import load_bookings
+from .geo import distance_matrix
+from .models import Appointment
+from .utils import day_bounds
+
+User = get_user_model()
+
+DEFAULT_TRAVEL_SPEED_KMH = 30
+DEFAULT_TIME_LIMIT = 5  # seconds of local search
+EPSILON = 1e-6  # metres; smaller gains are rounding noise
+
+
+class Stop:
+    """A timed stop on a route; key is the appointment id of a movable visit, None for fixed stops"""
+    __slots__ = ('key', 'start', 'end', 'location', 'staff_id')
+
+    def __init__(self, key, start, end, location, staff_id=None):
+        self.key = key
+        self.start = start
+        self.end = end
+        self.location = location
+        self.staff_id = staff_id
+
+
+class Carer:
+    """A carer's shift and route, kept sorted by start time"""
+    __slots__ = ('id', 'shift_start', 'shift_end', 'route', 'starts')
+
+    def __init__(self, id, shift_start, shift_end):
+        self.id = id
+        self.shift_start = shift_start
+        self.shift_end = shift_end
+        self.route = []
+        self.starts = []
+
+    def insert(self, position, stop):
+        self.route.insert(position, stop)
+        self.starts.insert(position, stop.start)
+
+    def remove(self, stop):
+        position = bisect_left(self.starts, stop.start)
+        del self.route[position]
+        del self.starts[position]
+        return position
+
+
+class RotaOptimizer:
+    """
+    Optimizes the assignment of `visits` (movable Stops) to `carers`.
+
+    `matrix` holds the distances in metres between location indexes; times are
+    epoch seconds. Fixed stops must already be on the carers' routes.
+    """
+
+    def __init__(self, visits, carers, matrix, speed_kmh=DEFAULT_TRAVEL_SPEED_KMH):
+        self.visits = sorted(visits, key=lambda stop: (stop.start, stop.start - stop.end))
+        self.carers = carers
+        self.matrix = matrix
+        self.speed = speed_kmh / 3.6  # metres per second
+        self.assignment = {}
+
+    def leg(self, a, b):
+        if a is None or b is None or a.location is None or b.location is None:
+            return 0.0
+        return self.matrix[a.location][b.location]
+
+    def _reachable(self, a, b):
+        """Whether b can follow a on a route, travel included"""
+        return a.end + self.leg(a, b) / self.speed <= b.start
+
+    def insertion(self, carer, stop):
+        """(added distance, position) of the cheapest feasible insertion of stop, or None"""
+        if stop.start < carer.shift_start or stop.end > carer.shift_end:
+            return None
+        position = bisect_left(carer.starts, stop.start)
+        prev = carer.route[position - 1] if position else None
+        nxt = carer.route[position] if position < len(carer.route) else None
+        if prev is not None and not self._reachable(prev, stop):
+            return None
+        if nxt is not None and not self._reachable(stop, nxt):
+            return None
+        return self.leg(prev, stop) + self.leg(stop, nxt) - self.leg(prev, nxt), position
+
+    def removal_gain(self, carer, stop):
+        position = bisect_left(carer.starts, stop.start)
+        prev = carer.route[position - 1] if position else None
+        nxt = carer.route[position + 1] if position + 1 < len(carer.route) else None
+        return self.leg(prev, stop) + self.leg(stop, nxt) - self.leg(prev, nxt)
+
+    def route_distance(self, carer):
+        return sum(self.leg(a, b) for a, b in zip(carer.route, carer.route[1:]))
+
+    def total_distance(self):
+        return sum(self.route_distance(carer) for carer in self.carers)
+
+    def _assign(self, carer, stop, position):
+        carer.insert(position, stop)
+        self.assignment[stop.key] = carer
+
+    def construct(self):
+        """Greedy cheapest insertion in start-time order"""
+        for stop in self.visits:
+            best = None
+            for carer in self.carers:
+                option = self.insertion(carer, stop)
+                if option is not None and (best is None or option[0] < best[0]):
+                    best = (option[0], option[1], carer)
+            if best is not None:
+                self._assign(best[2], stop, best[1])
+
+    def _relocate(self, stop, carer):
+        gain = self.removal_gain(carer, stop)
+        if gain <= EPSILON:
+            return False
+        best = None
+        for other in self.carers:
+            if other is carer:
+                continue
+            option = self.insertion(other, stop)
+            if option is not None and option[0] < gain - EPSILON and (best is None or option[0] < best[0]):
+                best = (option[0], option[1], other)
+        if best is None:
+            return False
+        carer.remove(stop)
+        self._assign(best[2], stop, best[1])
+        return True
+
+    def _swap(self, stop, carer):
+        """Exchange stop with a movable stop of another carer that overlaps it"""
+        for other in self.carers:
+            if other is carer:
+                continue
+            i = bisect_left(other.starts, stop.end) - 1
+            while i >= 0 and other.route[i].end > stop.start:
+                candidate = other.route[i]
+                i -= 1
+                if candidate.key is None:
+                    continue
+                gain = self.removal_gain(carer, stop) + self.removal_gain(other, candidate)
+                stop_position = carer.remove(stop)
+                candidate_position = other.remove(candidate)
+                into_other = self.insertion(other, stop)
+                into_carer = self.insertion(carer, candidate)
+                if (into_other is not None and into_carer is not None
+                        and into_other[0] + into_carer[0] < gain - EPSILON):
+                    self._assign(other, stop, into_other[1])
+                    self._assign(carer, candidate, into_carer[1])
+                    return True
+                carer.insert(stop_position, stop)
+                other.insert(candidate_position, candidate)
+        return False
+
+    def improve(self, deadline):
+        """Relocate and swap moves until none shortens the routes or the deadline passes"""
+        improved = True
+        while improved and time.monotonic() < deadline:
+            improved = False
+            for stop in self.visits:
+                if time.monotonic() >= deadline:
+                    break
+                carer = self.assignment.get(stop.key)
+                if carer is None:
+                    continue
+                if self._relocate(stop, carer) or self._swap(stop, carer):
+                    improved = True
+
+    def run(self, time_limit=DEFAULT_TIME_LIMIT):
+        self.construct()
+        self.improve(time.monotonic() + time_limit)
+        return self.assignment
+
+
+def _parse_clock(value, day_start):
+    try:
+        hours, minutes = (int(part) for part in str(value).split(':'))
+    except ValueError:
+        raise ValueError(f'Invalid shift time {value!r}, expected HH:MM')
+    if not (0 <= hours <= 24 and 0 <= minutes < 60):
+        raise ValueError(f'Invalid shift time {value!r}, expected HH:MM')
+    return day_start + hours * 3600 + minutes * 60
+
+
+def optimize_day(day, carer_ids=None, visit_ids=None, shifts=None, time_limit=DEFAULT_TIME_LIMIT):
+    """
+    Plan the assignment of a day's visits.
+
+    Movable visits are the day's scheduled, not yet started appointments
+    (optionally only `visit_ids`); carers are the active staff members
+    (optionally only `carer_ids`). Given `carer_ids` but no `visit_ids`, only
+    those carers' own visits move, so other carers' visits are never pulled
+    onto them. `shifts` maps carer ids to ('HH:MM', 'HH:MM') working hours;
+    carers without one are available all day.
+    """
+    started = time.monotonic()
+    window_start, window_end = day_bounds(day)
+    day_start, day_end = window_start.timestamp(), window_end.timestamp()
+    shifts = shifts or {}
+    for start, end in shifts.values():
+        if _parse_clock(start, 0) >= _parse_clock(end, 0):
+            raise ValueError(f'Shift {start}-{end} ends before it starts')
+
+    staff = User.objects.filter(is_active=True, is_staff_member=True)
+    selected = bool(carer_ids)
+    if selected:
+        staff = staff.filter(pk__in=carer_ids)
+    carer_ids = list(staff.order_by('pk').values_list('pk', flat=True))
+
+    visits = Appointment.objects.filter(
+        start_time__gte=window_start, start_time__lt=window_end,
+        status='scheduled', actual_start_time__isnull=True,
+    )
+    if visit_ids:
+        visits = visits.filter(pk__in=visit_ids)
+    elif selected:
+        visits = visits.filter(assigned_staff_id__in=carer_ids)
+    visits = list(visits.values_list('pk', 'start_time', 'end_time', 'client_id', 'assigned_staff_id'))
+    moving = {pk for pk, *_ in visits}
+    fixed = [
+        booking for booking in load_bookings(carer_ids, window_start, window_end, exclude_ids=moving)
+        if booking.pk not in moving
+    ] if carer_ids else []
+
+    client_ids = {row[3] for row in visits} | {booking.client_id for booking in fixed}
+    coordinates = {
+        pk: (lat, lon)
+        for pk, lat, lon in Client.objects.filter(pk__in=client_ids).values_list('pk', 'latitude', 'longitude')
+        if lat is not None and lon is not None
+    }
+    points = sorted(set(coordinates.values()))
+    location = {point: n for n, point in enumerate(points)}
+    matrix = distance_matrix(points)
+
+    def locate(client_id):
+        point = coordinates.get(client_id)
+        return None if point is None else location[point]
+
+    carers = []
+    for carer_id in carer_ids:
+        shift = shifts.get(carer_id)
+        if shift:
+            carers.append(Carer(carer_id, _parse_clock(shift[0], day_start), _parse_clock(shift[1], day_start)))
+        else:
+            carers.append(Carer(carer_id, day_start, day_end))
+    by_id = {carer.id: carer for carer in carers}
+    for booking in sorted(fixed, key=lambda booking: booking.start_time):
+        carer = by_id[booking.assigned_staff_id]
+        stop = Stop(None, booking.start_time.timestamp(), booking.end_time.timestamp(), locate(booking.client_id))
+        position = bisect_left(carer.starts, stop.start)
+        carer.insert(position, stop)
+
+    stops = [
+        Stop(pk, start.timestamp(), end.timestamp(), locate(client_id), staff_id)
+        for pk, start, end, client_id, staff_id in visits
+    ]
+    speed = getattr(settings, 'ROTA_TRAVEL_SPEED_KMH', DEFAULT_TRAVEL_SPEED_KMH)
+    optimizer = RotaOptimizer(stops, carers, matrix, speed_kmh=speed)
+    distance_before = _current_distance(optimizer, stops, fixed, locate)
+    assignment = optimizer.run(time_limit=time_limit)
+
+    changes = []
+    unassigned = []
+    for stop in optimizer.visits:
+        carer = assignment.get(stop.key)
+        if carer is None:
+            unassigned.append(stop.key)
+        elif carer.id != stop.staff_id:
+            changes.append({'appointment': stop.key, 'assigned_staff': carer.id, 'previous_staff': stop.staff_id})
+
+    return {
+        'date': day.isoformat(),
+        'visits': len(stops),
+        'carers': len(carers),
+        'assignments': changes,
+        'unassigned': unassigned,
+        'distance_before_m': round(distance_before),
+        'distance_after_m': round(optimizer.total_distance()),
+        'routes': [
+            {'carer': carer.id, 'visits': sum(1 for stop in carer.route if stop.key is not None),
+             'distance_m': round(optimizer.route_distance(carer))}
+            for carer in carers if any(stop.key is not None for stop in carer.route)
+        ],
+        'elapsed_ms': round((time.monotonic() - started) * 1000),
+    }
+
+
+def _current_distance(optimizer, stops, fixed, locate):
+    """Total travel of the assignment as it stands, for comparison"""
+    routes = defaultdict(list)
+    for stop in stops:
+        routes[stop.staff_id].append(stop)
+    for booking in fixed:
+        routes[booking.assigned_staff_id].append(
+            Stop(None, booking.start_time.timestamp(), booking.end_time.timestamp(), locate(booking.client_id))
+        )
+    total = 0.0
+    for route in routes.values():
+        route.sort(key=lambda stop: stop.start)
+        total += sum(optimizer.leg(a, b) for a, b in zip(route, route[1:]))
+    return total
+
+
+def apply_plan(plan, user=None):
+    """Write a plan's reassignments through the bulk engine; user None runs with admin rights"""
+    items = [{'id': change['appointment'], 'assigned_staff': change['assigned_staff']} for change in plan['assignments']]
+    if not items:
+        return {'operation': 'reassign', 'applied': 0, 'failed': 0, 'results': []}
+    return BulkAppointmentEngine(user, 'reassign', items, atomic=True).run()
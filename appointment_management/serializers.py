@@ -1,29 +1,148 @@
 from rest_framework import serializers
-from .models import Appointment, Seizure, Incident, Medication, BodyMap, VisitLocationLog
+from .models import Appointment, AppointmentSeries, Seizure, Incident, Medication, BodyMap, VisitLocationLog
 from client_management.models import Client
 from client_management.serializers import ClientSerializer
 
+from reference_cache.fields import ClientReferenceField, ReferenceListSerializer, StaffReferenceField
 from visit_notes.serializers import NoteSerializer
+from .conflicts import find_conflicts
 
+
+class ConflictingAppointmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Appointment
+        fields = ['id', 'title', 'start_time', 'end_time', 'series', 'occurrence_start']
+
+
+class ConflictSerializer(serializers.Serializer):
+    """A conflicts.Conflict: the batch position and times of a proposal and what it overlaps"""
+    index = serializers.IntegerField()
+    start_time = serializers.DateTimeField(source='proposal.start_time')
+    end_time = serializers.DateTimeField(source='proposal.end_time')
+    conflicts_with = ConflictingAppointmentSerializer(source='other')
+    conflicts_with_index = serializers.IntegerField(source='other_index', allow_null=True)
+
+
+class ProposedVisitSerializer(serializers.Serializer):
+    """A slot to check for double-bookings; id (or series + occurrence_start) names the visit it would replace"""
+    id = serializers.IntegerField(required=False)
+    start_time = serializers.DateTimeField()
+    end_time = serializers.DateTimeField()
+    series = serializers.IntegerField(required=False)
+    occurrence_start = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if data['end_time'] <= data['start_time']:
+            raise serializers.ValidationError("End time must be after start time.")
+        return data
+
+
+# Bulk appointment API items. Related rows are given by id and resolved for the
+# whole batch by appointment_management.bulk, not looked up per item.
+class BulkTimesMixin:
+    def validate(self, data):
+        if data['end_time'] <= data['start_time']:
+            raise serializers.ValidationError("End time must be after start time.")
+        return data
+
+
+class BulkCreateItemSerializer(BulkTimesMixin, serializers.Serializer):
+    title = serializers.CharField(max_length=200)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    client = serializers.IntegerField()
+    assigned_staff = serializers.IntegerField(required=False)
+    start_time = serializers.DateTimeField()
+    end_time = serializers.DateTimeField()
+    frequency = serializers.ChoiceField(choices=Appointment.FREQUENCY_CHOICES, required=False, allow_null=True)
+    checklist_items = serializers.ListField(child=serializers.CharField(), required=False)
+
+
+class BulkRescheduleItemSerializer(BulkTimesMixin, serializers.Serializer):
+    id = serializers.IntegerField()
+    start_time = serializers.DateTimeField()
+    end_time = serializers.DateTimeField()
+
+
+class BulkReassignItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    assigned_staff = serializers.IntegerField()
+
+
+class BulkCancelItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+
+
+def conflict_error(conflicts):
+    return serializers.ValidationError({
+        'conflicts': ConflictSerializer(conflicts, many=True).data,
+        'non_field_errors': ['This staff member already has an appointment during this time.'],
+    })
+
+
+class AppointmentListSerializer(ReferenceListSerializer):
+    """Checks a whole batch of appointments for double-bookings in one pass"""
+
+    def validate(self, attrs):
+        instances = self.instance if isinstance(self.instance, list) else [None] * len(attrs)
+        proposals = [self.child.proposal(item, instance) for item, instance in zip(attrs, instances)]
+        conflicts = find_conflicts(proposals)
+        if conflicts:
+            raise conflict_error(conflicts)
+        return attrs
+
+
+# Client and staff details come from the reference cache, so list querysets
+# do not need to join the client and user tables.
 class AppointmentSerializer(serializers.ModelSerializer):
-    client_name = serializers.ReadOnlyField(source='client.full_name')
-    client_location = serializers.ReadOnlyField(source='client.full_address')
-    assigned_staff_name = serializers.ReadOnlyField(source='assigned_staff.user.username')
+    client_name = ClientReferenceField('full_name')
+    client_location = ClientReferenceField('address')
+    assigned_staff_name = StaffReferenceField('username')
     duration_minutes = serializers.ReadOnlyField()
-    available_checklist_items = serializers.ReadOnlyField()
-    checklist_completion_percentage = serializers.ReadOnlyField()
+    available_checklist_items = ClientReferenceField('care_checklist')
     
     class Meta:
         model = Appointment
+        list_serializer_class = AppointmentListSerializer
         fields = [
             'id', 'title', 'description', 'start_time', 'end_time', 'status',
             'client', 'client_name', 'client_location', 'frequency', 'assigned_staff', 'assigned_staff_name',
             'actual_start_time', 'actual_end_time', 'checklist_items',
             'duration_minutes', 'available_checklist_items', 'checklist_completion_percentage',
-            'created_at', 'updated_at'
+            'series', 'occurrence_start', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
-    
+        read_only_fields = ['id', 'series', 'occurrence_start', 'created_at', 'updated_at']
+
+    def proposal(self, attrs, instance=None):
+        """Unsaved Appointment with the validated values applied over `instance`, for conflict checks"""
+        def value(field, default=None):
+            return attrs[field] if field in attrs else getattr(instance, field, default)
+        return Appointment(
+            pk=getattr(instance, 'pk', None),
+            title=value('title'),
+            assigned_staff_id=attrs['assigned_staff'].pk if 'assigned_staff' in attrs else getattr(instance, 'assigned_staff_id', None),
+            start_time=value('start_time'),
+            end_time=value('end_time'),
+            status=value('status') or 'scheduled',
+            series_id=getattr(instance, 'series_id', None),
+            occurrence_start=getattr(instance, 'occurrence_start', None),
+        )
+
+    @staticmethod
+    def schedule_changed(attrs, instance):
+        if 'assigned_staff' in attrs and attrs['assigned_staff'].pk != instance.assigned_staff_id:
+            return True
+        return any(field in attrs and attrs[field] != getattr(instance, field) for field in ('start_time', 'end_time'))
+
+    def validate(self, attrs):
+        # Batches are checked together by AppointmentListSerializer
+        if isinstance(self.parent, serializers.ListSerializer):
+            return attrs
+        if self.instance is None or self.schedule_changed(attrs, self.instance):
+            conflicts = find_conflicts([self.proposal(attrs, self.instance)])
+            if conflicts:
+                raise conflict_error(conflicts)
+        return attrs
+
     def create(self, validated_data):
         client_id = validated_data.pop('client_id')
         try:
@@ -42,13 +161,46 @@ class AppointmentSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class AppointmentSeriesSerializer(serializers.ModelSerializer):
+    client_name = ClientReferenceField('full_name')
+    assigned_staff_name = StaffReferenceField('username')
+    frequency_display = serializers.ReadOnlyField(source='get_frequency_display')
+
+    class Meta:
+        model = AppointmentSeries
+        list_serializer_class = ReferenceListSerializer
+        fields = [
+            'id', 'title', 'description', 'client', 'client_name', 'assigned_staff', 'assigned_staff_name',
+            'frequency', 'frequency_display', 'interval', 'by_weekday', 'start_time', 'end_time',
+            'until', 'count', 'excluded_starts', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['id', 'excluded_starts', 'created_at', 'updated_at']
+
+    def validate_by_weekday(self, value):
+        if not isinstance(value, list) or any(not isinstance(day, int) or not 0 <= day <= 6 for day in value):
+            raise serializers.ValidationError("Weekdays must be a list of numbers from 0 (Monday) to 6 (Sunday).")
+        return value
+
+    def validate(self, data):
+        start_time = data.get('start_time')
+        end_time = data.get('end_time')
+        if start_time and end_time and start_time >= end_time:
+            raise serializers.ValidationError("End time must be after start time.")
+        if data.get('until') and data.get('count'):
+            raise serializers.ValidationError("A series ends either on a date or after a number of visits, not both.")
+        if data.get('interval') == 0:
+            raise serializers.ValidationError("Interval must be at least 1.")
+        return data
+
+
 class SeizureSerializer(serializers.ModelSerializer):
     appointment_title = serializers.ReadOnlyField(source='appointment.title')
-    client_name = serializers.ReadOnlyField(source='appointment.client.full_name')
+    client_name = ClientReferenceField('full_name', id_path='appointment.client_id')
     duration_seconds = serializers.ReadOnlyField()
     
     class Meta:
         model = Seizure
+        list_serializer_class = ReferenceListSerializer
         fields = [
             'id', 'appointment', 'appointment_title', 'client_name',
             'start_time', 'end_time', 'duration_seconds',
@@ -68,11 +220,12 @@ class SeizureSerializer(serializers.ModelSerializer):
 
 class IncidentSerializer(serializers.ModelSerializer):
     appointment_title = serializers.ReadOnlyField(source='appointment.title')
-    client_name = serializers.ReadOnlyField(source='appointment.client.full_name')
+    client_name = ClientReferenceField('full_name', id_path='appointment.client_id')
     person_injured_display = serializers.ReadOnlyField(source='get_person_injured_display')
     
     class Meta:
         model = Incident
+        list_serializer_class = ReferenceListSerializer
         fields = [
             'id', 'appointment', 'appointment_title', 'client_name',
             'time', 'persons_involved', 'addresses_of_persons_involved',
@@ -104,13 +257,14 @@ class IncidentSerializer(serializers.ModelSerializer):
 
 class MedicationSerializer(serializers.ModelSerializer):
     appointment_title = serializers.ReadOnlyField(source='appointment.title')
-    client_name = serializers.ReadOnlyField(source='appointment.client.full_name')
+    client_name = ClientReferenceField('full_name', id_path='appointment.client_id')
     frequency_display = serializers.ReadOnlyField(source='get_frequency_display')
     route_display = serializers.ReadOnlyField(source='get_route_display')
     total_daily_dose = serializers.ReadOnlyField()
     
     class Meta:
         model = Medication
+        list_serializer_class = ReferenceListSerializer
         fields = [
             'id', 'appointment', 'appointment_title', 'client_name',
             'name', 'strength', 'dose', 'frequency', 'frequency_display',
@@ -131,14 +285,15 @@ class MedicationSerializer(serializers.ModelSerializer):
 
 class BodyMapSerializer(serializers.ModelSerializer):
     appointment_title = serializers.ReadOnlyField(source='appointment.title')
-    client_name = serializers.ReadOnlyField(source='appointment.client.full_name')
-    practitioner_name = serializers.ReadOnlyField(source='practitioner.user.username')
+    client_name = ClientReferenceField('full_name', id_path='appointment.client_id')
+    practitioner_name = StaffReferenceField('username', id_path='practitioner_id')
     consent_type_display = serializers.ReadOnlyField(source='get_consent_type_display')
     injury_count = serializers.ReadOnlyField()
     has_serious_injuries = serializers.ReadOnlyField()
     
     class Meta:
         model = BodyMap
+        list_serializer_class = ReferenceListSerializer
         fields = [
             'id', 'appointment', 'appointment_title', 'client_name',
             'date_recorded', 'practitioner', 'practitioner_name',
@@ -187,5 +342,36 @@ class VisitLocationLogSerializer(serializers.ModelSerializer):
     log_type_display = serializers.CharField(source='get_log_type_display', read_only=True)
     class Meta:
         model = VisitLocationLog
-        fields = ['id', 'appointment', 'log_type', 'log_type_display', 'latitude', 'longitude', 'timestamp', 'distance_from_client']
-        read_only_fields = ['id', 'timestamp', 'distance_from_client', 'log_type_display']
+        fields = ['id', 'appointment', 'log_type', 'log_type_display', 'latitude', 'longitude', 'timestamp', 'distance_from_client', 'within_geofence']
+        read_only_fields = ['id', 'timestamp', 'distance_from_client', 'within_geofence', 'log_type_display']
+
+
+# Mobile sync variants - the sync engine resolves appointments (and the body map
+# practitioner) for the whole batch itself, so these fields are not looked up per item.
+class AppointmentSyncSerializer(AppointmentSerializer):
+    class Meta(AppointmentSerializer.Meta):
+        read_only_fields = AppointmentSerializer.Meta.read_only_fields + ['client', 'assigned_staff']
+
+    def validate(self, attrs):
+        # Double-bookings are checked for the whole batch by sync.MobileSyncEngine
+        return attrs
+
+
+class SeizureSyncSerializer(SeizureSerializer):
+    class Meta(SeizureSerializer.Meta):
+        read_only_fields = SeizureSerializer.Meta.read_only_fields + ['appointment']
+
+
+class IncidentSyncSerializer(IncidentSerializer):
+    class Meta(IncidentSerializer.Meta):
+        read_only_fields = IncidentSerializer.Meta.read_only_fields + ['appointment']
+
+
+class MedicationSyncSerializer(MedicationSerializer):
+    class Meta(MedicationSerializer.Meta):
+        read_only_fields = MedicationSerializer.Meta.read_only_fields + ['appointment']
+
+
+class BodyMapSyncSerializer(BodyMapSerializer):
+    class Meta(BodyMapSerializer.Meta):
+        read_only_fields = BodyMapSerializer.Meta.read_only_fields + ['appointment', 'practitioner']
@@ -0,0 +1,143 @@
+"""
+Cache invalidation, sync bookkeeping and checklist counter hooks for appointment data.
+
+Bulk queryset operations (update(), bulk_create()) do not send these signals;
+callers using them are responsible for invalidating the affected caches.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from client_management.models import Client
+from visit_notes.models import Note
+from .checklist import refresh_client, set_completion
+from .dashboard import invalidate_staff_dashboard
+from .models import Appointment, AppointmentSeries, Seizure, Incident, Medication, BodyMap, SyncTombstone
+from .recurrence import exclude_occurrence
+
+User = get_user_model()
+
+# model -> sync key used by the delta sync API
+TOMBSTONE_KEYS = {
+    Appointment: 'appointments',
+    AppointmentSeries: 'series',
+    Seizure: 'seizures',
+    Incident: 'incidents',
+    Medication: 'medications',
+    BodyMap: 'body_maps',
+    Note: 'notes',
+}
+
+
+def _appointment_staff_id(instance):
+    try:
+        return instance.appointment.assigned_staff_id
+    except Appointment.DoesNotExist:
+        return None
+
+
+def _cascaded(sender, origin):
+    """Whether a row is being removed by the cascade of another model's deletion"""
+    if origin is None:
+        return False
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model is not sender
+
+
+@receiver(post_init, sender=Appointment)
+def remember_assigned_staff(sender, instance, **kwargs):
+    """Keep the staff member an appointment was loaded with, so reassignment is noticed on save"""
+    # Read from __dict__ so deferred loading of assigned_staff_id is never triggered
+    instance._loaded_assigned_staff_id = instance.__dict__.get('assigned_staff_id')
+
+
+@receiver(pre_save, sender=Appointment)
+def count_checklist(sender, instance, update_fields=None, **kwargs):
+    """Keep the stored checklist counters in step on full saves"""
+    if update_fields is None:
+        set_completion([instance])
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, created, **kwargs):
+    previous_staff_id = getattr(instance, '_loaded_assigned_staff_id', None)
+    invalidate_staff_dashboard(instance.assigned_staff_id, previous_staff_id)
+    if not created and previous_staff_id and previous_staff_id != instance.assigned_staff_id:
+        # The previous assignee's device must drop the visit
+        SyncTombstone.objects.create(model='appointments', object_id=instance.pk, staff_id=previous_staff_id)
+    instance._loaded_assigned_staff_id = instance.assigned_staff_id
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, origin=None, **kwargs):
+    invalidate_staff_dashboard(instance.assigned_staff_id)
+    SyncTombstone.objects.create(model='appointments', object_id=instance.pk, staff_id=instance.assigned_staff_id)
+    # A deleted occurrence must not be expanded from its series again
+    if instance.series_id and instance.occurrence_start and not _cascaded(sender, origin):
+        exclude_occurrence(instance.series_id, instance.occurrence_start)
+
+
+@receiver(post_init, sender=Client)
+def remember_checklist_size(sender, instance, **kwargs):
+    checklist = instance.__dict__.get('care_checklist')
+    instance._loaded_checklist_size = None if checklist is None else len(checklist)
+
+
+@receiver(post_save, sender=Client)
+def client_checklist_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Recompute the completion of the client's visits when the length of its care checklist changes"""
+    size = len(instance.care_checklist or [])
+    written = update_fields is None or 'care_checklist' in update_fields
+    if not created and written and size != instance._loaded_checklist_size:
+        refresh_client(instance)
+    instance._loaded_checklist_size = size
+
+
+@receiver(post_init, sender=AppointmentSeries)
+def remember_series_staff(sender, instance, **kwargs):
+    instance._loaded_assigned_staff_id = instance.__dict__.get('assigned_staff_id')
+
+
+@receiver(post_save, sender=AppointmentSeries)
+def series_saved(sender, instance, created, **kwargs):
+    previous_staff_id = getattr(instance, '_loaded_assigned_staff_id', None)
+    invalidate_staff_dashboard(instance.assigned_staff_id, previous_staff_id)
+    if not created and previous_staff_id and previous_staff_id != instance.assigned_staff_id:
+        SyncTombstone.objects.create(model='series', object_id=instance.pk, staff_id=previous_staff_id)
+    instance._loaded_assigned_staff_id = instance.assigned_staff_id
+
+
+@receiver(post_delete, sender=AppointmentSeries)
+def series_deleted(sender, instance, **kwargs):
+    invalidate_staff_dashboard(instance.assigned_staff_id)
+    SyncTombstone.objects.create(model='series', object_id=instance.pk, staff_id=instance.assigned_staff_id)
+
+
+@receiver(post_save, sender=Incident)
+@receiver(post_save, sender=Seizure)
+def visit_record_saved(sender, instance, **kwargs):
+    invalidate_staff_dashboard(_appointment_staff_id(instance))
+
+
+@receiver(post_delete, sender=Seizure)
+@receiver(post_delete, sender=Incident)
+@receiver(post_delete, sender=Medication)
+@receiver(post_delete, sender=BodyMap)
+@receiver(post_delete, sender=Note)
+def visit_record_deleted(sender, instance, origin=None, **kwargs):
+    # Cascades start at (or above) the appointment, whose tombstone and dashboard
+    # invalidation already cover its records
+    if _cascaded(sender, origin):
+        return
+    staff_id = _appointment_staff_id(instance)
+    if staff_id is None:
+        return
+    if sender in (Seizure, Incident):
+        invalidate_staff_dashboard(staff_id)
+    SyncTombstone.objects.create(model=TOMBSTONE_KEYS[sender], object_id=instance.pk, staff_id=staff_id)
+
+
+@receiver(post_save, sender=User)
+def staff_profile_changed(sender, instance, **kwargs):
+    invalidate_staff_dashboard(instance.pk)
@@ -0,0 +1,177 @@
+"""
+Mobile sync engine.
+
+Applies a batch of offline records uploaded by the mobile app. Every appointment
+referenced anywhere in the batch is loaded with one query, ownership is checked
+against that in-memory map, rescheduled appointments are checked for
+double-bookings together (see conflicts.find_conflicts), and the records are
+written with one bulk_update / bulk_create per model inside a single
+transaction.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from search import index as search_index
+from .checklist import set_completion
+from .conflicts import find_conflicts
+from .dashboard import invalidate_staff_dashboard
+from .models import Appointment, BodyMap, Incident, Medication, Seizure
+from .serializers import (
+    AppointmentSyncSerializer, SeizureSyncSerializer, IncidentSyncSerializer,
+    MedicationSyncSerializer, BodyMapSyncSerializer, conflict_error
+)
+
+# (payload key, result key, error label, model, serializer) for each created record type
+CHILD_RECORD_TYPES = [
+    ('seizures', 'seizures_created', 'Seizure', Seizure, SeizureSyncSerializer),
+    ('incidents', 'incidents_created', 'Incident', Incident, IncidentSyncSerializer),
+    ('medications', 'medications_created', 'Medication', Medication, MedicationSyncSerializer),
+    ('body_maps', 'body_maps_created', 'Body map', BodyMap, BodyMapSyncSerializer),
+]
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MobileSyncEngine:
+    """Validate and persist one sync batch for a staff member"""
+
+    def __init__(self, user, sync_data):
+        self.user = user
+        self.sync_data = sync_data
+        self.results = {
+            'appointments_updated': 0,
+            'seizures_created': 0,
+            'incidents_created': 0,
+            'medications_created': 0,
+            'body_maps_created': 0,
+            'errors': []
+        }
+        self.appointments = {}
+
+    def _items(self, key):
+        items = self.sync_data.get(key) or []
+        return items if isinstance(items, list) else []
+
+    def _load_appointments(self):
+        """Fetch every appointment referenced by the batch in one query"""
+        ids = {_as_id(item.get('id')) for item in self._items('appointments') if isinstance(item, dict)}
+        for key, *_ in CHILD_RECORD_TYPES:
+            ids.update(_as_id(item.get('appointment')) for item in self._items(key) if isinstance(item, dict))
+        ids.discard(None)
+        if ids:
+            self.appointments = Appointment.objects.in_bulk(ids)
+
+    def _owned_appointment(self, appointment_id):
+        """Return (appointment, error) for an id taken from the payload"""
+        appointment = self.appointments.get(_as_id(appointment_id))
+        if appointment is None:
+            return None, 'Not found'
+        if appointment.assigned_staff_id != self.user.id:
+            return None, 'Appointment not assigned to user'
+        return appointment, None
+
+    def _drop_conflicts(self, pending):
+        """Drop the updates that would double-book the user, checking every rescheduled appointment at once"""
+        moved = [
+            (appointment_id, serializer) for appointment_id, serializer in pending
+            if serializer.schedule_changed(serializer.validated_data, serializer.instance)
+        ]
+        if not moved:
+            return pending
+        failed = defaultdict(list)
+        proposals = [serializer.proposal(serializer.validated_data, serializer.instance) for _, serializer in moved]
+        for conflict in find_conflicts(proposals):
+            # Clashes with an update that is not written anyway do not count
+            if conflict.other_index is not None and conflict.other_index in failed:
+                continue
+            failed[conflict.index].append(conflict)
+        for position, conflicts in failed.items():
+            self.results['errors'].append(f"Appointment {moved[position][0]}: {conflict_error(conflicts).detail}")
+        rejected = {moved[position][1].instance.pk for position in failed}
+        return [entry for entry in pending if entry[1].instance.pk not in rejected]
+
+    def _prepare_appointment_updates(self):
+        pending = []
+        for appointment_data in self._items('appointments'):
+            appointment_id = appointment_data.get('id') if isinstance(appointment_data, dict) else None
+            appointment, error = self._owned_appointment(appointment_id)
+            if error:
+                # Appointments the user does not own are reported as missing, as before
+                self.results['errors'].append(f"Appointment {appointment_id}: Not found")
+                continue
+            serializer = AppointmentSyncSerializer(appointment, data=appointment_data, partial=True)
+            if not serializer.is_valid():
+                self.results['errors'].append(f"Appointment {appointment_id}: {serializer.errors}")
+                continue
+            pending.append((appointment_id, serializer))
+
+        updated = []
+        fields = set()
+        now = timezone.now()
+        for _, serializer in self._drop_conflicts(pending):
+            appointment = serializer.instance
+            for field, value in serializer.validated_data.items():
+                setattr(appointment, field, value)
+                fields.add(field)
+            # bulk_update does not touch auto_now fields
+            appointment.updated_at = now
+            updated.append(appointment)
+        if 'checklist_items' in fields:
+            set_completion(updated)
+            fields |= {'checklist_completed_count', 'checklist_completion_percentage'}
+        return updated, fields | {'updated_at'}
+
+    def _prepare_children(self, key, label, model, serializer_class):
+        instances = []
+        for item in self._items(key):
+            if not isinstance(item, dict):
+                self.results['errors'].append(f"{label}: Invalid record")
+                continue
+            appointment, error = self._owned_appointment(item.get('appointment'))
+            if error:
+                self.results['errors'].append(f"{label}: {error}")
+                continue
+            serializer = serializer_class(data=item)
+            if not serializer.is_valid():
+                self.results['errors'].append(f"{label}: {serializer.errors}")
+                continue
+            values = dict(serializer.validated_data, appointment=appointment)
+            if model is BodyMap:
+                values['practitioner'] = self.user
+            instances.append(model(**values))
+        return instances
+
+    def run(self):
+        """Apply the batch and return the per-type result counts"""
+        self._load_appointments()
+
+        updated, update_fields = self._prepare_appointment_updates()
+        children = [
+            (result_key, model, self._prepare_children(key, label, model, serializer_class))
+            for key, result_key, label, model, serializer_class in CHILD_RECORD_TYPES
+        ]
+
+        with transaction.atomic():
+            if updated:
+                Appointment.objects.bulk_update(updated, sorted(update_fields))
+                search_index.index(Appointment, updated, update_fields)
+                self.results['appointments_updated'] = len(updated)
+            for result_key, model, instances in children:
+                if instances:
+                    model.objects.bulk_create(instances)
+                    # bulk_create sends no post_save, so index the searchable records here
+                    if model in search_index.KINDS:
+                        search_index.index(model, instances, created=True)
+                    self.results[result_key] = len(instances)
+
+        # Bulk writes skip model signals, so clear the dashboard snapshot here
+        if updated or any(instances for _, _, instances in children):
+            invalidate_staff_dashboard(self.user.id)
+        return self.results
@@ -1,13 +1,20 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
+from django.core.cache import cache
 from django.utils import timezone
 from datetime import timedelta
 import json
+import time
+from urllib.parse import quote
 
-from .models import Appointment, Seizure, Incident, Medication, BodyMap
+from .models import Appointment, AppointmentSeries, Seizure, Incident, Medication, BodyMap
+from .conflicts import IntervalIndex, find_conflicts
+from .recurrence import expand, materialize, occurrence_starts, start_series
+from .serializers import AppointmentSerializer
+from .utils import day_bounds, encode_token
 from client_management.models import Client
 
 User = get_user_model()
@@ -416,3 +423,1692 @@ class VisitManagementAPITestCase(TestCase):
         }
         response = self.api_client.post(url, body_map_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StaffAppointmentQueryBudgetTestCase(TestCase):
+    """
+    Query budget regression tests for the staff appointment endpoints.
+
+    Every endpoint is seeded with many rows spread over distinct clients, so a
+    serializer field that reaches through a relation per row breaks the budget.
+    """
+
+    ROWS = 12
+
+    # endpoint -> maximum number of queries, independent of ROWS
+    LIST_BUDGETS = {
+        '/appointments/api/staff/appointments/': 1,  # keyset page, no COUNT
+        '/appointments/api/staff/appointments/today/': 3,  # ETag aggregate + series + rows
+        '/appointments/api/staff/appointments/upcoming/': 2,  # series + rows
+        '/appointments/api/staff/appointments/in_progress/': 1,
+        '/appointments/api/staff/appointments/week/': 3,  # ETag aggregate + series + rows
+    }
+
+    # detail endpoint (formatted with the appointment id) -> maximum number of queries
+    DETAIL_BUDGETS = {
+        '/appointments/api/staff/appointments/{id}/details/': 3,  # ETag aggregate + appointment + notes
+        '/appointments/api/staff/appointments/{id}/seizures/': 2,
+        '/appointments/api/staff/appointments/{id}/location_logs/': 2,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='budget_staff', password='testpass123')
+        now = timezone.now()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for i in range(self.ROWS):
+            client = Client.objects.create(
+                first_name=f'Client{i}',
+                last_name='Budget',
+                address=f'{i} Budget Street',
+                care_checklist=['hygiene', 'medication'],
+            )
+            # Alternate between today and the coming days so every action returns rows
+            start = midnight + timedelta(minutes=i * 10) if i % 2 else now + timedelta(days=1, hours=i)
+            Appointment.objects.create(
+                title=f'Visit {i}',
+                client=client,
+                start_time=start,
+                end_time=start + timedelta(minutes=5),
+                status='in_progress' if i % 3 == 0 else 'scheduled',
+                assigned_staff=self.user,
+                checklist_items=['hygiene'],
+            )
+        self.appointment = Appointment.objects.filter(assigned_staff=self.user).first()
+        for i in range(self.ROWS):
+            Seizure.objects.create(appointment=self.appointment, start_time=now - timedelta(minutes=i))
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def test_list_endpoints_stay_within_budget(self):
+        for url, budget in self.LIST_BUDGETS.items():
+            with self.subTest(url=url):
+                with self.assertNumQueries(budget):
+                    response = self.api_client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail_endpoints_stay_within_budget(self):
+        for url, budget in self.DETAIL_BUDGETS.items():
+            url = url.format(id=self.appointment.id)
+            with self.subTest(url=url):
+                with self.assertNumQueries(budget):
+                    response = self.api_client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_serialized_rows_include_related_fields(self):
+        response = self.api_client.get('/appointments/api/staff/appointments/')
+        row = response.json()['results'][0]
+        self.assertEqual(row['assigned_staff_name'], 'budget_staff')
+        self.assertTrue(row['client_name'].endswith('Budget'))
+        self.assertEqual(row['available_checklist_items'], ['hygiene', 'medication'])
+        self.assertEqual(row['checklist_completion_percentage'], 50)
+
+
+class StaffDashboardCacheTestCase(TestCase):
+    """Test the staff dashboard snapshot and its invalidation"""
+
+    url = '/appointments/api/staff/dashboard/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='dashboard_staff', password='testpass123')
+        now = timezone.now()
+        for i in range(5):
+            client = Client.objects.create(first_name=f'Client{i}', last_name='Dash', address='1 Dash Road')
+            appointment = Appointment.objects.create(
+                title=f'Visit {i}',
+                client=client,
+                start_time=now + timedelta(hours=i + 1),
+                end_time=now + timedelta(hours=i + 2),
+                status='in_progress' if i == 0 else 'scheduled',
+                assigned_staff=self.user,
+            )
+            Seizure.objects.create(appointment=appointment, start_time=now - timedelta(hours=i))
+        self.appointment = appointment
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def test_dashboard_is_built_in_four_queries(self):
+        with self.assertNumQueries(4):
+            response = self.api_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = response.json()['stats']
+        self.assertEqual(stats['in_progress_count'], 1)
+        self.assertEqual(stats['upcoming_count'], 5)
+        self.assertEqual(stats['recent_seizures_count'], 5)
+        self.assertEqual(len(response.json()['upcoming_appointments']), 5)
+
+    def test_repeated_requests_are_served_from_cache(self):
+        first = self.api_client.get(self.url).json()
+        with self.assertNumQueries(0):
+            second = self.api_client.get(self.url).json()
+        self.assertEqual(first, second)
+
+    def test_local_memory_snapshot_is_short_lived(self):
+        from django.conf import settings
+        from . import dashboard
+
+        self.assertEqual(settings.STAFF_DASHBOARD_CACHE_TIMEOUT, dashboard.LOCAL_CACHE_TIMEOUT)
+        with self.settings():
+            del settings.STAFF_DASHBOARD_CACHE_TIMEOUT
+            self.assertEqual(dashboard._cache_timeout(), dashboard.LOCAL_CACHE_TIMEOUT)
+
+    def test_writes_invalidate_snapshot(self):
+        self.api_client.get(self.url)
+        Incident.objects.create(
+            appointment=self.appointment,
+            time=timezone.now(),
+            persons_involved='Carer',
+            addresses_of_persons_involved='1 Dash Road',
+            incident_details='Slip',
+            remediation_taken='Checked',
+        )
+        self.assertEqual(self.api_client.get(self.url).json()['stats']['recent_incidents_count'], 1)
+
+        self.appointment.status = 'in_progress'
+        self.appointment.save()
+        self.assertEqual(self.api_client.get(self.url).json()['stats']['in_progress_count'], 2)
+
+    def test_reassignment_invalidates_previous_staff(self):
+        other = User.objects.create_user(username='other_staff', password='testpass123')
+        self.api_client.get(self.url)
+        self.appointment.assigned_staff = other
+        self.appointment.save()
+        self.assertEqual(self.api_client.get(self.url).json()['stats']['upcoming_count'], 4)
+
+
+class MobileSyncEngineTestCase(TestCase):
+    """Test the batched mobile sync endpoint"""
+
+    url = '/appointments/api/staff/sync/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='sync_staff', password='testpass123')
+        self.other = User.objects.create_user(username='other_sync_staff', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Sync', last_name='Client', address='1 Sync Lane')
+        start = timezone.now() + timedelta(hours=1)
+        self.appointments = [
+            Appointment.objects.create(
+                title=f'Visit {i}', client=self.client_obj, start_time=start,
+                end_time=start + timedelta(hours=1), assigned_staff=self.user,
+            )
+            for i in range(3)
+        ]
+        self.foreign = Appointment.objects.create(
+            title='Not mine', client=self.client_obj, start_time=start,
+            end_time=start + timedelta(hours=1), assigned_staff=self.other,
+        )
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def _payload(self, count):
+        now = timezone.now()
+        appointment_ids = [a.id for a in self.appointments]
+        return {
+            'appointments': [{'id': pk, 'checklist_items': ['hygiene']} for pk in appointment_ids],
+            'seizures': [
+                {'appointment': appointment_ids[i % 3], 'start_time': (now - timedelta(minutes=i)).isoformat()}
+                for i in range(count)
+            ],
+            'incidents': [
+                {
+                    'appointment': appointment_ids[i % 3], 'time': now.isoformat(),
+                    'persons_involved': 'Carer', 'addresses_of_persons_involved': '1 Sync Lane',
+                    'incident_details': f'Incident {i}', 'remediation_taken': 'None needed',
+                }
+                for i in range(count)
+            ],
+            'medications': [
+                {
+                    'appointment': appointment_ids[i % 3], 'name': 'Paracetamol', 'strength': '500.00',
+                    'dose': '500.00', 'frequency': 'twice_daily', 'route': 'oral',
+                }
+                for i in range(count)
+            ],
+            'body_maps': [
+                {'appointment': appointment_ids[i % 3], 'injuries': [], 'consent_given': False}
+                for i in range(count)
+            ],
+        }
+
+    def test_sync_creates_all_record_types(self):
+        response = self.api_client.post(self.url, self._payload(4), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['errors'], [])
+        self.assertEqual(data['appointments_updated'], 3)
+        for key in ('seizures_created', 'incidents_created', 'medications_created', 'body_maps_created'):
+            self.assertEqual(data[key], 4)
+        self.assertEqual(Medication.objects.count(), 4)
+        self.assertEqual(BodyMap.objects.filter(practitioner=self.user).count(), 4)
+        self.appointments[0].refresh_from_db()
+        self.assertEqual(self.appointments[0].checklist_items, ['hygiene'])
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as small:
+            self.api_client.post(self.url, self._payload(2), format='json')
+        with CaptureQueriesContext(connection) as large:
+            self.api_client.post(self.url, self._payload(40), format='json')
+        self.assertEqual(len(small), len(large))
+
+    def test_reschedules_are_checked_for_conflicts_in_one_pass(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        Appointment.objects.filter(pk__in=[a.pk for a in self.appointments]).delete()
+        base = (timezone.now() + timedelta(days=2)).replace(hour=8, minute=0, second=0, microsecond=0)
+        visits = [
+            Appointment.objects.create(
+                title=f'Visit {i}', client=self.client_obj, start_time=base + timedelta(hours=2 * i),
+                end_time=base + timedelta(hours=2 * i + 1), assigned_staff=self.user,
+            )
+            for i in range(12)
+        ]
+
+        def moves(count, offset):
+            return {'appointments': [
+                {'id': visit.id, 'start_time': (visit.start_time + offset).isoformat(),
+                 'end_time': (visit.end_time + offset).isoformat()}
+                for visit in visits[:count]
+            ]}
+
+        with CaptureQueriesContext(connection) as small:
+            self.api_client.post(self.url, moves(2, timedelta(minutes=30)), format='json')
+        with CaptureQueriesContext(connection) as large:
+            self.api_client.post(self.url, moves(12, timedelta(minutes=15)), format='json')
+        self.assertEqual(len(small), len(large))
+
+        # The first visit moves onto the unchanged second one and is not written
+        first, second = visits[:2]
+        first.refresh_from_db()
+        second.refresh_from_db()
+        clash = {'id': first.id, 'start_time': second.start_time.isoformat(), 'end_time': second.end_time.isoformat()}
+        data = self.api_client.post(self.url, {'appointments': [clash]}, format='json').json()
+        self.assertEqual(data['appointments_updated'], 0)
+        self.assertEqual(len(data['errors']), 1)
+        self.assertIn('conflicts', data['errors'][0])
+        self.assertEqual(Appointment.objects.get(pk=first.id).start_time, first.start_time)
+
+    def test_foreign_and_unknown_appointments_are_rejected(self):
+        payload = {
+            'appointments': [{'id': self.foreign.id, 'checklist_items': []}],
+            'seizures': [
+                {'appointment': self.foreign.id, 'start_time': timezone.now().isoformat()},
+                {'appointment': 999999, 'start_time': timezone.now().isoformat()},
+            ],
+        }
+        data = self.api_client.post(self.url, payload, format='json').json()
+        self.assertEqual(data['appointments_updated'], 0)
+        self.assertEqual(data['seizures_created'], 0)
+        self.assertEqual(len(data['errors']), 3)
+        self.assertFalse(Seizure.objects.exists())
+
+
+@override_settings(SYNC_COMMIT_LAG=0)
+class DeltaSyncAPITestCase(TestCase):
+    """Test the incremental sync endpoint"""
+
+    url = '/appointments/api/staff/sync/changes/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='delta_staff', password='testpass123')
+        self.other = User.objects.create_user(username='other_delta_staff', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Delta', last_name='Client', address='1 Delta Way')
+        self.start = timezone.now() + timedelta(hours=1)
+        self.appointments = [self._appointment(f'Visit {i}') for i in range(3)]
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def _appointment(self, title, staff=None):
+        return Appointment.objects.create(
+            title=title, client=self.client_obj, start_time=self.start,
+            end_time=self.start + timedelta(hours=1), assigned_staff=staff or self.user,
+        )
+
+    def _pull(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        response = self.api_client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_initial_pull_returns_everything(self):
+        self._appointment('Someone else', staff=self.other)
+        data = self._pull()
+        self.assertEqual(len(data['appointments']), 3)
+        self.assertFalse(data['has_more'])
+        self.assertIn('cursor', data)
+
+    def test_second_pull_returns_only_changes_and_tombstones(self):
+        cursor = self._pull()['cursor']
+        self.assertEqual(self._pull(cursor)['appointments'], [])
+
+        changed = self.appointments[0]
+        changed.checklist_items = ['hygiene']
+        changed.save()
+        deleted_id = self.appointments[1].id
+        self.appointments[1].delete()
+        seizure = Seizure.objects.create(appointment=self.appointments[2], start_time=timezone.now())
+
+        data = self._pull(cursor)
+        self.assertEqual([a['id'] for a in data['appointments']], [changed.id])
+        self.assertEqual([s['id'] for s in data['seizures']], [seizure.id])
+        self.assertEqual(data['deleted']['appointments'], [deleted_id])
+
+        data = self._pull(data['cursor'])
+        self.assertEqual(data['appointments'], [])
+        self.assertEqual(data['deleted']['appointments'], [])
+
+    def test_reassignment_sends_tombstone_to_previous_staff(self):
+        cursor = self._pull()['cursor']
+        moved = self.appointments[0]
+        moved.assigned_staff = self.other
+        moved.save()
+        self.assertEqual(self._pull(cursor)['deleted']['appointments'], [moved.id])
+
+    def test_paging_resumes_after_last_row(self):
+        seen = []
+        data = self._pull(page_size=2)
+        seen += [a['id'] for a in data['appointments']]
+        self.assertTrue(data['has_more'])
+        data = self._pull(data['cursor'], page_size=2)
+        seen += [a['id'] for a in data['appointments']]
+        self.assertFalse(data['has_more'])
+        self.assertEqual(sorted(seen), sorted(a.id for a in self.appointments))
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.api_client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        impossible = encode_token({'appointments': ['2025-13-01T00:00:00+00:00', 1]})
+        response = self.api_client.get(self.url, {'cursor': impossible})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(SYNC_COMMIT_LAG=60)
+    def test_recent_rows_are_sent_again_until_past_the_commit_lag(self):
+        old = self.appointments[0]
+        Appointment.objects.filter(pk=old.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+        cursor = self._pull()['cursor']
+        again = {a['id'] for a in self._pull(cursor)['appointments']}
+        self.assertEqual(again, {a.id for a in self.appointments[1:]})
+
+
+class DatasetGeneratorTestCase(TestCase):
+    """Test the synthetic dataset generator used for load testing"""
+
+    def test_generates_requested_volumes_in_chunks(self):
+        from .datagen import DatasetGenerator
+
+        counts = DatasetGenerator(clients=5, staff=3, appointments=120, chunk_size=50, prefix='gen').run()
+        self.assertEqual(counts['appointments'], 120)
+        self.assertEqual(Appointment.objects.count(), 120)
+        self.assertEqual(User.objects.filter(username__startswith='gen_carer_').count(), 3)
+        self.assertEqual(Client.objects.count(), 5)
+        # Every started visit has a start location log
+        started = Appointment.objects.filter(actual_start_time__isnull=False).count()
+        self.assertEqual(
+            Appointment.objects.filter(location_logs__log_type='start').count(), started
+        )
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test ETag / Last-Modified handling on the polled staff endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='etag_staff', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Etag', last_name='Client', address='1 Etag Road')
+        start = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
+        self.appointments = [
+            Appointment.objects.create(
+                title=f'Visit {i}', client=self.client_obj, assigned_staff=self.user,
+                start_time=start + timedelta(hours=i), end_time=start + timedelta(hours=i, minutes=30),
+            )
+            for i in range(2)
+        ]
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def _revalidate(self, url, etag):
+        return self.api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_list_returns_304_without_serializing(self):
+        url = '/appointments/api/staff/appointments/today/'
+        response = self.api_client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+
+        # Only the aggregate and series queries run
+        with self.assertNumQueries(2):
+            response = self._revalidate(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_window_rollover_produces_a_new_etag(self):
+        from unittest import mock
+
+        url = '/appointments/api/staff/appointments/today/'
+        etag = self.api_client.get(url)['ETag']
+        response = self.api_client.get(url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        tomorrow = day_bounds(timezone.localdate() + timedelta(days=1))
+        with mock.patch('appointment_management.views.today_bounds', return_value=tomorrow):
+            response = self._revalidate(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_changes_produce_a_new_etag(self):
+        url = '/appointments/api/staff/appointments/week/'
+        etag = self.api_client.get(url)['ETag']
+
+        self.appointments[0].checklist_items = ['hygiene']
+        self.appointments[0].save()
+        response = self._revalidate(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # Client details are part of every row
+        self.client_obj.address = '2 Etag Road'
+        self.client_obj.save()
+        response = self._revalidate(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        self.appointments[1].delete()
+        response = self._revalidate(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_details_and_notes(self):
+        from visit_notes.models import Note
+
+        appointment = self.appointments[0]
+        details_url = f'/appointments/api/staff/appointments/{appointment.id}/details/'
+        notes_url = f'/api/notes/by_appointment/?appointment_id={appointment.id}'
+        details_etag = self.api_client.get(details_url)['ETag']
+        notes_etag = self.api_client.get(notes_url)['ETag']
+        self.assertEqual(self._revalidate(details_url, details_etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self._revalidate(notes_url, notes_etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Note.objects.create(appointment=appointment, uploaded_by=self.user, content='Ate well')
+        self.assertEqual(self._revalidate(details_url, details_etag).status_code, status.HTTP_200_OK)
+        self.assertEqual(self._revalidate(notes_url, notes_etag).status_code, status.HTTP_200_OK)
+
+    def test_other_staff_cannot_probe_details(self):
+        other = User.objects.create_user(username='etag_other', password='testpass123')
+        self.api_client.force_authenticate(user=other)
+        response = self.api_client.get(f'/appointments/api/staff/appointments/{self.appointments[0].id}/details/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('ETag', response)
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Test cursor pagination of the staff list endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='keyset_staff', password='testpass123')
+        client = Client.objects.create(first_name='Keyset', last_name='Client', address='1 Keyset Row')
+        now = timezone.now()
+        self.appointment = Appointment.objects.create(
+            title='Visit', client=client, assigned_staff=self.user,
+            start_time=now - timedelta(days=1), end_time=now - timedelta(days=1, minutes=-30),
+        )
+        # Pairs of incidents share a timestamp, so pages must break ties on id
+        Incident.objects.bulk_create([
+            Incident(appointment=self.appointment, time=now - timedelta(days=i // 2),
+                     persons_involved='Carer', incident_details=f'Incident {i}', remediation_taken='None')
+            for i in range(7)
+        ])
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def _walk(self, url):
+        pages = []
+        while url:
+            data = self.api_client.get(url).json()
+            pages.append([row['id'] for row in data['results']])
+            url = data['next']
+        return pages
+
+    def test_pages_cover_every_row_once_in_order(self):
+        pages = self._walk('/appointments/api/staff/incidents/recent/?page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        expected = list(Incident.objects.order_by('-time', '-id').values_list('id', flat=True))
+        self.assertEqual([pk for page in pages for pk in page], expected)
+
+    def test_previous_link_returns_the_earlier_page(self):
+        first = self.api_client.get('/appointments/api/staff/incidents/?page_size=3').json()
+        self.assertIsNone(first['previous'])
+        second = self.api_client.get(first['next']).json()
+        back = self.api_client.get(second['previous']).json()
+        self.assertEqual([row['id'] for row in back['results']], [row['id'] for row in first['results']])
+
+    def test_deep_pages_cost_one_query(self):
+        url = '/appointments/api/staff/incidents/?page_size=2'
+        for _ in range(3):
+            url = self.api_client.get(url).json()['next']
+        with self.assertNumQueries(1):
+            response = self.api_client.get(url)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_invalid_cursor(self):
+        response = self.api_client.get('/appointments/api/staff/incidents/', {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_detail_actions_are_paginated(self):
+        for i in range(3):
+            Seizure.objects.create(appointment=self.appointment, start_time=timezone.now() - timedelta(minutes=i))
+        url = f'/appointments/api/staff/appointments/{self.appointment.id}/seizures/?page_size=2'
+        pages = self._walk(url)
+        self.assertEqual([len(page) for page in pages], [2, 1])
+
+
+class RecurringSeriesTestCase(TestCase):
+    """Test recurring appointment series expansion and materialization"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='series_staff', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Series', last_name='Client', address='1 Series Lane')
+        self.start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def _series(self, frequency='daily', start=None, **kwargs):
+        start = start or self.start
+        return AppointmentSeries.objects.create(
+            title='Recurring visit', client=self.client_obj, assigned_staff=self.user,
+            frequency=frequency, start_time=start, end_time=start + timedelta(minutes=30), **kwargs
+        )
+
+    def _starts(self, series, n):
+        return [timezone.localtime(start) for start in list(occurrence_starts(series))[:n]]
+
+    def test_rules(self):
+        daily = self._series(interval=2, count=3)
+        self.assertEqual([s.date() for s in self._starts(daily, 5)],
+                         [self.start.date() + timedelta(days=d) for d in (0, 2, 4)])
+
+        monday = self.start - timedelta(days=self.start.weekday())
+        weekly = self._series('weekly', start=monday, by_weekday=[0, 3], until=monday + timedelta(days=8))
+        self.assertEqual([s.date() for s in self._starts(weekly, 5)],
+                         [monday.date() + timedelta(days=d) for d in (0, 3, 7)])
+
+        jan_31 = self.start.replace(year=2031, month=1, day=31)
+        monthly = self._series('monthly', start=jan_31, count=3)
+        self.assertEqual([(s.month, s.day) for s in self._starts(monthly, 5)], [(1, 31), (3, 31), (5, 31)])
+
+    def test_today_lists_virtual_occurrences(self):
+        series = self._series(start=self.start - timedelta(days=3))
+        results = self.api_client.get('/appointments/api/staff/appointments/today/').json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertIsNone(results[0]['id'])
+        self.assertEqual(results[0]['series'], series.id)
+
+    def test_materialized_occurrence_replaces_the_virtual_one(self):
+        series = self._series()
+        url = f'/appointments/api/staff/series/{series.id}/materialize/'
+        response = self.api_client.post(url, {'occurrence_start': self.start.isoformat()}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        again = self.api_client.post(url, {'occurrence_start': self.start.isoformat()}, format='json')
+        self.assertEqual(again.status_code, status.HTTP_200_OK)
+        self.assertEqual(again.json()['id'], response.json()['id'])
+
+        results = self.api_client.get('/appointments/api/staff/appointments/today/').json()['results']
+        self.assertEqual([row['id'] for row in results], [response.json()['id']])
+
+        bad = self.api_client.post(url, {'occurrence_start': (self.start + timedelta(hours=1)).isoformat()}, format='json')
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cancel_occurrence(self):
+        series = self._series()
+        tomorrow = self.start + timedelta(days=1)
+        response = self.api_client.post(
+            f'/appointments/api/staff/series/{series.id}/cancel_occurrence/',
+            {'occurrence_start': tomorrow.isoformat()}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['status'], 'cancelled')
+        occurrences = expand([series], tomorrow, tomorrow + timedelta(days=2))
+        self.assertEqual(len(occurrences), 1)
+        self.assertEqual(occurrences[0].start_time, tomorrow + timedelta(days=1))
+
+    def test_list_window_and_pages(self):
+        self._series()
+        url = f'/appointments/api/staff/appointments/?start={self.start.date()}&page_size=2'
+        first = self.api_client.get(url).json()
+        self.assertEqual(len(first['results']), 2)
+        second = self.api_client.get(first['next']).json()
+        self.assertEqual(second['results'][0]['start_time'][:10], str(self.start.date() + timedelta(days=2)))
+        back = self.api_client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_series_edit_changes_etag(self):
+        series = self._series()
+        url = '/appointments/api/staff/appointments/week/'
+        etag = self.api_client.get(url)['ETag']
+        series.title = 'Renamed visit'
+        series.save()
+        self.assertEqual(self.api_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_dashboard_includes_occurrences(self):
+        cache.clear()
+        self._series(start=self.start - timedelta(days=1))
+        stats = self.api_client.get('/appointments/api/staff/dashboard/').json()['stats']
+        self.assertEqual(stats['today_count'], 1)
+        self.assertGreaterEqual(stats['upcoming_count'], 7)
+
+    def test_appointment_form_creates_a_series(self):
+        admin = User.objects.create_user(username='series_admin', password='testpass123', role='admin', is_superuser=True)
+        self.client.force_login(admin)
+        start = self.start + timedelta(days=1)
+        response = self.client.post('/appointments/create/', {
+            'title': 'Weekly visit',
+            'client': self.client_obj.id,
+            'assigned_staff': self.user.id,
+            'start_time': start.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': (start + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'status': 'scheduled',
+            'frequency': 'weekly',
+            'checklist_items': '["hygiene"]',
+            'repeat_until': (start + timedelta(weeks=3)).date().isoformat(),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Appointment.objects.filter(title='Weekly visit').count(), 1)
+        series = AppointmentSeries.objects.get(title='Weekly visit')
+        self.assertEqual(len(list(occurrence_starts(series))), 4)
+        self.assertEqual(series.occurrences.get().occurrence_start, series.start_time)
+
+
+    def test_deleted_occurrence_is_not_expanded_again(self):
+        first = Appointment.objects.create(
+            title='Recurring visit', client=self.client_obj, assigned_staff=self.user, frequency='daily',
+            start_time=self.start, end_time=self.start + timedelta(minutes=30),
+        )
+        series = start_series(first, count=3)
+        second, _ = materialize(series, self.start + timedelta(days=1))
+        first.delete()
+        response = self.api_client.delete(f'/appointments/api/staff/appointments/{second.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        series.refresh_from_db()
+        self.assertEqual(len(series.excluded_starts), 2)
+        self.assertEqual([o.start_time for o in expand([series], self.start, self.start + timedelta(days=5))],
+                         [self.start + timedelta(days=2)])
+        with self.assertRaises(ValueError):
+            materialize(series, self.start)
+
+    def _admin_login(self):
+        admin = User.objects.create_user(username='series_admin', password='testpass123', role='admin', is_superuser=True)
+        self.client.force_login(admin)
+
+    def _form_data(self, appointment, **changes):
+        data = {
+            'title': appointment.title, 'client': appointment.client_id, 'assigned_staff': appointment.assigned_staff_id,
+            'start_time': timezone.localtime(appointment.start_time).strftime('%Y-%m-%dT%H:%M'),
+            'end_time': timezone.localtime(appointment.end_time).strftime('%Y-%m-%dT%H:%M'),
+            'status': appointment.status, 'frequency': appointment.frequency, 'checklist_items': '["hygiene"]',
+        }
+        data.update(changes)
+        return data
+
+    def test_admin_views_list_occurrences(self):
+        self._admin_login()
+        series = self._series(start=self.start - timedelta(days=1))
+        dashboard = self.client.get('/').context
+        self.assertEqual((len(dashboard['today_appointments']), len(dashboard['recent_appointments'])), (1, 5))
+        self.assertEqual(dashboard['active_appointments'], 28)
+        for url in ['/appointments/', f'/clients/{self.client_obj.id}/', f'/users/{self.user.id}/']:
+            self.assertContains(self.client.get(url), f'/appointments/series/{series.id}/detail/?start=', count=28)
+        self.assertEqual(self.api_client.get('/api/dashboard/').json()['active_appointments'], 28)
+
+        response = self.client.get('/appointments/')
+        self.assertEqual(len(response.context['appointments']), 28)
+        occurrence = response.context['appointments'][-2]  # tomorrow's
+        self.assertIsNone(occurrence.id)
+        self.assertContains(response, f'/appointments/series/{series.id}/edit/?start=')
+        query = {'start': occurrence.occurrence_start.isoformat()}
+        # Opening an occurrence writes nothing
+        for action in ('detail', 'edit', 'delete'):
+            response = self.client.get(f'/appointments/series/{series.id}/{action}/', query)
+            self.assertEqual(response.status_code, 200, action)
+        self.assertFalse(series.occurrences.exists())
+
+        url = f'/appointments/series/{series.id}/edit/?start={quote(query["start"])}'
+        response = self.client.post(url, self._form_data(occurrence, title='Moved visit'))
+        self.assertEqual(response.status_code, 302)
+        materialized = series.occurrences.get()
+        self.assertEqual((materialized.title, materialized.occurrence_start), ('Moved visit', occurrence.start_time))
+        self.assertRedirects(self.client.get(url), f'/appointments/{materialized.id}/edit/')
+
+        other = self.client.get('/appointments/').context['appointments'][-1]
+        response = self.client.post(f'/appointments/series/{series.id}/delete/?start={quote(other.start_time.isoformat())}',
+                                    {'apply_to': 'visit'})
+        self.assertEqual(response.status_code, 302)
+        series.refresh_from_db()
+        self.assertEqual(series.excluded_starts, [other.start_time.isoformat()])
+        self.assertEqual(series.occurrences.count(), 1)
+
+    def test_delete_and_edit_the_rest_of_a_series(self):
+        self._admin_login()
+        series = self._series(count=6)
+        third, _ = materialize(series, self.start + timedelta(days=2))
+        fifth, _ = materialize(series, self.start + timedelta(days=4))
+
+        moved = {field: timezone.localtime(getattr(third, field) + timedelta(hours=8)).strftime('%Y-%m-%dT%H:%M')
+                 for field in ('start_time', 'end_time')}
+        response = self.client.post(f'/appointments/{third.id}/edit/',
+                                    self._form_data(third, title='Evening visit', apply_to='following', **moved))
+        self.assertEqual(response.status_code, 302)
+        series.refresh_from_db()
+        self.assertEqual(len(list(occurrence_starts(series))), 2)
+        self.assertFalse(Appointment.objects.filter(pk=fifth.pk).exists())
+        third.refresh_from_db()
+        following = third.series
+        self.assertEqual((following.title, following.count), ('Evening visit', 4))
+        self.assertEqual(list(occurrence_starts(following))[1], self.start + timedelta(days=3, hours=8))
+
+        response = self.client.post(f'/appointments/{third.id}/delete/', {'apply_to': 'following'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(AppointmentSeries.objects.filter(pk=following.pk).exists())
+        self.assertFalse(Appointment.objects.filter(pk=third.pk).exists())
+        self.assertEqual(len(expand([series], self.start, self.start + timedelta(days=10))), 2)
+
+
+class ConflictDetectionTestCase(TestCase):
+    """Test batch double-booking detection"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='conflict_staff', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Conflict', last_name='Client', address='1 Clash Street')
+        self.base = timezone.localtime(timezone.now() + timedelta(days=2)).replace(hour=9, minute=0, second=0, microsecond=0)
+        self.booked = self._visit(0, 60, save=True)
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def _visit(self, offset, length, save=False, **kwargs):
+        start = self.base + timedelta(minutes=offset)
+        visit = Appointment(
+            title='Visit', client=self.client_obj, assigned_staff=self.user,
+            start_time=start, end_time=start + timedelta(minutes=length), **kwargs
+        )
+        if save:
+            visit.save()
+        return visit
+
+    def test_interval_index_matches_brute_force(self):
+        import random
+        rng = random.Random(7)
+        intervals = []
+        for _ in range(300):
+            start = rng.randrange(0, 1000)
+            intervals.append((start, start + rng.randrange(1, 80)))
+        index = IntervalIndex(intervals, bounds=lambda interval: interval)
+        for _ in range(200):
+            start = rng.randrange(0, 1000)
+            end = start + rng.randrange(1, 50)
+            expected = sorted(i for i in intervals if i[0] < end and i[1] > start)
+            self.assertEqual(sorted(index.overlapping(start, end)), expected)
+
+    def test_batch_reports_every_conflict(self):
+        AppointmentSeries.objects.create(
+            title='Daily', client=self.client_obj, assigned_staff=self.user, frequency='daily',
+            start_time=self.base + timedelta(hours=3), end_time=self.base + timedelta(hours=4),
+        )
+        self._visit(120, 30, save=True, status='cancelled')
+        proposals = [
+            self._visit(30, 60),    # overlaps the booked visit
+            self._visit(120, 30),   # only overlaps a cancelled visit
+            self._visit(200, 30),   # overlaps the series occurrence
+            self._visit(130, 30),   # overlaps the second proposal
+            self._visit(60, 30),    # touches the booked visit, and overlaps the first proposal
+        ]
+        with self.assertNumQueries(3):  # rows, series, materialized occurrences
+            conflicts = find_conflicts(proposals)
+        found = [(c.index, c.other.pk, c.other.series_id, c.other_index) for c in conflicts]
+        series_id = AppointmentSeries.objects.get().pk
+        self.assertEqual(found, [
+            (0, self.booked.pk, None, None),
+            (2, None, series_id, None),
+            (3, None, None, 1),
+            (4, None, None, 0),
+        ])
+
+    def test_rescheduled_row_does_not_conflict_with_itself(self):
+        self.booked.start_time += timedelta(minutes=15)
+        self.booked.end_time += timedelta(minutes=15)
+        self.assertEqual(find_conflicts([self.booked]), [])
+
+    def test_serializer_rejects_double_booking(self):
+        serializer = AppointmentSerializer(
+            self.booked, data={'start_time': self.base + timedelta(minutes=90)}, partial=True
+        )
+        self.assertTrue(serializer.is_valid())
+        other = self._visit(120, 30, save=True)
+        serializer = AppointmentSerializer(other, data={'start_time': self.base + timedelta(minutes=30)}, partial=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['conflicts'][0]['conflicts_with']['id'], str(self.booked.pk))
+
+        response = self.api_client.patch(
+            f'/appointments/api/staff/appointments/{other.id}/',
+            {'start_time': (self.base + timedelta(minutes=30)).isoformat()}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_check_conflicts_endpoint(self):
+        response = self.api_client.post('/appointments/api/staff/appointments/check_conflicts/', [
+            {'start_time': (self.base + timedelta(minutes=30)).isoformat(),
+             'end_time': (self.base + timedelta(minutes=90)).isoformat()},
+            {'id': self.booked.id, 'start_time': (self.base + timedelta(hours=5)).isoformat(),
+             'end_time': (self.base + timedelta(hours=6)).isoformat()},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['conflicts'], [])
+
+    def test_form_checks_repeat_visits(self):
+        from .forms import AppointmentForm
+        self._visit(60 * 24 * 7 + 60, 30, save=True)
+        form = AppointmentForm(data={
+            'title': 'Weekly visit',
+            'client': self.client_obj.id,
+            'assigned_staff': self.user.id,
+            'start_time': self.base.strftime('%Y-%m-%dT') + '11:00',
+            'end_time': self.base.strftime('%Y-%m-%dT') + '11:30',
+            'status': 'scheduled',
+            'checklist_items': '["hygiene"]',
+        })
+        self.assertTrue(form.is_valid(), form.errors)
+
+        data = dict(form.data, start_time=self.base.strftime('%Y-%m-%dT') + '09:15',
+                    end_time=self.base.strftime('%Y-%m-%dT') + '09:45', frequency='weekly')
+        form = AppointmentForm(data=data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('already has an appointment during this time', str(form.errors))
+
+        form = AppointmentForm(data=dict(data, start_time=self.base.strftime('%Y-%m-%dT') + '10:00',
+                                         end_time=self.base.strftime('%Y-%m-%dT') + '10:30'))
+        self.assertFalse(form.is_valid())
+        self.assertIn('repeat visits on', str(form.errors))
+
+
+class BulkAppointmentAPITestCase(TestCase):
+    """Test the bulk create / reschedule / reassign / cancel endpoint"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='bulk_admin', password='testpass123', role='admin')
+        self.staff = User.objects.create_user(username='bulk_staff', password='testpass123')
+        self.other = User.objects.create_user(username='bulk_other', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Bulk', last_name='Client', address='1 Bulk Road')
+        self.base = (timezone.now() + timedelta(days=3)).replace(hour=8, minute=0, second=0, microsecond=0)
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.admin)
+
+    def _slot(self, hours, length=30):
+        start = self.base + timedelta(hours=hours)
+        return {'start_time': start.isoformat(), 'end_time': (start + timedelta(minutes=length)).isoformat()}
+
+    def _post(self, operation, items, **extra):
+        return self.api_client.post(
+            f'/appointments/api/bulk/{operation}/', {'appointments': items, **extra}, format='json'
+        )
+
+    def _book(self, hours, staff=None):
+        slot = self._slot(hours)
+        return Appointment.objects.create(
+            title='Booked', client=self.client_obj, assigned_staff=staff or self.staff,
+            start_time=slot['start_time'], end_time=slot['end_time'],
+        )
+
+    def test_create_in_constant_queries(self):
+        items = [
+            {'title': f'Visit {i}', 'client': self.client_obj.id, 'assigned_staff': self.staff.id, **self._slot(i)}
+            for i in range(200)
+        ]
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            response = self._post('create', items)
+        # staff, clients, bookings and series lookups; the rest are the batched INSERTs
+        lookups = [q for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(lookups), 4)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['applied'], 200)
+        self.assertEqual(Appointment.objects.filter(assigned_staff=self.staff).count(), 200)
+        self.assertTrue(all(result['status'] == 'created' and result['id'] for result in response.json()['results']))
+
+    def test_per_item_errors(self):
+        self._book(0)
+        items = [
+            {'title': 'Clash', 'client': self.client_obj.id, 'assigned_staff': self.staff.id, **self._slot(0)},
+            {'title': 'Fine', 'client': self.client_obj.id, 'assigned_staff': self.staff.id, **self._slot(2)},
+            {'title': 'Clash in batch', 'client': self.client_obj.id, 'assigned_staff': self.staff.id, **self._slot(2)},
+            {'title': 'No client', 'client': 999999, 'assigned_staff': self.staff.id, **self._slot(4)},
+            {'title': 'Backwards', 'client': self.client_obj.id, 'start_time': self._slot(5)['end_time'],
+             'end_time': self._slot(5)['start_time']},
+        ]
+        data = self._post('create', items).json()
+        self.assertEqual([r['status'] for r in data['results']], ['error', 'created', 'error', 'error', 'error'])
+        self.assertEqual(data['results'][2]['errors']['conflicts'][0]['conflicts_with_index'], 1)
+        self.assertIn('client', data['results'][3]['errors'])
+
+        response = self._post('create', items, atomic=True)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['results'][1]['status'], 'error')  # now clashes with the row written above
+        self.assertEqual(Appointment.objects.count(), 2)
+
+    def test_create_with_frequency_starts_a_series(self):
+        from .forms import DEFAULT_REPEAT_COUNT
+        self._book(24 * 3, staff=self.other)  # the fourth visit of the other carer's series
+        items = [
+            {'title': 'Daily', 'client': self.client_obj.id, 'assigned_staff': self.staff.id,
+             'frequency': 'daily', **self._slot(0)},
+            {'title': 'Clashes with day two', 'client': self.client_obj.id, 'assigned_staff': self.staff.id,
+             **self._slot(24)},
+            {'title': 'Clashes with a booking', 'client': self.client_obj.id, 'assigned_staff': self.other.id,
+             'frequency': 'daily', **self._slot(0)},
+        ]
+        data = self._post('create', items).json()
+        self.assertEqual([r['status'] for r in data['results']], ['created', 'error', 'error'])
+        self.assertEqual(data['results'][1]['errors']['conflicts'][0]['conflicts_with_index'], 0)
+        self.assertIsNone(data['results'][2]['errors']['conflicts'][0]['conflicts_with_index'])
+
+        appointment = Appointment.objects.get(pk=data['results'][0]['id'])
+        self.assertEqual(appointment.occurrence_start, appointment.start_time)
+        self.assertEqual(appointment.series.count, DEFAULT_REPEAT_COUNT)
+        self.assertEqual(len(list(occurrence_starts(appointment.series))), DEFAULT_REPEAT_COUNT)
+        self.assertFalse(AppointmentSeries.objects.filter(assigned_staff=self.other).exists())
+
+    def test_reschedule_swaps_and_ownership(self):
+        first, second = self._book(0), self._book(1)
+        foreign = self._book(3, staff=self.other)
+        self.api_client.force_authenticate(user=self.staff)
+        data = self._post('reschedule', [
+            {'id': first.id, **self._slot(1)},
+            {'id': second.id, **self._slot(0)},
+            {'id': foreign.id, **self._slot(6)},
+        ]).json()
+        self.assertEqual([r['status'] for r in data['results']], ['rescheduled', 'rescheduled', 'error'])
+        first.refresh_from_db()
+        self.assertEqual(first.start_time, self.base + timedelta(hours=1))
+
+    def test_reassign_is_admin_only_and_tombstoned(self):
+        from .models import SyncTombstone
+        appointment = self._book(0)
+        self.api_client.force_authenticate(user=self.staff)
+        self.assertEqual(self._post('reassign', [{'id': appointment.id, 'assigned_staff': self.other.id}]).status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        self.api_client.force_authenticate(user=self.admin)
+        data = self._post('reassign', [{'id': appointment.id, 'assigned_staff': self.other.id}]).json()
+        self.assertEqual(data['results'][0]['status'], 'reassigned')
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.assigned_staff, self.other)
+        self.assertTrue(SyncTombstone.objects.filter(object_id=appointment.id, staff=self.staff).exists())
+
+    def test_cancel(self):
+        scheduled, started = self._book(0), self._book(2)
+        started.actual_start_time = timezone.now()
+        started.save()
+        data = self._post('cancel', [{'id': scheduled.id}, {'id': started.id}, {'id': scheduled.id}]).json()
+        self.assertEqual([r['status'] for r in data['results']], ['cancelled', 'error', 'error'])
+        scheduled.refresh_from_db()
+        self.assertEqual(scheduled.status, 'cancelled')
+
+    def test_payload_errors(self):
+        self.assertEqual(self._post('create', 'nope').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._post('explode', []).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RotaOptimizerTestCase(TestCase):
+    """Test the travel-aware carer assignment"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='rota_admin', password='testpass123', role='admin',
+                                              is_staff_member=False)
+        self.carers = [User.objects.create_user(username=f'rota_carer{i}', password='testpass123') for i in range(2)]
+        # Two neighbourhoods about 20 km apart
+        self.north = [Client.objects.create(first_name=f'North{i}', last_name='Client', address='North',
+                                            latitude=51.60 + i * 0.001, longitude=-0.10) for i in range(3)]
+        self.south = [Client.objects.create(first_name=f'South{i}', last_name='Client', address='South',
+                                            latitude=51.42 + i * 0.001, longitude=-0.10) for i in range(3)]
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.start = day_bounds(self.day)[0] + timedelta(hours=8)
+        # Each carer alternates between the neighbourhoods
+        self.visits = []
+        for slot in range(3):
+            for carer in range(2):
+                clients = self.north if (slot + carer) % 2 == 0 else self.south
+                start = self.start + timedelta(hours=slot * 2)
+                self.visits.append(Appointment.objects.create(
+                    title='Visit', client=clients[slot], assigned_staff=self.carers[carer],
+                    start_time=start, end_time=start + timedelta(hours=1),
+                ))
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.admin)
+
+    def test_optimizer_on_synthetic_day_is_feasible_and_shorter(self):
+        import random
+        from .geo import distance_matrix
+        from .rota import Carer, RotaOptimizer, Stop
+        rng = random.Random(3)
+        points = [(51.4 + rng.random() * 0.3, -0.3 + rng.random() * 0.5) for _ in range(150)]
+        visits = []
+        for key in range(300):
+            start = 7 * 3600 + rng.randrange(0, 14 * 3600, 900)
+            visits.append(Stop(key, start, start + rng.choice([900, 1800, 3600]), rng.randrange(150)))
+        carers = [Carer(n, 0, 86400) for n in range(60)]
+        optimizer = RotaOptimizer(visits, carers, distance_matrix(points))
+        optimizer.construct()
+        constructed = optimizer.total_distance()
+        optimizer.improve(time.monotonic() + 10)
+        self.assertLessEqual(optimizer.total_distance(), constructed)
+        self.assertEqual(len(optimizer.assignment), 300)
+        for carer in carers:
+            for a, b in zip(carer.route, carer.route[1:]):
+                self.assertTrue(optimizer._reachable(a, b))
+
+    def test_plan_keeps_carers_in_one_neighbourhood(self):
+        from .rota import optimize_day
+        plan = optimize_day(self.day, carer_ids=[c.id for c in self.carers])
+        self.assertEqual(plan['visits'], 6)
+        self.assertEqual(plan['unassigned'], [])
+        self.assertLess(plan['distance_after_m'], 1000)
+        self.assertGreater(plan['distance_before_m'], 40000)
+
+    def test_selected_carers_keep_other_carers_visits(self):
+        from .rota import optimize_day
+        other = User.objects.create_user(username='rota_other', password='testpass123')
+        theirs = Appointment.objects.create(
+            title='Visit', client=self.north[0], assigned_staff=other,
+            start_time=self.start + timedelta(hours=7), end_time=self.start + timedelta(hours=8),
+        )
+        plan = optimize_day(self.day, carer_ids=[c.id for c in self.carers])
+        self.assertEqual(plan['visits'], 6)
+        self.assertNotIn(theirs.id, [change['appointment'] for change in plan['assignments']])
+
+    def test_shift_limits(self):
+        from .rota import optimize_day
+        # Carer 1 only works 08:00-10:00, so carer 0 can take just one of each later pair
+        plan = optimize_day(self.day, carer_ids=[c.id for c in self.carers],
+                            shifts={self.carers[1].id: ('08:00', '10:00')})
+        self.assertEqual(len(plan['unassigned']), 2)
+        for change in plan['assignments']:
+            if change['assigned_staff'] == self.carers[1].id:
+                visit = Appointment.objects.get(pk=change['appointment'])
+                self.assertLess(visit.start_time, self.start + timedelta(hours=2))
+
+    def test_travel_time_between_visits(self):
+        from django.test import override_settings
+        from .rota import optimize_day
+        own = [visit.id for visit in self.visits if visit.assigned_staff == self.carers[0]]  # north, south, north
+        plan = optimize_day(self.day, carer_ids=[self.carers[0].id], visit_ids=own)
+        self.assertEqual(plan['unassigned'], [])
+        # 20 km in the hour between visits needs more than 10 km/h
+        with override_settings(ROTA_TRAVEL_SPEED_KMH=10):
+            plan = optimize_day(self.day, carer_ids=[self.carers[0].id], visit_ids=own)
+        self.assertEqual(plan['unassigned'], [own[1]])
+
+    def test_api_applies_plan(self):
+        url = '/appointments/api/rota/optimize/'
+        self.api_client.force_authenticate(user=self.carers[0])
+        self.assertEqual(self.api_client.post(url, {'date': str(self.day)}, format='json').status_code,
+                         status.HTTP_403_FORBIDDEN)
+
+        self.api_client.force_authenticate(user=self.admin)
+        response = self.api_client.post(url, {'date': str(self.day), 'apply': True, 'carers': [
+            {'id': self.carers[0].id}, self.carers[1].id,
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['applied']['applied'], len(response.json()['assignments']))
+        for carer in self.carers:
+            clients = set(Appointment.objects.filter(assigned_staff=carer).values_list('client__address', flat=True))
+            self.assertEqual(len(clients), 1)
+
+        bad = self.api_client.post(url, {'date': str(self.day), 'carers': [{'id': 1, 'start': 'noon'}]}, format='json')
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('optimize_rota', date=str(self.day), apply=True, time_limit=1, stdout=out)
+        self.assertIn('Applied', out.getvalue())
+
+
+class GeofenceTestCase(TestCase):
+    """Test batch distances, live location logging and the nightly location scan"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='geo_staff', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Geo', last_name='Client', address='1 Fence Rd',
+                                                latitude=51.5, longitude=-0.1)
+        start = timezone.now() - timedelta(hours=1)
+        self.appointment = Appointment.objects.create(
+            title='Visit', client=self.client_obj, assigned_staff=self.user,
+            start_time=start, end_time=start + timedelta(hours=1),
+        )
+        self.url = f'/appointments/api/staff/appointments/{self.appointment.id}/log_location/'
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def test_batch_distances_match_scalar_haversine(self):
+        from .geo import distance_matrix, distances, geofence, haversine
+        points = [(51.5, -0.1), (51.501, -0.1), (51.51, -0.12), (52.0, 1.0)]
+        centre = (51.5, -0.1)
+        expected = [haversine(*centre, *point) for point in points]
+        for got, want in zip(distances(points, centre), expected):
+            self.assertAlmostEqual(got, want, places=6)
+        self.assertAlmostEqual(distances(points, centre)[1], 111.19, places=1)
+        self.assertEqual(distances(points, [centre] * 4), distances(points, centre))
+        self.assertEqual([row[0] for row in distance_matrix(points, [centre])], distances(points, centre))
+        measured, inside = geofence(points, centre, [150, 100, 150, 10 ** 6])
+        self.assertEqual(inside, [True, False, False, True])
+        self.assertEqual(geofence([], centre, 150), ([], []))
+        with self.assertRaises(ValueError):
+            distances(points, [centre] * 3)
+
+    def test_log_location_flags_visit_outside_geofence(self):
+        # About 1.1 km north of the client
+        response = self.api_client.post(self.url, {'log_type': 'start', 'latitude': 51.51, 'longitude': -0.1},
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.json()['within_geofence'])
+        self.assertAlmostEqual(response.json()['distance_from_client'], 1112, delta=1)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.location_flag, 'start')
+
+        # Logging again from the door clears the flag; deviations never flag
+        self.api_client.post(self.url, {'log_type': 'start', 'latitude': 51.5003, 'longitude': -0.1}, format='json')
+        self.api_client.post(self.url, {'log_type': 'deviation', 'latitude': 51.6, 'longitude': -0.1}, format='json')
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.location_flag, '')
+
+        self.api_client.post(self.url, {'log_type': 'end', 'latitude': 51.6, 'longitude': -0.1}, format='json')
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.location_flag, 'end')
+
+    def test_log_location_without_client_location(self):
+        Client.objects.filter(pk=self.client_obj.pk).update(latitude=None)
+        response = self.api_client.post(self.url, {'log_type': 'start', 'latitude': 51.5, 'longitude': -0.1},
+                                        format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.appointment.location_logs.exists())
+
+    def test_scan_remeasures_logs_and_updates_flags(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .geofence import record_logs, scan
+        record_logs(self.appointment, [
+            {'log_type': 'start', 'latitude': 51.5005, 'longitude': -0.1},
+            {'log_type': 'end', 'latitude': 51.5005, 'longitude': -0.1},
+        ])
+        other = Appointment.objects.create(
+            title='Other', client=self.client_obj, assigned_staff=self.user,
+            start_time=self.appointment.start_time, end_time=self.appointment.end_time,
+        )
+        self.appointment.location_logs.update(within_geofence=None)
+        summary = scan()
+        self.assertEqual((summary['visits'], summary['logs'], summary['updated_logs'], summary['flagged']),
+                         (2, 2, 2, 0))
+
+        # A tighter radius puts the 55 m logs outside
+        Client.objects.filter(pk=self.client_obj.pk).update(geofence_radius=50)
+        out = StringIO()
+        call_command('scan_visit_locations', all=True, batch_size=1, stdout=out)
+        self.assertIn('1 visits outside their geofence (1 flags changed)', out.getvalue())
+        self.appointment.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.appointment.location_flag, other.location_flag), ('start_end', ''))
+        self.assertFalse(self.appointment.location_logs.filter(within_geofence=True).exists())
+
+        # Nothing changes on a second run, and other days are not scanned
+        self.assertEqual(scan()['updated_logs'], 0)
+        out = StringIO()
+        call_command('scan_visit_locations', date=str(timezone.localdate() - timedelta(days=2)), stdout=out)
+        self.assertIn('Scanned 0 visits', out.getvalue())
+
+
+class TraceUploadTestCase(TestCase):
+    """Test batched GPS trace uploads"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='trace_staff', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Trace', last_name='Client', address='2 Path Ln',
+                                                latitude=51.5, longitude=-0.1)
+        self.start = timezone.now() - timedelta(hours=1)
+        self.appointment = Appointment.objects.create(
+            title='Visit', client=self.client_obj, assigned_staff=self.user,
+            start_time=self.start, end_time=self.start + timedelta(hours=1),
+        )
+        self.url = f'/appointments/api/staff/appointments/{self.appointment.id}/trace/'
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def points(self, count=240, offset=0):
+        """A fix every 5 s: 100 at the door, then walking north at about 1.1 m/s"""
+        points = []
+        for n in range(offset, offset + count):
+            latitude = 51.5 + max(0, n - 100) * 0.00005
+            points.append([(self.start + timedelta(seconds=5 * n)).timestamp(), latitude, -0.1])
+        return points
+
+    def post_gzip(self, payload, encoding='gzip'):
+        import gzip
+        return self.api_client.post(self.url, data=gzip.compress(json.dumps(payload).encode()),
+                                    content_type='application/json', HTTP_CONTENT_ENCODING=encoding)
+
+    def test_gzip_batch_is_downsampled_in_bulk(self):
+        with self.assertNumQueries(3):  # appointment, last trace point, bulk insert
+            response = self.post_gzip({'points': self.points()})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        summary = response.json()
+        self.assertEqual((summary['received'], summary['duplicates']), (240, 0))
+        self.assertLess(summary['stored'], 40)
+
+        logs = list(self.appointment.location_logs.order_by('timestamp'))
+        self.assertEqual(len(logs), summary['stored'])
+        self.assertTrue(all(log.log_type == 'trace' for log in logs))
+        self.assertEqual(logs[0].timestamp, self.start)
+        self.assertEqual(logs[-1].timestamp, self.start + timedelta(seconds=5 * 239))
+        # The boundary crossing is kept, and stored points are never far apart while moving
+        outside = [log.within_geofence for log in logs].index(False)
+        self.assertLessEqual(logs[outside].distance_from_client, 155)
+        self.assertEqual(summary['outside_geofence'], 240 - 100 - 27)
+        for a, b in zip(logs, logs[1:]):
+            self.assertLessEqual(b.timestamp - a.timestamp, timedelta(minutes=5))
+        self.assertEqual(self.appointment.location_flag, '')
+
+    def test_resent_batch_is_not_stored_twice(self):
+        first = self.api_client.post(self.url, {'points': self.points(60)}, format='json').json()
+        again = self.api_client.post(self.url, {'points': self.points(60)}, format='json').json()
+        self.assertEqual((again['duplicates'], again['stored']), (60, 0))
+        more = self.api_client.post(self.url, {'points': self.points(60, offset=50)}, format='json').json()
+        self.assertEqual(more['duplicates'], 10)
+        self.assertEqual(self.appointment.location_logs.count(), first['stored'] + more['stored'])
+
+    def test_object_points_and_errors(self):
+        iso = (self.start + timedelta(minutes=1)).isoformat()
+        response = self.api_client.post(self.url, {'points': [
+            {'timestamp': iso, 'latitude': 51.5, 'longitude': -0.1},
+        ]}, format='json')
+        self.assertEqual(response.json()['stored'], 1)
+
+        for points in [None, [[iso, 91, 0]], [[iso, 51.5]], [['yesterday', 51.5, -0.1]],
+                       [[(timezone.now() + timedelta(hours=1)).timestamp(), 51.5, -0.1]]]:
+            response = self.api_client.post(self.url, {'points': points}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, points)
+        response = self.api_client.post(self.url, data=b'not gzip', content_type='application/json',
+                                        HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.post_gzip({'points': []}, encoding='br')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        other = User.objects.create_user(username='trace_other', password='testpass123')
+        self.api_client.force_authenticate(user=other)
+        self.assertEqual(self.post_gzip({'points': self.points(5)}).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PackedTraceTestCase(TestCase):
+    """Test the delta-encoded trace storage mode"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='packed_staff', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Packed', last_name='Client', address='3 Blob St',
+                                                latitude=51.5, longitude=-0.1)
+        self.start = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        self.appointment = Appointment.objects.create(
+            title='Visit', client=self.client_obj, assigned_staff=self.user,
+            start_time=self.start, end_time=self.start + timedelta(hours=1),
+        )
+        self.base = f'/appointments/api/staff/appointments/{self.appointment.id}'
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.user)
+
+    def points(self, count, offset=0):
+        """A fix every 10 s, walking north-east 30 m at a time"""
+        return [[(self.start + timedelta(seconds=10 * n)).timestamp(), 51.5 + n * 0.0002, -0.1 + n * 0.0002]
+                for n in range(offset, offset + count)]
+
+    def read_logs(self, page_size=7):
+        """Every location log following next links, and again following previous links from the last page"""
+        pages = []
+        url = f'{self.base}/location_logs/?page_size={page_size}'
+        while url:
+            pages.append(self.api_client.get(url).json())
+            url = pages[-1]['next']
+        forward = [log for page in pages for log in page['results']]
+        backward = pages[-1]['results']
+        url = pages[-1]['previous']
+        while url:
+            page = self.api_client.get(url).json()
+            backward = page['results'] + backward
+            url = page['previous']
+        return forward, backward
+
+    def test_codec_round_trip_and_append(self):
+        from .codec import Point, decode, encode
+        points = [
+            Point(self.start + timedelta(milliseconds=1500 * n), 51.5 + n * 1e-5, -0.1 - n * 3e-6, n * 1.25, n % 3 != 0)
+            for n in range(50)
+        ]
+        data = encode(points)
+        self.assertEqual(encode(points[:20]) + encode(points[20:], previous=points[19]), data)
+        self.assertLess(len(data), 50 * 8)
+        for got, want in zip(decode(data), points):
+            self.assertEqual(got.timestamp, want.timestamp)
+            self.assertAlmostEqual(got.latitude, want.latitude, places=6)
+            self.assertAlmostEqual(got.longitude, want.longitude, places=6)
+            self.assertAlmostEqual(got.distance_from_client, want.distance_from_client, delta=0.051)
+            self.assertEqual(got.within_geofence, want.within_geofence)
+        self.assertEqual(len(list(decode(data))), 50)
+        with self.assertRaises(ValueError):
+            list(decode(data[:-1]))
+        with self.assertRaises(ValueError):
+            list(decode(b'\x07' + data[1:]))
+        with self.assertRaises(ValueError):
+            encode(points[::-1])
+
+    def test_packed_upload_and_lazy_paged_reads(self):
+        from django.test import override_settings
+        from .models import VisitTrace, VisitLocationLog
+        self.api_client.post(f'{self.base}/log_location/', {'log_type': 'start', 'latitude': 51.5, 'longitude': -0.1},
+                             format='json')
+        with override_settings(VISIT_TRACE_STORAGE='packed'):
+            first = self.api_client.post(f'{self.base}/trace/', {'points': self.points(20)}, format='json').json()
+            again = self.api_client.post(f'{self.base}/trace/', {'points': self.points(20)}, format='json').json()
+            second = self.api_client.post(f'{self.base}/trace/', {'points': self.points(10, 20)},
+                                          format='json').json()
+        self.assertEqual((first['stored'], again['stored'], again['duplicates'], second['stored']), (20, 0, 20, 10))
+        self.assertFalse(VisitLocationLog.objects.filter(log_type='trace').exists())
+        trace = VisitTrace.objects.get(appointment=self.appointment)
+        self.assertEqual(trace.point_count, 30)
+        self.assertLess(len(trace.data), 30 * 10)
+
+        with self.assertNumQueries(2):
+            page = self.api_client.get(f'{self.base}/location_logs/?page_size=5').json()
+        self.assertEqual([log['log_type'] for log in page['results']], ['trace'] * 5)
+        self.assertIsNone(page['results'][0]['id'])
+
+        forward, backward = self.read_logs()
+        self.assertEqual(forward, backward)
+        self.assertEqual(len(forward), 31)
+        timestamps = [log['timestamp'] for log in forward]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual([log['log_type'] for log in forward].count('start'), 1)
+        self.assertAlmostEqual(forward[-2]['latitude'], 51.5 + 29 * 0.0002, places=6)
+
+    def test_pack_command_moves_rows(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import VisitTrace, VisitLocationLog
+        self.api_client.post(f'{self.base}/trace/', {'points': self.points(12)}, format='json')
+        before, _ = self.read_logs()
+        self.assertEqual(VisitLocationLog.objects.filter(log_type='trace').count(), 12)
+
+        out = StringIO()
+        call_command('pack_visit_traces', batch_size=1, stdout=out)
+        self.assertIn('Packed 12 trace rows of 1 visits', out.getvalue())
+        self.assertFalse(VisitLocationLog.objects.filter(log_type='trace').exists())
+        self.assertEqual(VisitTrace.objects.get(appointment=self.appointment).point_count, 12)
+
+        after, _ = self.read_logs()
+        self.assertEqual([log['timestamp'] for log in after], [log['timestamp'] for log in before])
+        for a, b in zip(after, before):
+            self.assertAlmostEqual(a['latitude'], b['latitude'], places=6)
+            self.assertAlmostEqual(a['distance_from_client'], b['distance_from_client'], delta=0.051)
+
+        # Rows uploaded in rows mode around the packed points are merged into the trace in time order
+        VisitLocationLog.objects.create(appointment=self.appointment, log_type='trace',
+                                        timestamp=self.start - timedelta(minutes=5), latitude=51.5, longitude=-0.1,
+                                        distance_from_client=0, within_geofence=True)
+        call_command('pack_visit_traces', stdout=StringIO())
+        trace = VisitTrace.objects.get(appointment=self.appointment)
+        timestamps = [point.timestamp for point in trace.points()]
+        self.assertEqual(len(timestamps), 13)
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_benchmark_command_rolls_back(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import VisitTrace
+        out = StringIO()
+        call_command('benchmark_trace_storage', visits=2, points=30, requests=1, stdout=out)
+        self.assertIn('packed', out.getvalue())
+        self.assertFalse(VisitTrace.objects.exists())
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+class ComplianceAnalyticsTestCase(TestCase):
+    """Test the database-side visit compliance reports"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='analytics_admin', password='testpass123', role='admin',
+                                              is_staff_member=False)
+        self.carers = [User.objects.create_user(username=f'analytics_carer{i}', password='testpass123')
+                       for i in range(2)]
+        self.full_plan = Client.objects.create(first_name='Four', last_name='Items', address='1 Plan St',
+                                               care_checklist=['hygiene', 'nutrition', 'mobility', 'monitoring'])
+        self.no_plan = Client.objects.create(first_name='No', last_name='Plan', address='2 Plan St')
+        self.day = timezone.localdate() - timedelta(days=3)
+        nine = day_bounds(self.day)[0] + timedelta(hours=9)
+
+        def visit(carer, client, hour, started=None, ended=None, items=(), **fields):
+            start = nine + timedelta(hours=hour)
+            return Appointment.objects.create(
+                title='Visit', client=client, assigned_staff=self.carers[carer],
+                start_time=start, end_time=start + timedelta(hours=1),
+                actual_start_time=None if started is None else start + timedelta(minutes=started),
+                actual_end_time=None if ended is None else start + timedelta(minutes=ended),
+                checklist_items=list(items), **fields,
+            )
+        self.visits = [
+            # On time and complete
+            visit(0, self.full_plan, 0, 0, 60, ['hygiene', 'nutrition', 'mobility', 'monitoring'], status='completed'),
+            # 20 minutes late, 30 minutes short, half the checklist, started away from the client
+            visit(0, self.full_plan, 2, 20, 50, ['hygiene', 'nutrition'], status='completed', location_flag='start'),
+            # Not visited yet
+            visit(1, self.full_plan, 0),
+            # Early start, nothing on the care plan
+            visit(1, self.no_plan, 2, -5, 45, status='completed'),
+        ]
+        visit(1, self.no_plan, 4, 0, 60, status='cancelled')
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.admin)
+
+    def test_report_matches_model_properties(self):
+        from .analytics import report
+        with self.assertNumQueries(1):
+            result = report('carer', start=self.day, end=self.day + timedelta(days=1))
+        rows = {row['assigned_staff']: row for row in result['rows']}
+        first, second = rows[self.carers[0].id], rows[self.carers[1].id]
+        self.assertEqual(first['carer_username'], 'analytics_carer0')
+
+        self.assertEqual((first['visits'], first['started'], first['completed']), (2, 2, 2))
+        self.assertEqual((first['late_starts'], first['late_start_rate']), (1, 50.0))
+        self.assertEqual((first['average_start_delay_minutes'], first['max_start_delay_minutes']), (10.0, 20.0))
+        self.assertEqual((first['short_visits'], first['shortfall_minutes']), (1, 30.0))
+        self.assertEqual(first['delivered_minutes'], sum(v.duration_minutes for v in self.visits[:2]))
+        self.assertEqual(first['average_checklist_completion'],
+                         sum(v.checklist_completion_percentage for v in self.visits[:2]) / 2)
+        self.assertEqual((first['checklist_gaps'], first['geofence_flagged'], first['geofence_adherence']),
+                         (1, 1, 50.0))
+
+        # The cancelled visit is left out; the unvisited one only counts as a visit
+        self.assertEqual((second['visits'], second['started'], second['completed']), (2, 1, 1))
+        self.assertEqual((second['late_starts'], second['average_start_delay_minutes']), (0, -5.0))
+        self.assertEqual((second['short_visits'], second['delivered_minutes']), (1, self.visits[3].duration_minutes))
+        self.assertEqual(second['average_checklist_completion'], 0)
+
+    def test_client_week_and_total_groups(self):
+        from .analytics import report
+        clients = report('client', start=self.day, end=self.day + timedelta(days=1), carer_ids=[self.carers[0].id])
+        self.assertEqual([row['client'] for row in clients['rows']], [self.full_plan.id])
+        weeks = report('week', start=self.day - timedelta(days=7), end=self.day + timedelta(days=7))
+        monday = self.day - timedelta(days=self.day.weekday())
+        self.assertEqual([(row['week'], row['visits']) for row in weeks['rows']], [(monday.isoformat(), 4)])
+        total, = report('all', start=self.day, end=self.day + timedelta(days=1))['rows']
+        self.assertEqual((total['visits'], total['late_starts'], total['short_visits']), (4, 1, 2))
+        self.assertEqual(total['checklist_gaps'], 2)
+        strict, = report('all', start=self.day, end=self.day + timedelta(days=1), checklist_threshold=50)['rows']
+        self.assertEqual(strict['checklist_gaps'], 1)
+        self.assertEqual(report('all', start=self.day + timedelta(days=1))['rows'], [])
+        with self.assertRaises(ValueError):
+            report('month')
+
+    def test_api_and_csv_export(self):
+        import csv
+        import io
+        url = '/appointments/api/analytics/compliance/'
+        params = {'group': 'client', 'start': str(self.day), 'end': str(self.day + timedelta(days=1))}
+        response = self.api_client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['rows']), 2)
+
+        export = self.api_client.get(url + 'export/', params)
+        self.assertEqual(export.status_code, status.HTTP_200_OK)
+        self.assertEqual(export['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(export.content.decode())))
+        self.assertEqual([row['client_last_name'] for row in rows], ['Items', 'Plan'])
+        self.assertEqual(rows[0]['late_starts'], '1')
+
+        self.assertEqual(self.api_client.get(url, {'group': 'month'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.api_client.get(url, {'start': '2024-02-30'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.api_client.get(url, {'carer': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.api_client.force_authenticate(user=self.carers[0])
+        self.assertEqual(self.api_client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.api_client.get(url + 'export/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ChecklistCompletionTestCase(TestCase):
+    """Test the stored checklist completion counters"""
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(username='checklist_staff', password='testpass123')
+        self.client_obj = Client.objects.create(first_name='Check', last_name='List', address='1 List St',
+                                                care_checklist=['hygiene', 'nutrition', 'mobility', 'monitoring'])
+        start = timezone.now().replace(microsecond=0) + timedelta(hours=1)
+        self.appointment = Appointment.objects.create(
+            title='Visit', client=self.client_obj, assigned_staff=self.staff,
+            start_time=start, end_time=start + timedelta(hours=1), checklist_items=['hygiene'],
+        )
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.staff)
+
+    def test_saved_and_updated_by_checklist_endpoint(self):
+        self.assertEqual(self.appointment.checklist_completed_count, 1)
+        self.assertEqual(self.appointment.checklist_completion_percentage, 25)
+        url = f'/appointments/api/staff/appointments/{self.appointment.id}/update_checklist/'
+        response = self.api_client.post(url, {'checklist_items': ['hygiene', 'nutrition', 'mobility']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['completion_percentage'], 75)
+        self.assertEqual(
+            Appointment.objects.filter(checklist_completion_percentage__lt=80).count(), 1
+        )
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.checklist_completed_count, 3)
+
+    def test_client_checklist_change_recomputes_visits(self):
+        client = Client.objects.get(pk=self.client_obj.pk)
+        client.care_checklist = ['hygiene', 'nutrition']
+        client.save()
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.checklist_completion_percentage, 50)
+
+        # Same length: nothing to recompute
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        client.care_checklist = ['hygiene', 'mobility']
+        with CaptureQueriesContext(connection) as queries:
+            client.save()
+        self.assertFalse([q for q in queries.captured_queries if 'appointment_management_appointment' in q['sql']])
+        client.care_checklist = []
+        client.save()
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.checklist_completion_percentage, 0)
+
+    def test_stale_cached_checklist_is_not_written(self):
+        from reference_cache.accessors import get_care_checklist
+        get_care_checklist(self.client_obj.pk)
+        # update() bypasses the signal that would drop the cached checklist
+        Client.objects.filter(pk=self.client_obj.pk).update(care_checklist=['hygiene', 'nutrition'])
+        self.appointment.save()
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.checklist_completion_percentage, 50)
+
+    def test_bulk_writes_and_backfill(self):
+        import io
+        from django.core.management import call_command
+        start = self.appointment.start_time + timedelta(days=1)
+        response = self.api_client.post('/appointments/api/bulk/create/', {'appointments': [{
+            'title': 'Bulk', 'client': self.client_obj.id, 'assigned_staff': self.staff.id,
+            'start_time': start.isoformat(), 'end_time': (start + timedelta(hours=1)).isoformat(),
+            'checklist_items': ['hygiene', 'nutrition'],
+        }]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        created = Appointment.objects.get(title='Bulk')
+        self.assertEqual((created.checklist_completed_count, created.checklist_completion_percentage), (2, 50))
+
+        response = self.api_client.post('/appointments/api/staff/sync/', {'appointments': [
+            {'id': self.appointment.id, 'checklist_items': ['hygiene', 'nutrition', 'mobility', 'monitoring']},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.checklist_completion_percentage, 100)
+
+        Appointment.objects.update(checklist_completed_count=0, checklist_completion_percentage=0)
+        call_command('backfill_checklist_completion', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(
+            sorted(Appointment.objects.values_list('checklist_completed_count', 'checklist_completion_percentage')),
+            [(2, 50.0), (4, 100.0)]
+        )
+
+
+class RecordExportTestCase(TestCase):
+    """Test the streaming CSV / NDJSON exports"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='export_admin', password='testpass123', role='admin',
+                                              is_staff_member=False)
+        self.carers = [User.objects.create_user(username=f'export_carer{i}', password='testpass123')
+                       for i in range(2)]
+        self.clients = [Client.objects.create(first_name=f'Export{i}', last_name='Client', address='1 Export St')
+                        for i in range(2)]
+        self.day = timezone.localdate() - timedelta(days=2)
+        nine = day_bounds(self.day)[0] + timedelta(hours=9)
+        self.appointments = [
+            Appointment.objects.create(
+                title=f'Visit {i}', client=self.clients[i % 2], assigned_staff=self.carers[i % 2],
+                start_time=nine + timedelta(days=i - 1), end_time=nine + timedelta(days=i - 1, hours=1),
+                checklist_items=['hygiene'],
+            )
+            for i in range(3)
+        ]
+        Seizure.objects.create(appointment=self.appointments[1], start_time=nine)
+        Medication.objects.create(appointment=self.appointments[1], name='Paracetamol', strength='500.00',
+                                  dose='1000.00', frequency='as_needed', route='oral')
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.admin)
+
+    def _get(self, path, **params):
+        response = self.api_client.get(f'/appointments/api/export/{path}', params)
+        content = b''.join(response.streaming_content).decode() if response.streaming else None
+        return response, content
+
+    def test_csv_filters_by_visit_date_client_and_carer(self):
+        import csv
+        import io
+        response, content = self._get('appointments.csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([row['title'] for row in rows], ['Visit 0', 'Visit 1', 'Visit 2'])
+        self.assertEqual(rows[1]['checklist_items'], '["hygiene"]')
+        self.assertEqual(rows[1]['carer_username'], 'export_carer1')
+        self.assertEqual(rows[1]['start_time'], timezone.localtime(self.appointments[1].start_time).isoformat())
+
+        _, content = self._get('appointments.csv', start=str(self.day), end=str(self.day + timedelta(days=2)),
+                               carer=self.carers[0].id)
+        self.assertEqual([row['title'] for row in csv.DictReader(io.StringIO(content))], ['Visit 2'])
+        _, content = self._get('appointments.csv', client=self.clients[1].id)
+        self.assertEqual([row['title'] for row in csv.DictReader(io.StringIO(content))], ['Visit 1'])
+
+    def test_visit_records_as_ndjson(self):
+        response, content = self._get('medications.ndjson', start=str(self.day))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['name'], rows[0]['dose']), ('Paracetamol', '1000.00'))
+        self.assertEqual((rows[0]['client_id'], rows[0]['carer_username']), (self.clients[1].id, 'export_carer1'))
+        _, content = self._get('seizures.ndjson', end=str(self.day))
+        self.assertEqual(content, '')
+
+    def test_streams_in_chunks_and_rejects_bad_requests(self):
+        from unittest import mock
+        from . import exports
+        with mock.patch.object(exports, 'FLUSH_ROWS', 1):
+            self.assertEqual(len(list(exports.stream('appointments', 'ndjson'))), 3)
+
+        self.assertEqual(self._get('visits.csv')[0].status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._get('appointments.xml')[0].status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._get('appointments.csv', start='2024-13-01')[0].status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.api_client.force_authenticate(user=self.carers[0])
+        self.assertEqual(self._get('appointments.csv')[0].status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_command(self):
+        import io
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('export_records', 'appointments', '--format', 'ndjson', '--carer', str(self.carers[1].id),
+                     stdout=out)
+        self.assertEqual([json.loads(line)['title'] for line in out.getvalue().splitlines()], ['Visit 1'])
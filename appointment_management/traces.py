@@ -0,0 +1,255 @@
+"""
+GPS trace ingestion.
+
+A device tracking a carer during a visit uploads its fixes in batches of
+timestamped points instead of one log_location request per fix. Each batch is
+measured against the client's geofence in one batch call (geo.distances,
+geo.geofence), thinned to the points the visit record needs, and written with
+one bulk_create as 'trace' VisitLocationLog rows - or, when
+VISIT_TRACE_STORAGE is 'packed', appended to the visit's VisitTrace blob (see
+codec), which location_logs decodes lazily into the same rows.
+
+A point is kept when it is the first or last of the batch, crosses the
+geofence boundary, or comes TRACE_MIN_DISTANCE_M along the path or
+TRACE_MAX_INTERVAL after the last kept point. The last stored trace point of
+the visit anchors the next batch, and points at or before it are dropped as
+duplicates, so a device can safely resend a batch it got no response for.
+"""
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .codec import Point
+from .geo import distances, geofence
+from .geofence import BATCH_SIZE, GeofenceError, client_radius, has_location
+from .models import VisitLocationLog, VisitTrace
+
+MAX_POINTS = 10000
+TRACE_MIN_DISTANCE_M = 25
+TRACE_MAX_INTERVAL = timedelta(minutes=5)
+# Fixes stamped further ahead than this are from a device with a wrong clock
+MAX_CLOCK_SKEW = timedelta(minutes=10)
+# Decoded points have no id; they are ordered after one another and before rows by
+# keyset_id = position in the trace - PACKED_ID_OFFSET, which stays put as points are appended
+PACKED_ID_OFFSET = 2 ** 40
+
+
+class TraceError(ValueError):
+    pass
+
+
+def _timestamp(value):
+    """Aware datetime from an ISO 8601 string or Unix seconds"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    if isinstance(value, str):
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            return None
+        if parsed is not None and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    return None
+
+
+def _coordinate(value, limit):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not -limit <= value <= limit:
+        return None
+    return float(value)
+
+
+def parse_points(raw):
+    """
+    (timestamp, latitude, longitude) tuples in time order from a list of
+    [timestamp, latitude, longitude] arrays or {timestamp, latitude, longitude}
+    objects. Raises TraceError naming the first invalid point.
+    """
+    if not isinstance(raw, list):
+        raise TraceError('points must be a list.')
+    if len(raw) > MAX_POINTS:
+        raise TraceError(f'At most {MAX_POINTS} points can be sent at once.')
+    latest = timezone.now() + MAX_CLOCK_SKEW
+    points = []
+    for n, point in enumerate(raw):
+        if isinstance(point, dict):
+            point = (point.get('timestamp'), point.get('latitude'), point.get('longitude'))
+        if not isinstance(point, (list, tuple)) or len(point) != 3:
+            raise TraceError(f'Point {n} must be [timestamp, latitude, longitude].')
+        timestamp, latitude, longitude = _timestamp(point[0]), _coordinate(point[1], 90), _coordinate(point[2], 180)
+        if timestamp is None or timestamp > latest:
+            raise TraceError(f'Point {n} has an invalid timestamp.')
+        if latitude is None or longitude is None:
+            raise TraceError(f'Point {n} has an invalid latitude or longitude.')
+        points.append((timestamp, latitude, longitude))
+    points.sort(key=lambda point: point[0])
+    return points
+
+
+def keep_indexes(times, steps, inside, previous=None):
+    """
+    Positions of the points worth storing.
+
+    steps[i] is the distance travelled to point i from the point before it
+    (from the `previous` stored point for i == 0). `previous` is the
+    (timestamp, within_geofence) of the last stored point, if any.
+    """
+    kept = []
+    last_time, last_inside = previous or (None, None)
+    travelled = 0.0
+    final = len(times) - 1
+    for i, timestamp in enumerate(times):
+        travelled += steps[i]
+        if (last_time is None or i == final or inside[i] != last_inside
+                or travelled >= TRACE_MIN_DISTANCE_M or timestamp - last_time >= TRACE_MAX_INTERVAL):
+            kept.append(i)
+            last_time, last_inside, travelled = timestamp, inside[i], 0.0
+    return kept
+
+
+def is_packed():
+    return settings.VISIT_TRACE_STORAGE == 'packed'
+
+
+def _last_point(appointment, trace=None):
+    """The latest stored trace point of a visit, from its rows or its packed trace"""
+    row = (
+        appointment.location_logs.filter(log_type='trace').order_by('-timestamp')
+        .values_list('timestamp', 'latitude', 'longitude', 'distance_from_client', 'within_geofence').first()
+    )
+    candidates = [point for point in (row and Point(*row), trace and trace.last_point) if point is not None]
+    return max(candidates, key=lambda point: point.timestamp, default=None)
+
+
+def ingest(appointment, raw_points):
+    """Store a batch of trace points for a visit and return what was done with them"""
+    client = appointment.client
+    if not has_location(client):
+        raise GeofenceError('The client does not have a valid location set.')
+    points = parse_points(raw_points)
+    if not is_packed():
+        return _store(appointment, points)
+    with transaction.atomic():
+        # Locked so concurrent uploads append to the blob one after another
+        trace, _ = VisitTrace.objects.select_for_update().get_or_create(appointment=appointment)
+        return _store(appointment, points, trace)
+
+
+def _store(appointment, points, trace=None):
+    received = len(points)
+    previous = _last_point(appointment, trace)
+    if previous is not None:
+        points = [point for point in points if point[0] > previous.timestamp]
+    # A fix reported twice in one batch is stored once
+    points = [point for n, point in enumerate(points) if n == 0 or point[0] != points[n - 1][0]]
+
+    summary = {'received': received, 'duplicates': received - len(points), 'stored': 0, 'outside_geofence': 0}
+    if not points:
+        return summary
+
+    client = appointment.client
+    coordinates = [(latitude, longitude) for _, latitude, longitude in points]
+    measured, inside = geofence(coordinates, (client.latitude, client.longitude), client_radius(client))
+    if previous is not None:
+        steps = distances(coordinates, [(previous.latitude, previous.longitude)] + coordinates[:-1])
+    else:
+        steps = [0.0] + distances(coordinates[1:], coordinates[:-1])
+    kept = keep_indexes(
+        [point[0] for point in points], steps, inside,
+        previous=None if previous is None else (previous.timestamp, previous.within_geofence),
+    )
+    stored = [Point(*points[i], measured[i], inside[i]) for i in kept]
+
+    if trace is not None:
+        trace.append(stored)
+        trace.save()
+    else:
+        VisitLocationLog.objects.bulk_create([
+            VisitLocationLog(appointment=appointment, log_type='trace', **point._asdict()) for point in stored
+        ], batch_size=BATCH_SIZE)
+    summary['stored'] = len(stored)
+    summary['outside_geofence'] = sum(1 for within in inside if not within)
+    return summary
+
+
+def _packed_log(trace, n, point):
+    log = VisitLocationLog(appointment_id=trace.appointment_id, log_type='trace', **point._asdict())
+    log.keyset_id = n - PACKED_ID_OFFSET
+    return log
+
+
+def packed_logs(trace, after=None, reverse=False, limit=None):
+    """
+    Unsaved 'trace' VisitLocationLog rows decoded from a packed trace, in
+    (timestamp, keyset_id) order - descending when `reverse` - past the keyset
+    position `after`. Decoding stops as soon as a forward page is full.
+    """
+    after = None if after is None else (after[0], after[1])
+    if reverse:
+        page = deque(maxlen=limit)
+        for n, point in enumerate(trace.points()):
+            if after is not None and (point.timestamp, n - PACKED_ID_OFFSET) >= after:
+                break
+            page.append((n, point))
+        return [_packed_log(trace, n, point) for n, point in reversed(page)]
+
+    logs = []
+    for n, point in enumerate(trace.points()):
+        if after is not None and (point.timestamp, n - PACKED_ID_OFFSET) <= after:
+            continue
+        if limit is not None and len(logs) >= limit:
+            break
+        logs.append(_packed_log(trace, n, point))
+    return logs
+
+
+def pack(appointment_ids):
+    """
+    Move the 'trace' rows of the given visits into their packed traces, merging
+    with points already packed. Returns the number of rows moved.
+    """
+    rows = VisitLocationLog.objects.filter(appointment_id__in=appointment_ids, log_type='trace').order_by(
+        'appointment_id', 'timestamp', 'id'
+    ).values_list('pk', 'appointment_id', 'timestamp', 'latitude', 'longitude',
+                  'distance_from_client', 'within_geofence')
+    moved = []
+    points = defaultdict(list)
+    for pk, appointment_id, *point in rows:
+        moved.append(pk)
+        points[appointment_id].append(Point(*point))
+    if not moved:
+        return 0
+
+    with transaction.atomic():
+        traces = VisitTrace.objects.select_for_update().in_bulk(points, field_name='appointment_id')
+        created, updated = [], []
+        for appointment_id, new_points in points.items():
+            trace = traces.get(appointment_id)
+            if trace is None:
+                trace = VisitTrace(appointment_id=appointment_id)
+                created.append(trace)
+            else:
+                updated.append(trace)
+                if trace.last_point is not None and new_points[0].timestamp <= trace.last_timestamp:
+                    # Rows older than the packed tail: re-encode the whole trace in time order
+                    new_points = sorted([*trace.points(), *new_points], key=lambda point: point.timestamp)
+                    trace.last_timestamp, trace.point_count = None, 0
+            trace.append(new_points)
+        VisitTrace.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        now = timezone.now()
+        for trace in updated:
+            trace.updated_at = now
+        VisitTrace.objects.bulk_update(updated, [
+            'data', 'point_count', 'last_timestamp', 'last_latitude', 'last_longitude',
+            'last_distance_from_client', 'last_within_geofence', 'updated_at',
+        ], batch_size=BATCH_SIZE)
+        for start in range(0, len(moved), BATCH_SIZE):
+            VisitLocationLog.objects.filter(pk__in=moved[start:start + BATCH_SIZE]).delete()
+    return len(moved)
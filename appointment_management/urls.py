@@ -5,6 +5,7 @@ from . import views
 # Create router for API viewsets
 router = DefaultRouter()
 router.register(r'api/staff/appointments', views.StaffAppointmentViewSet, basename='staff-appointment')
+router.register(r'api/staff/series', views.StaffAppointmentSeriesViewSet, basename='staff-appointment-series')
 router.register(r'api/staff/seizures', views.SeizureViewSet, basename='staff-seizure')
 router.register(r'api/staff/incidents', views.IncidentViewSet, basename='staff-incident')
 router.register(r'api/staff/medications', views.MedicationViewSet, basename='staff-medication')
@@ -30,6 +31,21 @@ urlpatterns += [
     
     # Mobile sync endpoint
     path('api/staff/sync/', views.MobileSyncAPIView.as_view(), name='mobile-sync'),
+    path('api/staff/sync/changes/', views.DeltaSyncAPIView.as_view(), name='delta-sync'),
+
+    # Bulk create / reschedule / reassign / cancel
+    path('api/bulk/<str:operation>/', views.BulkAppointmentAPIView.as_view(), name='bulk-appointments'),
+
+    # Admin rota planning
+    path('api/rota/optimize/', views.RotaOptimizeAPIView.as_view(), name='rota-optimize'),
+
+    # Admin compliance analytics
+    path('api/analytics/compliance/', views.ComplianceReportAPIView.as_view(), name='compliance-report'),
+    path('api/analytics/compliance/export/', views.ComplianceReportAPIView.as_view(export=True),
+         name='compliance-report-export'),
+
+    # Admin record exports
+    path('api/export/<slug:dataset>.<slug:file_format>', views.RecordExportAPIView.as_view(), name='record-export'),
     
     # Include DRF browsable API
     path('api-auth/', include('rest_framework.urls')),
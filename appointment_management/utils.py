@@ -0,0 +1,42 @@
+import base64
+import binascii
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def day_bounds(day, days=1):
+    """
+    Return the half-open [start, end) datetime range covering `days` local dates from `day`.
+
+    Filtering on start_time__gte/__lt with these bounds lets the database use the
+    start_time indexes, which a start_time__date lookup (a cast per row) cannot.
+    """
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=days)
+
+
+def today_bounds():
+    return day_bounds(timezone.localdate())
+
+
+def week_bounds():
+    """Monday to Sunday of the current week"""
+    today = timezone.localdate()
+    return day_bounds(today - timedelta(days=today.weekday()), days=7)
+
+
+def encode_token(state):
+    """Encode a JSON-serializable value as an opaque, URL-safe token"""
+    raw = json.dumps(state, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Reverse encode_token, raising ValueError if the token is malformed"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise ValueError('Malformed token')
@@ -3,7 +3,7 @@ from django.contrib import messages
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
@@ -13,15 +13,34 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db.models import Count, Max, Prefetch
 from datetime import datetime, timedelta
+import csv
 import json
 from django.contrib.auth import get_user_model
-import math
-from .models import Appointment, Seizure, Incident, Medication, BodyMap, VisitLocationLog
+from visit_notes.models import Note
+from .models import Appointment, AppointmentSeries, Seizure, Incident, Medication, BodyMap, VisitLocationLog, VisitTrace
+from .conditional import collection_state, conditional_get
+from .analytics import columns as compliance_columns, report as compliance_report
+from .bulk import ADMIN_OPERATIONS, OPERATIONS as BULK_OPERATIONS, BulkAppointmentEngine, BulkOperationError, is_admin
+from .conflicts import find_conflicts
+from .dashboard import get_staff_dashboard
+from .exports import FORMATS as EXPORT_FORMATS, ExportError, stream as stream_export
+from .geofence import GeofenceError, record_logs
+from .pagination import KeysetListMixin
+from .parsers import CompressedJSONParser
+from .delta import DEFAULT_PAGE_SIZE as DELTA_PAGE_SIZE, InvalidCursor, get_changes
+from .sync import MobileSyncEngine
+from .recurrence import expand, materialize
+from .rota import apply_plan, optimize_day
+from .traces import TraceError, ingest as ingest_trace, packed_logs
+from .utils import day_bounds, today_bounds, week_bounds
 from .forms import AppointmentForm, SeizureForm, IncidentForm, MedicationForm, BodyMapForm
 from .serializers import (
-    AppointmentSerializer, SeizureSerializer, IncidentSerializer, 
-    MedicationSerializer, BodyMapSerializer, VisitLocationLogSerializer
+    AppointmentSerializer, AppointmentSeriesSerializer, SeizureSerializer, IncidentSerializer,
+    MedicationSerializer, BodyMapSerializer, VisitLocationLogSerializer,
+    ConflictSerializer, ProposedVisitSerializer
 )
 
 User = get_user_model()
@@ -77,18 +96,85 @@ class AppointmentDeleteView(LoginRequiredMixin, DeleteView):
 
 
 # API Views for Mobile App
-class StaffAppointmentViewSet(viewsets.ModelViewSet):
+# Aggregates describing a serialized appointment list; the client rows are
+# included because their name, address and checklist are part of each row.
+APPOINTMENT_LIST_STATE = {
+    'count': Count('pk'),
+    'latest': Max('updated_at'),
+    'clients_latest': Max('client__updated_at'),
+}
+
+
+def _with_series_state(view, state):
+    """Add the staff member's series to a list state, as their occurrences are listed too"""
+    if state is not None:
+        series = view.staff_series()
+        state['series'] = len(series)
+        state['series_latest'] = max((s.updated_at for s in series), default=None)
+    return state
+
+
+def _with_window(state, bounds):
+    """Add the bounds of a moving window to a list state, so the ETag changes when the window does"""
+    if state is not None:
+        state['window'] = '/'.join(bound.isoformat() for bound in bounds)
+    return state
+
+
+def _today_state(view, request):
+    state = collection_state(view.today_queryset(), **APPOINTMENT_LIST_STATE)
+    return _with_window(_with_series_state(view, state), today_bounds())
+
+
+def _week_state(view, request):
+    state = collection_state(view.week_queryset(), **APPOINTMENT_LIST_STATE)
+    return _with_window(_with_series_state(view, state), week_bounds())
+
+
+def _details_state(view, request, pk=None):
+    state = collection_state(
+        view.get_queryset().filter(pk=pk),
+        count=Count('pk', distinct=True),
+        latest=Max('updated_at'),
+        client_latest=Max('client__updated_at'),
+        invoice_group_latest=Max('client__invoice_group__updated_at'),
+        notes_count=Count('notes', distinct=True),
+        notes_latest=Max('notes__updated_at'),
+    )
+    # Unknown or foreign appointments fall through to the usual 404
+    return state if state and state['count'] else None
+
+
+class StaffAppointmentViewSet(KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for staff to manage their appointments
+
+    today, week, upcoming and windowed lists also return the not yet
+    materialized occurrences of the staff member's recurring series (id null,
+    series and occurrence_start set); see StaffAppointmentSeriesViewSet.
     """
     serializer_class = AppointmentSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('start_time', 'id')
 
     def get_queryset(self):
         """Filter appointments for the authenticated staff member"""
-        if self.request.user.is_staff_member:
-            return Appointment.objects.filter(assigned_staff=self.request.user).order_by('start_time')
-        return Appointment.objects.none()
+        if not self.request.user.is_staff_member:
+            return Appointment.objects.none()
+        # Serialized rows read client and staff details from the reference cache,
+        # only the actions using the client row itself join it
+        queryset = Appointment.objects.filter(
+            assigned_staff=self.request.user
+        ).order_by('start_time')
+        if self.action in ('log_location', 'trace'):
+            queryset = queryset.select_related('client')
+        elif self.action == 'location_logs':
+            queryset = queryset.select_related('trace')
+        elif self.action == 'details':
+            queryset = queryset.select_related('client__invoice_group').prefetch_related(
+                Prefetch('notes', queryset=Note.objects.select_related('uploaded_by'))
+            )
+        return queryset
 
     @action(detail=True, methods=['post'])
     def start_visit(self, request, pk=None):
@@ -106,9 +192,8 @@ class StaffAppointmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         # Check for other in-progress visits for this staff member
-        staff = appointment.assigned_staff
         in_progress = Appointment.objects.filter(
-            assigned_staff=staff,
+            assigned_staff_id=appointment.assigned_staff_id,
             status='in_progress',
             actual_start_time__isnull=False,
             actual_end_time__isnull=True
@@ -173,16 +258,71 @@ class StaffAppointmentViewSet(viewsets.ModelViewSet):
             'completion_percentage': appointment.checklist_completion_percentage
         })
 
+    def staff_series(self):
+        """The staff member's recurring series, loaded once per request"""
+        if not hasattr(self, '_staff_series'):
+            if self.request.user.is_staff_member:
+                self._staff_series = list(AppointmentSeries.objects.filter(assigned_staff=self.request.user))
+            else:
+                self._staff_series = []
+        return self._staff_series
+
+    def occurrences(self, window_start, window_end=None):
+        """Keyset `extra` provider merging series occurrences in the window into a page"""
+        def extra(position, reverse, limit):
+            return expand(self.staff_series(), window_start, window_end, after=position, reverse=reverse, limit=limit)
+        return extra
+
+    def requested_window(self):
+        """(start, end) from the ?start= / ?end= parameters (dates or datetimes), either may be None"""
+        bounds = []
+        for param in ('start', 'end'):
+            value = self.request.query_params.get(param)
+            if not value:
+                bounds.append(None)
+                continue
+            parsed = parse_datetime(value)
+            if parsed is None:
+                day = parse_date(value)
+                if day is None:
+                    raise serializers.ValidationError({param: 'Enter a valid date or datetime.'})
+                parsed = day_bounds(day)[0]
+            elif timezone.is_naive(parsed):
+                parsed = timezone.make_aware(parsed)
+            bounds.append(parsed)
+        return tuple(bounds)
+
+    def list(self, request, *args, **kwargs):
+        """All appointments; with ?start= (and optionally ?end=) also the series occurrences in that window"""
+        window_start, window_end = self.requested_window()
+        queryset = self.filter_queryset(self.get_queryset())
+        if window_end is not None:
+            queryset = queryset.filter(start_time__lt=window_end)
+        if window_start is None:
+            return self.keyset_response(queryset)
+        queryset = queryset.filter(start_time__gte=window_start)
+        return self.keyset_response(queryset, extra=self.occurrences(window_start, window_end))
+
+    def today_queryset(self):
+        day_start, day_end = today_bounds()
+        return self.get_queryset().filter(
+            start_time__gte=day_start,
+            start_time__lt=day_end
+        ).order_by('start_time')
+
+    def week_queryset(self):
+        # Monday 00:00 up to (not including) next Monday 00:00
+        week_start, week_end = week_bounds()
+        return self.get_queryset().filter(
+            start_time__gte=week_start,
+            start_time__lt=week_end
+        ).order_by('start_time')
+
     @action(detail=False, methods=['get'])
+    @conditional_get(_today_state, last_modified=False)
     def today(self, request):
         """Get today's appointments for the staff member"""
-        today = timezone.now().date()
-        queryset = self.get_queryset().filter(
-            start_time__date=today
-        ).order_by('start_time')
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.keyset_response(self.today_queryset(), extra=self.occurrences(*today_bounds()))
 
     @action(detail=False, methods=['get'])
     def upcoming(self, request):
@@ -190,37 +330,45 @@ class StaffAppointmentViewSet(viewsets.ModelViewSet):
         now = timezone.now()
         queryset = self.get_queryset().filter(
             start_time__gte=now
-        ).order_by('start_time')[:10]  # Next 10 appointments
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        )
+        # Next 10 appointments per page
+        return self.keyset_response(queryset, page_size=10, extra=self.occurrences(now))
+
+    @action(detail=False, methods=['post'])
+    def check_conflicts(self, request):
+        """Report every double-booking of a batch of proposed visits for the staff member"""
+        serializer = ProposedVisitSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        proposals = [
+            Appointment(
+                pk=item.get('id'),
+                assigned_staff=request.user,
+                start_time=item['start_time'],
+                end_time=item['end_time'],
+                series_id=item.get('series'),
+                occurrence_start=item.get('occurrence_start'),
+            )
+            for item in serializer.validated_data
+        ]
+        conflicts = find_conflicts(proposals)
+        return Response({'conflicts': ConflictSerializer(conflicts, many=True).data})
 
     @action(detail=False, methods=['get'])
     def in_progress(self, request):
         """Get currently in-progress appointments for the staff member"""
         queryset = self.get_queryset().filter(
             status='in_progress'
-        ).order_by('start_time')
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        )
+        return self.keyset_response(queryset)
 
     @action(detail=False, methods=['get'])
+    @conditional_get(_week_state, last_modified=False)
     def week(self, request):
         """Get this week's appointments for the staff member"""
-        today = timezone.now().date()
-        # Start of week (Monday)
-        start_of_week = today - timedelta(days=today.weekday())
-        # End of week (Sunday)
-        end_of_week = start_of_week + timedelta(days=6)
-        queryset = self.get_queryset().filter(
-            start_time__date__gte=start_of_week,
-            start_time__date__lte=end_of_week
-        ).order_by('start_time')
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.keyset_response(self.week_queryset(), extra=self.occurrences(*week_bounds()))
 
     @action(detail=True, methods=['get'])
+    @conditional_get(_details_state)
     def details(self, request, pk=None):
         """Get all details for a single appointment, including client and notes"""
         appointment = self.get_object()
@@ -244,58 +392,118 @@ class StaffAppointmentViewSet(viewsets.ModelViewSet):
             longitude = float(longitude)
         except ValueError:
             return Response({'error': 'Latitude and longitude must be valid numbers.'}, status=status.HTTP_400_BAD_REQUEST)
-        client = appointment.client
-        if not client.latitude or not client.longitude:
+        try:
+            log, = record_logs(appointment, [{'log_type': log_type, 'latitude': latitude, 'longitude': longitude}])
+        except GeofenceError:
             return Response({'error': 'The client does not have a valid location set. Please contact your administrator.'}, status=status.HTTP_400_BAD_REQUEST)
-        def haversine(lat1, lon1, lat2, lon2):
-            R = 6371000  # meters
-            phi1 = math.radians(lat1)
-            phi2 = math.radians(lat2)
-            dphi = math.radians(lat2 - lat1)
-            dlambda = math.radians(lon2 - lon1)
-            a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-            return R * c
-        distance = haversine(client.latitude, client.longitude, latitude, longitude)
-        log = VisitLocationLog.objects.create(
-            appointment=appointment,
-            log_type=log_type,
-            latitude=latitude,
-            longitude=longitude,
-            distance_from_client=distance
-        )
         serializer = VisitLocationLogSerializer(log)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, methods=['post'], parser_classes=[CompressedJSONParser])
+    def trace(self, request, pk=None):
+        """Upload a batch of GPS points recorded during the visit; the body may be gzip-compressed"""
+        appointment = self.get_object()
+        points = request.data.get('points') if isinstance(request.data, dict) else None
+        try:
+            summary = ingest_trace(appointment, points)
+        except GeofenceError:
+            return Response({'error': 'The client does not have a valid location set. Please contact your administrator.'}, status=status.HTTP_400_BAD_REQUEST)
+        except TraceError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(summary, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['get'])
     def location_logs(self, request, pk=None):
-        """Get all location logs for a visit"""
+        """Get all location logs for a visit, with the points of its packed trace (id null) merged in"""
         appointment = self.get_object()
-        logs = appointment.location_logs.all().order_by('timestamp')
-        serializer = VisitLocationLogSerializer(logs, many=True)
-        return Response(serializer.data)
+        try:
+            trace = appointment.trace
+        except VisitTrace.DoesNotExist:
+            trace = None
+
+        def extra(position, reverse, limit):
+            return packed_logs(trace, after=position, reverse=reverse, limit=limit)
+        return self.keyset_response(
+            appointment.location_logs.all(), VisitLocationLogSerializer, ordering=('timestamp', 'id'),
+            extra=None if trace is None else extra,
+        )
 
     @action(detail=True, methods=['get'])
     def seizures(self, request, pk=None):
         """List all seizures for this appointment, including duration."""
         appointment = self.get_object()
-        seizures = appointment.seizures.all().order_by('start_time')
-        from .serializers import SeizureSerializer
-        serializer = SeizureSerializer(seizures, many=True)
-        return Response(serializer.data)
+        return self.keyset_response(
+            appointment.seizures.all(), SeizureSerializer, ordering=('start_time', 'id')
+        )
+
 
+class StaffAppointmentSeriesViewSet(KeysetListMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint listing the staff member's recurring series.
 
-class SeizureViewSet(viewsets.ModelViewSet):
+    Occurrences are turned into real appointments with `materialize` before
+    they are started or edited (through the appointment endpoints), or with
+    `cancel_occurrence`.
+    """
+    serializer_class = AppointmentSeriesSerializer
+    permission_classes = [IsAuthenticated]
+    keyset_ordering = ('start_time', 'id')
+
+    def get_queryset(self):
+        if not self.request.user.is_staff_member:
+            return AppointmentSeries.objects.none()
+        return AppointmentSeries.objects.filter(assigned_staff=self.request.user)
+
+    def _materialize(self, request, **changes):
+        series = self.get_object()
+        occurrence_start = parse_datetime(str(request.data.get('occurrence_start', '')))
+        try:
+            if occurrence_start is None:
+                raise ValueError
+            return materialize(series, occurrence_start, **changes)
+        except ValueError:
+            raise serializers.ValidationError(
+                {'occurrence_start': 'Must be the start time of an occurrence of this series.'}
+            )
+
+    @action(detail=True, methods=['post'])
+    def materialize(self, request, pk=None):
+        """Turn an occurrence into an appointment that can be started or edited"""
+        appointment, created = self._materialize(request)
+        return Response(
+            AppointmentSerializer(appointment).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    @action(detail=True, methods=['post'])
+    def cancel_occurrence(self, request, pk=None):
+        """Cancel a single occurrence of the series"""
+        appointment, created = self._materialize(request, status='cancelled')
+        if appointment.status != 'cancelled':
+            if appointment.actual_start_time:
+                return Response(
+                    {'error': 'This visit has already been started and cannot be cancelled.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            appointment.status = 'cancelled'
+            appointment.save()
+        return Response(AppointmentSerializer(appointment).data)
+
+
+class SeizureViewSet(KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing seizures
     """
     serializer_class = SeizureSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('-start_time', '-id')
 
     def get_queryset(self):
         """Filter seizures for appointments assigned to the authenticated staff member"""
         if self.request.user.is_staff_member:
-            return Seizure.objects.filter(appointment__assigned_staff=self.request.user).order_by('-start_time')
+            return Seizure.objects.filter(
+                appointment__assigned_staff=self.request.user
+            ).select_related('appointment').order_by('-start_time')
         return Seizure.objects.none()
 
     def perform_create(self, serializer):
@@ -326,17 +534,20 @@ class SeizureViewSet(viewsets.ModelViewSet):
         })
 
 
-class IncidentViewSet(viewsets.ModelViewSet):
+class IncidentViewSet(KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing incidents
     """
     serializer_class = IncidentSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('-time', '-id')
 
     def get_queryset(self):
         """Filter incidents for appointments assigned to the authenticated staff member"""
         if self.request.user.is_staff_member:
-            return Incident.objects.filter(appointment__assigned_staff=self.request.user).order_by('-time')
+            return Incident.objects.filter(
+                appointment__assigned_staff=self.request.user
+            ).select_related('appointment').order_by('-time')
         return Incident.objects.none()
 
     def perform_create(self, serializer):
@@ -352,23 +563,24 @@ class IncidentViewSet(viewsets.ModelViewSet):
         thirty_days_ago = timezone.now() - timedelta(days=30)
         queryset = self.get_queryset().filter(
             time__gte=thirty_days_ago
-        ).order_by('-time')
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        )
+        return self.keyset_response(queryset)
 
 
-class MedicationViewSet(viewsets.ModelViewSet):
+class MedicationViewSet(KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing medications
     """
     serializer_class = MedicationSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         """Filter medications for appointments assigned to the authenticated staff member"""
         if self.request.user.is_staff_member:
-            return Medication.objects.filter(appointment__assigned_staff=self.request.user).order_by('-created_at')
+            return Medication.objects.filter(
+                appointment__assigned_staff=self.request.user
+            ).select_related('appointment').order_by('-created_at')
         return Medication.objects.none()
 
     def perform_create(self, serializer):
@@ -387,33 +599,24 @@ class MedicationViewSet(viewsets.ModelViewSet):
                 {'error': 'appointment_id parameter is required'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        try:
-            staff = User.objects.get(user=self.request.user)
-            queryset = self.get_queryset().filter(
-                appointment_id=appointment_id,
-                appointment__assigned_staff=staff
-            )
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
-        except Appointment.DoesNotExist:
-            return Response(
-                {'error': 'Appointment not found'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
+        # get_queryset already limits rows to the staff member's appointments
+        return self.keyset_response(self.get_queryset().filter(appointment_id=appointment_id))
 
 
-class BodyMapViewSet(viewsets.ModelViewSet):
+class BodyMapViewSet(KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing body maps
     """
     serializer_class = BodyMapSerializer
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('-date_recorded', '-id')
 
     def get_queryset(self):
         """Filter body maps for appointments assigned to the authenticated staff member"""
         if self.request.user.is_staff_member:
-            return BodyMap.objects.filter(appointment__assigned_staff=self.request.user).order_by('-date_recorded')
+            return BodyMap.objects.filter(
+                appointment__assigned_staff=self.request.user
+            ).select_related('appointment').order_by('-date_recorded')
         return BodyMap.objects.none()
 
     def perform_create(self, serializer):
@@ -434,20 +637,8 @@ class BodyMapViewSet(viewsets.ModelViewSet):
                 {'error': 'appointment_id parameter is required'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        try:
-            staff = User.objects.get(user=self.request.user)
-            queryset = self.get_queryset().filter(
-                appointment_id=appointment_id,
-                appointment__assigned_staff=staff
-            )
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
-        except Appointment.DoesNotExist:
-            return Response(
-                {'error': 'Appointment not found'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
+        # get_queryset already limits rows to the staff member's appointments
+        return self.keyset_response(self.get_queryset().filter(appointment_id=appointment_id))
 
 
 class StaffDashboardAPIView(APIView):
@@ -464,72 +655,7 @@ class StaffDashboardAPIView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        today = timezone.now().date()
-        now = timezone.now()
-
-        # Today's appointments
-        today_appointments = Appointment.objects.filter(
-            assigned_staff=request.user,
-            start_time__date=today
-        ).order_by('start_time')
-
-        # In-progress appointments
-        in_progress_appointments = Appointment.objects.filter(
-            assigned_staff=request.user,
-            status='in_progress'
-        )
-
-        # Upcoming appointments (next 7 days)
-        upcoming_appointments = Appointment.objects.filter(
-            assigned_staff=request.user,
-            start_time__gte=now,
-            start_time__lte=now + timedelta(days=7)
-        ).order_by('start_time')
-
-        # Recent incidents (last 7 days)
-        recent_incidents = Incident.objects.filter(
-            appointment__assigned_staff=request.user,
-            time__gte=now - timedelta(days=7)
-        ).order_by('-time')
-
-        # Recent seizures (last 7 days)
-        recent_seizures = Seizure.objects.filter(
-            appointment__assigned_staff=request.user,
-            start_time__gte=now - timedelta(days=7)
-        ).order_by('-start_time')
-
-        # Prepare user data
-        user_data = {
-            'id': request.user.id,
-            'username': request.user.username,
-            'first_name': request.user.first_name,
-            'last_name': request.user.last_name,
-            'full_name': request.user.full_name,
-            'email': request.user.email,
-            'phone': request.user.phone,
-            'role': request.user.role,
-            'role_display': request.user.get_role_display(),
-            'is_active': request.user.is_active,
-            'is_staff_member': request.user.is_staff_member,
-        }
-
-        dashboard_data = {
-            'staff': user_data,
-            'today_appointments': AppointmentSerializer(today_appointments, many=True).data,
-            'in_progress_appointments': AppointmentSerializer(in_progress_appointments, many=True).data,
-            'upcoming_appointments': AppointmentSerializer(upcoming_appointments, many=True).data,
-            'recent_incidents': IncidentSerializer(recent_incidents, many=True).data,
-            'recent_seizures': SeizureSerializer(recent_seizures, many=True).data,
-            'stats': {
-                'today_count': today_appointments.count(),
-                'in_progress_count': in_progress_appointments.count(),
-                'upcoming_count': upcoming_appointments.count(),
-                'recent_incidents_count': recent_incidents.count(),
-                'recent_seizures_count': recent_seizures.count(),
-            }
-        }
-
-        return Response(dashboard_data)
+        return Response(get_staff_dashboard(request.user))
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -547,67 +673,185 @@ class MobileSyncAPIView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        sync_data = request.data
-        results = {
-            'appointments_updated': 0,
-            'seizures_created': 0,
-            'incidents_created': 0,
-            'medications_created': 0,
-            'body_maps_created': 0,
-            'errors': []
-        }
-
-        # Sync appointments
-        if 'appointments' in sync_data:
-            for appointment_data in sync_data['appointments']:
-                try:
-                    appointment = Appointment.objects.get(
-                        id=appointment_data['id'],
-                        assigned_staff=request.user
-                    )
-                    serializer = AppointmentSerializer(appointment, data=appointment_data, partial=True)
-                    if serializer.is_valid():
-                        serializer.save()
-                        results['appointments_updated'] += 1
-                    else:
-                        results['errors'].append(f"Appointment {appointment_data['id']}: {serializer.errors}")
-                except Appointment.DoesNotExist:
-                    results['errors'].append(f"Appointment {appointment_data['id']}: Not found")
-
-        # Sync seizures
-        if 'seizures' in sync_data:
-            for seizure_data in sync_data['seizures']:
-                try:
-                    serializer = SeizureSerializer(data=seizure_data)
-                    if serializer.is_valid():
-                        # Ensure appointment belongs to user
-                        appointment = serializer.validated_data['appointment']
-                        if appointment.assigned_staff == request.user:
-                            serializer.save()
-                            results['seizures_created'] += 1
-                        else:
-                            results['errors'].append(f"Seizure: Appointment not assigned to user")
-                    else:
-                        results['errors'].append(f"Seizure: {serializer.errors}")
-                except Exception as e:
-                    results['errors'].append(f"Seizure: {str(e)}")
-
-        # Sync incidents
-        if 'incidents' in sync_data:
-            for incident_data in sync_data['incidents']:
-                try:
-                    serializer = IncidentSerializer(data=incident_data)
-                    if serializer.is_valid():
-                        # Ensure appointment belongs to user
-                        appointment = serializer.validated_data['appointment']
-                        if appointment.assigned_staff == request.user:
-                            serializer.save()
-                            results['incidents_created'] += 1
-                        else:
-                            results['errors'].append(f"Incident: Appointment not assigned to user")
-                    else:
-                        results['errors'].append(f"Incident: {serializer.errors}")
-                except Exception as e:
-                    results['errors'].append(f"Incident: {str(e)}")
-
+        results = MobileSyncEngine(request.user, request.data).run()
         return Response(results)
+
+
+class BulkAppointmentAPIView(APIView):
+    """
+    API endpoint creating, rescheduling, reassigning or cancelling many appointments at once
+
+    Admins may act on any appointment; staff members only on their own, and
+    only admins may reassign. The body is {"appointments": [...], "atomic": bool}.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, operation):
+        if operation not in BULK_OPERATIONS:
+            return Response({'error': f'Unknown operation: {operation}'}, status=status.HTTP_404_NOT_FOUND)
+        admin = is_admin(request.user)
+        if not (admin or request.user.is_staff_member) or (operation in ADMIN_OPERATIONS and not admin):
+            return Response(
+                {'error': 'You do not have permission to perform this operation'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        data = request.data if isinstance(request.data, dict) else {}
+        try:
+            engine = BulkAppointmentEngine(
+                request.user, operation, data.get('appointments'), atomic=bool(data.get('atomic'))
+            )
+        except BulkOperationError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        results = engine.run()
+        failed_outright = results['failed'] and not results['applied']
+        return Response(results, status=status.HTTP_400_BAD_REQUEST if failed_outright else status.HTTP_200_OK)
+
+
+class RotaOptimizeAPIView(APIView):
+    """
+    API endpoint planning (and optionally applying) the carer assignment of a day's visits
+
+    Body: {"date": "YYYY-MM-DD", "carers": [id or {"id", "start": "HH:MM", "end": "HH:MM"}],
+    "visits": [ids], "time_limit": seconds, "apply": bool}; everything but date is optional.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if not is_admin(request.user):
+            return Response(
+                {'error': 'You do not have permission to perform this operation'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        data = request.data if isinstance(request.data, dict) else {}
+        day = parse_date(str(data.get('date', '')))
+        if day is None:
+            return Response({'error': 'date must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        carer_ids, shifts = [], {}
+        try:
+            for carer in data.get('carers') or []:
+                if isinstance(carer, dict):
+                    carer_ids.append(int(carer['id']))
+                    if carer.get('start') or carer.get('end'):
+                        shifts[int(carer['id'])] = (carer.get('start') or '00:00', carer.get('end') or '24:00')
+                else:
+                    carer_ids.append(int(carer))
+            visit_ids = [int(visit) for visit in data.get('visits') or []]
+            time_limit = min(float(data.get('time_limit', 5)), 30)
+            plan = optimize_day(day, carer_ids=carer_ids, visit_ids=visit_ids, shifts=shifts, time_limit=time_limit)
+        except (KeyError, TypeError, ValueError) as exc:
+            return Response({'error': f'Invalid request: {exc}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if data.get('apply'):
+            plan['applied'] = apply_plan(plan, request.user)
+        return Response(plan)
+
+
+def visit_filters(params):
+    """start / end dates and carer_ids / client_ids from ?start=&end=&carer=&client=, raising ValueError"""
+    filters = {
+        'carer_ids': [int(value) for value in params.getlist('carer')],
+        'client_ids': [int(value) for value in params.getlist('client')],
+    }
+    for param in ('start', 'end'):
+        if params.get(param):
+            filters[param] = parse_date(params[param])
+            if filters[param] is None:
+                raise ValueError(f'{param} must be YYYY-MM-DD')
+    return filters
+
+
+class ComplianceReportAPIView(APIView):
+    """
+    API endpoint reporting visit punctuality, duration shortfall, checklist
+    completion and geofence adherence per carer, client or week
+
+    Query: ?group=carer|client|week|all&start=YYYY-MM-DD&end=YYYY-MM-DD (end
+    exclusive), repeatable &carer= / &client= ids and &checklist_threshold= (the
+    completion percentage below which a visit is a checklist gap, default 100).
+    The export view returns the same report as CSV.
+    """
+    permission_classes = [IsAuthenticated]
+    export = False
+
+    def get(self, request):
+        if not is_admin(request.user):
+            return Response(
+                {'error': 'You do not have permission to perform this operation'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        params = request.query_params
+        try:
+            group = params.get('group', 'carer')
+            threshold = float(params.get('checklist_threshold', 100))
+            if not 0 <= threshold <= 100:
+                raise ValueError('checklist_threshold must be between 0 and 100')
+            result = compliance_report(group, checklist_threshold=threshold, **visit_filters(params))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not self.export:
+            return Response(result)
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = (
+            f'attachment; filename="compliance-{group}-{result["start"]}-{result["end"]}.csv"'
+        )
+        writer = csv.DictWriter(response, fieldnames=compliance_columns(group))
+        writer.writeheader()
+        writer.writerows(result['rows'])
+        return response
+
+
+class RecordExportAPIView(APIView):
+    """
+    API endpoint streaming appointments, seizures, incidents, medications or
+    body maps as CSV or NDJSON
+
+    URL: /api/export/<dataset>.<csv|ndjson>, with the compliance report's
+    ?start=&end=&carer=&client= filters applied to the visit of each row.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dataset, file_format):
+        if not is_admin(request.user):
+            return Response(
+                {'error': 'You do not have permission to perform this operation'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        try:
+            chunks = stream_export(dataset, file_format, **visit_filters(request.query_params))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[file_format])
+        response['Content-Disposition'] = (
+            f'attachment; filename="{dataset}-{timezone.localdate().isoformat()}.{file_format}"'
+        )
+        return response
+
+
+class DeltaSyncAPIView(APIView):
+    """
+    API endpoint for incremental download of visit data to the mobile app
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """Get rows created, changed or deleted since the cursor from the previous call"""
+        if not request.user.is_staff_member:
+            return Response(
+                {'error': 'User is not a staff member'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            page_size = int(request.query_params.get('page_size', DELTA_PAGE_SIZE))
+        except ValueError:
+            return Response(
+                {'error': 'page_size must be a whole number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            changes = get_changes(request.user, request.query_params.get('cursor'), page_size)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(changes)
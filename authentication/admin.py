@@ -1,18 +1,19 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User
+from .models import DeviceSession, User
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
-    list_display = ('username', 'email', 'first_name', 'last_name', 'role', 'is_staff_member', 'login_code', 'biometric_id', 'is_active', 'date_joined')
+    list_display = ('username', 'email', 'first_name', 'last_name', 'role', 'is_staff_member', 'pin_enabled', 'biometric_enabled', 'is_active', 'date_joined')
     list_filter = ('role', 'is_staff_member', 'is_active', 'is_staff', 'is_superuser', 'date_joined')
-    search_fields = ('username', 'first_name', 'last_name', 'email', 'login_code', 'biometric_id')
+    search_fields = ('username', 'first_name', 'last_name', 'email')
+    readonly_fields = ('pin_enabled', 'biometric_enabled')
     ordering = ('username',)
     
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
         ('Personal info', {'fields': ('first_name', 'last_name', 'email', 'phone')}),
-        ('App Authentication', {'fields': ('login_code', 'biometric_id')}),
+        ('App Authentication', {'fields': ('pin_enabled', 'biometric_enabled')}),
         ('Role & Permissions', {
             'fields': ('role', 'is_staff_member', 'is_active', 'is_staff', 'is_superuser', 'groups', 'user_permissions'),
         }),
@@ -22,9 +23,29 @@ class CustomUserAdmin(UserAdmin):
     add_fieldsets = (
         (None, {
             'classes': ('wide',),
-            'fields': ('username', 'email', 'password1', 'password2', 'first_name', 'last_name', 'role', 'is_staff_member', 'login_code', 'biometric_id'),
+            'fields': ('username', 'email', 'password1', 'password2', 'first_name', 'last_name', 'role', 'is_staff_member'),
         }),
     )
     
+    @admin.display(boolean=True, description='PIN')
+    def pin_enabled(self, obj):
+        return obj.has_login_code
+    
+    @admin.display(boolean=True, description='Biometric')
+    def biometric_enabled(self, obj):
+        return obj.has_biometric
+    
     def get_queryset(self, request):
         return super().get_queryset(request).select_related()
+
+
+@admin.register(DeviceSession)
+class DeviceSessionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'device_id', 'device_name', 'created_at', 'rotated_at', 'expires_at')
+    list_filter = ('expires_at',)
+    search_fields = ('user__username', 'device_id', 'device_name')
+    readonly_fields = ('user', 'device_id', 'created_at', 'rotated_at', 'expires_at')
+    list_select_related = ('user',)
+    
+    def has_add_permission(self, request):
+        return False
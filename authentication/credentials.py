@@ -0,0 +1,74 @@
+"""
+PIN and biometric logins.
+
+Login codes and biometric ids are never stored. User keeps a keyed hash of each
+(HMAC-SHA256 under SECRET_KEY, see lookup_hash()) in a unique, so indexed,
+column, and a login hashes what it was sent and looks that up: one indexed
+query whether or not the credential exists, with no per-user comparison for
+timing to leak through. Rotating SECRET_KEY therefore invalidates every PIN and
+biometric registration.
+
+A successful login issues a new token for the device it came from (see
+authentication.tokens.issue), replacing that device's previous one, or a
+separate session when the request does not name its device.
+"""
+import re
+
+from django.contrib.auth import get_user_model
+from django.utils.crypto import salted_hmac
+
+from reference_cache.accessors import staff_profile
+from .tokens import issue
+
+LOGIN_CODE = re.compile(r'^[0-9]{6}$')
+
+
+def lookup_hash(purpose, value):
+    """Keyed hash of a login credential, as stored in User.<purpose>_hash"""
+    return salted_hmac(f'authentication.{purpose}', value, algorithm='sha256').hexdigest()
+
+
+def valid_login_code(login_code):
+    return isinstance(login_code, str) and LOGIN_CODE.match(login_code) is not None
+
+
+def find_user(purpose, value):
+    """The active staff member whose login_code or biometric credential is `value`, else None"""
+    return get_user_model().objects.filter(
+        **{f'{purpose}_hash': lookup_hash(purpose, value)}, is_staff_member=True, is_active=True,
+    ).first()
+
+
+def credential_taken(purpose, value, user):
+    """Whether another user registered the same credential"""
+    return get_user_model().objects.filter(
+        **{f'{purpose}_hash': lookup_hash(purpose, value)}
+    ).exclude(pk=user.pk).exists()
+
+
+def user_data(user):
+    """The user part of the login and user info responses"""
+    return {
+        'user_id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'email': user.email,
+        'staff': {
+            **staff_profile(user),
+            'has_login_code': user.has_login_code,
+            'has_biometric': user.has_biometric,
+        },
+    }
+
+
+def device(data):
+    """(device_id, device_name) a login request names; device_id is None when it names none"""
+    device_id = data.get('device_id')
+    return str(device_id)[:255] if device_id else None, str(data.get('device_name') or '')[:255]
+
+
+def login_data(user, data):
+    """Login response for `user`, with a new token for the device named in the request `data`"""
+    session, key = issue(user, *device(data))
+    return {'token': key, 'expires_at': session.expires_at, **user_data(user)}
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
-from rest_framework.authtoken.models import Token
+from authentication.tokens import issue
 
 User = get_user_model()
 
@@ -35,24 +35,18 @@ class Command(BaseCommand):
                 self.style.SUCCESS(f'Successfully created user {username}')
             )
         
-        # Create or get token
-        token, created = Token.objects.get_or_create(user=user)
-        
-        if created:
-            self.stdout.write(
-                self.style.SUCCESS(f'Created new token for user {username}')
-            )
-        else:
-            self.stdout.write(
-                self.style.WARNING(f'Token already exists for user {username}')
-            )
+        # Issue a token (replaces the one issued by an earlier run)
+        session, token = issue(user, device_id='create_test_user', device_name='Test user command')
+        self.stdout.write(
+            self.style.SUCCESS(f'Issued new token for user {username}, valid until {session.expires_at:%Y-%m-%d}')
+        )
         
         self.stdout.write(
             self.style.SUCCESS(f'\nTest User Credentials:')
         )
         self.stdout.write(f'Username: {username}')
         self.stdout.write(f'Password: {password}')
-        self.stdout.write(f'Token: {token.key}')
+        self.stdout.write(f'Token: {token}')
         self.stdout.write(f'Role: {user.get_role_display()}')
         self.stdout.write(f'User ID: {user.id}')
         self.stdout.write(f'\nAPI Login URL: http://localhost:8000/api/auth/login/')
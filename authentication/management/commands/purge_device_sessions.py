@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.tokens import PURGE_BATCH_SIZE, purge_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired device sessions in small batches, each committed on its own, "
+        "so it can run from cron while the app is in use"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE, help='Sessions deleted per statement')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        if options['pause'] < 0:
+            raise CommandError('--pause cannot be negative.')
+        deleted = purge_expired(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired device sessions'))
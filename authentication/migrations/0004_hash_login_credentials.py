@@ -0,0 +1,46 @@
+from django.db import migrations, models
+from django.utils.crypto import salted_hmac
+
+
+def _hash(purpose, value):
+    # Frozen copy of authentication.credentials.lookup_hash as it was when this migration was written
+    return salted_hmac(f'authentication.{purpose}', value, algorithm='sha256').hexdigest()
+
+
+def hash_credentials(apps, schema_editor):
+    User = apps.get_model('authentication', 'User')
+    users = User.objects.exclude(login_code__isnull=True, biometric_id__isnull=True)
+    for user in users.only('login_code', 'biometric_id'):
+        User.objects.filter(pk=user.pk).update(
+            login_code_hash=_hash('login_code', user.login_code) if user.login_code else None,
+            biometric_hash=_hash('biometric', user.biometric_id) if user.biometric_id else None,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_user_biometric_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='login_code_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Keyed hash of the 6-digit app login code (optional)', max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='biometric_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Keyed hash of the biometric identifier for fingerprint/face recognition (optional)', max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(hash_credentials, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='user',
+            name='login_code',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='biometric_id',
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:53
+
+import hashlib
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def sessions_from_tokens(apps, schema_editor):
+    """Keep existing apps signed in: each user's token becomes their 'default' device session"""
+    Token = apps.get_model('authtoken', 'Token')
+    DeviceSession = apps.get_model('authentication', 'DeviceSession')
+    now = timezone.now()
+    expires_at = now + timedelta(days=getattr(settings, 'DEVICE_SESSION_LIFETIME_DAYS', 30))
+    DeviceSession.objects.bulk_create([
+        DeviceSession(user_id=user_id, key_digest=hashlib.sha256(key.encode()).hexdigest(), device_id='default',
+                      rotated_at=now, expires_at=expires_at)
+        for key, user_id in Token.objects.values_list('key', 'user_id').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0004_hash_login_credentials'),
+        ('authtoken', '0004_alter_tokenproxy_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key_digest', models.CharField(editable=False, max_length=64, unique=True)),
+                ('device_id', models.CharField(help_text='Identifier the app sends for the device', max_length=255)),
+                ('device_name', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rotated_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='device_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Device session',
+                'verbose_name_plural': 'Device sessions',
+                'constraints': [models.UniqueConstraint(fields=('user', 'device_id'), name='device_session_user_device')],
+            },
+        ),
+        migrations.RunPython(sessions_from_tokens, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
-from django.core.validators import RegexValidator
-from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -24,26 +23,21 @@ class User(AbstractUser):
         default=True,
         help_text="Whether this user is a staff member"
     )
-    login_code = models.CharField(
-        max_length=6,
+    login_code_hash = models.CharField(
+        max_length=64,
         unique=True,
         blank=True,
         null=True,
-        validators=[
-            RegexValidator(
-                regex=r'^[0-9]{6}$',
-                message='Login code must be exactly 6 digits.',
-                code='invalid_login_code'
-            ),
-        ],
-        help_text="6-digit code for app login (optional)"
+        editable=False,
+        help_text="Keyed hash of the 6-digit app login code (optional)"
     )
-    biometric_id = models.CharField(
-        max_length=255,
+    biometric_hash = models.CharField(
+        max_length=64,
         unique=True,
         blank=True,
         null=True,
-        help_text="Unique biometric identifier for fingerprint/face recognition (optional)"
+        editable=False,
+        help_text="Keyed hash of the biometric identifier for fingerprint/face recognition (optional)"
     )
     
     class Meta:
@@ -71,15 +65,38 @@ class User(AbstractUser):
     @property
     def has_biometric(self):
         """Check if user has biometric authentication enabled"""
-        return bool(self.biometric_id)
+        return bool(self.biometric_hash)
     
     @property
     def has_login_code(self):
         """Check if user has login code authentication enabled"""
-        return bool(self.login_code)
+        return bool(self.login_code_hash)
+
+
+class DeviceSession(models.Model):
+    """
+    An API token issued to one of a user's devices. Only a SHA-256 digest of
+    the token is stored; it expires at expires_at and is replaced by logging in
+    again from the device or by rotating it.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='device_sessions')
+    key_digest = models.CharField(max_length=64, unique=True, editable=False)
+    device_id = models.CharField(max_length=255, help_text="Identifier the app sends for the device")
+    device_name = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    rotated_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
     
-    def clean(self):
-        """Custom validation for the model"""
-        super().clean()
-        if self.login_code and len(self.login_code) != 6:
-            raise ValidationError({'login_code': 'Login code must be exactly 6 digits.'})
+    class Meta:
+        verbose_name = "Device session"
+        verbose_name_plural = "Device sessions"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'device_id'], name='device_session_user_device'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} on {self.device_name or self.device_id}"
+    
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
@@ -0,0 +1,27 @@
+"""
+Keep the token caches in step with DeviceSession and User writes.
+
+Deleting a device session (logout, revocation, the user being deleted) drops
+its token from the authentication caches; rotation drops the old token itself
+(authentication.tokens.rotate). Saving a user drops their cached sessions, so
+deactivation, role changes and removed credentials apply to the next request.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import tokens
+from .models import DeviceSession
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=DeviceSession)
+def session_deleted(sender, instance, **kwargs):
+    tokens.forget(instance.key_digest)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created=False, **kwargs):
+    if not created:
+        tokens.forget_user(instance.pk)
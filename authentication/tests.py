@@ -1,3 +1,316 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from . import tokens
+from .credentials import lookup_hash
+from .models import DeviceSession
+from .throttling import LoginThrottle
+
+User = get_user_model()
+
+
+class CredentialLoginTestCase(TestCase):
+    """Test PIN and biometric logins against the hashed credential columns"""
+
+    def setUp(self):
+        cache.clear()
+        caches['login-throttle'].clear()
+        self.user = User.objects.create_user(username='pin_nurse', password='testpass123',
+                                             first_name='Pat', last_name='Lee')
+        self.api_client = APIClient()
+
+    def _setup(self, path, **data):
+        return self.api_client.post(path, {'username': 'pin_nurse', 'password': 'testpass123', **data},
+                                    format='json')
+
+    def test_credentials_are_stored_hashed(self):
+        self.assertEqual(self._setup('/api/auth/setup/pin/', login_code='123456').status_code, status.HTTP_200_OK)
+        self.assertEqual(self._setup('/api/auth/setup/biometric/', biometric_id='finger-1').status_code,
+                         status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.login_code_hash, lookup_hash('login_code', '123456'))
+        self.assertEqual(self.user.biometric_hash, lookup_hash('biometric', 'finger-1'))
+        self.assertNotIn('123456', self.user.login_code_hash)
+
+        other = User.objects.create_user(username='pin_other', password='testpass123')
+        response = self.api_client.post('/api/auth/setup/pin/', {
+            'username': other.username, 'password': 'testpass123', 'login_code': '123456',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_login_issues_a_token_per_device(self):
+        self._setup('/api/auth/setup/pin/', login_code='654321')
+        self._setup('/api/auth/setup/biometric/', biometric_id='face-7')
+
+        first = self.api_client.post('/api/auth/login/code/', {'login_code': '654321', 'device_id': 'phone'},
+                                     format='json')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(DeviceSession.objects.get(user=self.user, device_id='phone').key_digest,
+                         tokens.digest(first.data['token']))
+        self.assertEqual(first.data['staff']['full_name'], 'Pat Lee')
+        self.assertTrue(first.data['staff']['has_login_code'])
+        self.assertIn('expires_at', first.data)
+
+        tablet = self.api_client.post('/api/auth/login/biometric/', {'biometric_id': 'face-7', 'device_id': 'tablet'},
+                                      format='json')
+        # user lookup, the device's session, and its new token
+        with self.assertNumQueries(3):
+            again = self.api_client.post('/api/auth/login/', {'login_code': '654321', 'device_id': 'phone'},
+                                         format='json')
+        self.assertEqual(again.data['staff'], first.data['staff'])
+        self.assertEqual(DeviceSession.objects.filter(user=self.user).count(), 2)
+
+        for token, expected in [(first.data['token'], status.HTTP_401_UNAUTHORIZED),
+                                (again.data['token'], status.HTTP_200_OK),
+                                (tablet.data['token'], status.HTTP_200_OK)]:
+            self.api_client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+            self.assertEqual(self.api_client.get('/api/auth/user/').status_code, expected)
+
+    def test_logins_without_a_device_get_their_own_sessions(self):
+        self._setup('/api/auth/setup/pin/', login_code='444444')
+        phone = self.api_client.post('/api/auth/login/code/', {'login_code': '444444', 'device_id': 'phone'},
+                                     format='json').data['token']
+        unnamed = [self.api_client.post('/api/auth/login/code/', {'login_code': '444444'}, format='json').data['token']
+                   for _ in range(2)]
+        self.assertEqual(DeviceSession.objects.filter(user=self.user).count(), 3)
+        for token in [phone, *unnamed]:
+            self.api_client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+            self.assertEqual(self.api_client.get('/api/auth/user/').status_code, status.HTTP_200_OK)
+
+    def test_login_never_hands_out_a_deleted_token(self):
+        self._setup('/api/auth/setup/pin/', login_code='555555')
+        first = self.api_client.post('/api/auth/login/code/', {'login_code': '555555', 'device_id': 'phone'},
+                                     format='json').data['token']
+        # Removed without signals, as another worker's cache would never hear of it
+        DeviceSession.objects.filter(user=self.user)._raw_delete(DeviceSession.objects.db)
+        second = self.api_client.post('/api/auth/login/code/', {'login_code': '555555', 'device_id': 'phone'},
+                                      format='json').data['token']
+        self.assertNotEqual(second, first)
+        self.assertTrue(DeviceSession.objects.filter(key_digest=tokens.digest(second)).exists())
+
+    def test_rejected_logins(self):
+        self._setup('/api/auth/setup/pin/', login_code='111111')
+        for path, data, expected in [
+            ('/api/auth/login/code/', {'login_code': '222222'}, status.HTTP_401_UNAUTHORIZED),
+            ('/api/auth/login/code/', {'login_code': '11111a'}, status.HTTP_400_BAD_REQUEST),
+            ('/api/auth/login/biometric/', {'biometric_id': 'unknown'}, status.HTTP_401_UNAUTHORIZED),
+        ]:
+            self.assertEqual(self.api_client.post(path, data, format='json').status_code, expected)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.api_client.post('/api/auth/login/code/', {'login_code': '111111'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_revokes_one_device(self):
+        self._setup('/api/auth/setup/pin/', login_code='333333')
+        phone, tablet = [
+            self.api_client.post('/api/auth/login/code/', {'login_code': '333333', 'device_id': device},
+                                 format='json').data['token']
+            for device in ('phone', 'tablet')
+        ]
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Token {phone}')
+        self.assertEqual(self.api_client.post('/api/auth/logout/').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.api_client.get('/api/auth/user/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Token {tablet}')
+        self.assertEqual(self.api_client.get('/api/auth/user/').status_code, status.HTTP_200_OK)
+        self.api_client.post('/api/auth/logout/', {'all_devices': True}, format='json')
+        self.assertFalse(DeviceSession.objects.filter(user=self.user).exists())
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    """Test that token authentication is answered from cache and invalidated on writes"""
+
+    def setUp(self):
+        cache.clear()
+        tokens.clear()
+        self.user = User.objects.create_user(username='token_nurse', password='testpass123',
+                                             login_code_hash=lookup_hash('login_code', '246810'))
+        self.session, self.token = tokens.issue(self.user)
+        self.api_client = APIClient()
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def _user_info(self):
+        return self.api_client.get('/api/auth/user/')
+
+    def test_repeat_requests_skip_the_database(self):
+        self.assertEqual(self._user_info().status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            response = self._user_info()
+        self.assertEqual(response.data['username'], 'token_nurse')
+
+    def test_invalidated_by_logout_deactivation_and_remove_pin(self):
+        self._user_info()
+        response = self.api_client.post('/api/auth/remove/pin/')
+        self.assertFalse(response.data['has_login_code'])
+        self.assertFalse(self._user_info().data['staff']['has_login_code'])
+
+        self.user.refresh_from_db()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self._user_info().status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user.is_active = True
+        self.user.save()
+        self._user_info()
+        self.api_client.post('/api/auth/logout/')
+        self.assertEqual(self._user_info().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_AUTH_CACHE='default')
+    def test_shared_tier(self):
+        self._user_info()
+        tokens.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self._user_info().status_code, status.HTTP_200_OK)
+
+        self.session.delete()
+        tokens.clear()
+        self.assertEqual(self._user_info().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_lru_is_bounded(self):
+        lru = tokens.LRUCache(size=2, timeout=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+        expired = tokens.LRUCache(size=2, timeout=-1)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+
+class DeviceSessionTestCase(TestCase):
+    """Test device session expiry, rotation, revocation and purging"""
+
+    def setUp(self):
+        cache.clear()
+        tokens.clear()
+        self.user = User.objects.create_user(username='device_nurse', password='testpass123')
+        self.session, self.token = tokens.issue(self.user, device_id='phone', device_name='Work phone')
+        self.api_client = APIClient()
+        self.api_client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def _user_info(self, token=None):
+        if token:
+            self.api_client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        return self.api_client.get('/api/auth/user/')
+
+    def test_expired_tokens_are_rejected_even_when_cached(self):
+        self.assertEqual(self._user_info().status_code, status.HTTP_200_OK)
+        tokens.local_tier().get(tokens.digest(self.token)).expires_at = timezone.now() - timedelta(seconds=1)
+        self.assertEqual(self._user_info().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rotation(self):
+        self._user_info()
+        response = self.api_client.post('/api/auth/token/rotate/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._user_info().status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self._user_info(response.data['token']).status_code, status.HTTP_200_OK)
+
+    def test_list_and_revoke_sessions(self):
+        _, tablet = tokens.issue(self.user, device_id='tablet')
+        other_session, _ = tokens.issue(User.objects.create_user(username='device_other', password='x'))
+
+        sessions = self.api_client.get('/api/auth/sessions/').data
+        self.assertEqual({(s['device_id'], s['current']) for s in sessions}, {('phone', True), ('tablet', False)})
+
+        tablet_id = next(s['id'] for s in sessions if s['device_id'] == 'tablet')
+        self.assertEqual(self.api_client.delete(f'/api/auth/sessions/{tablet_id}/').status_code,
+                         status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.api_client.delete(f'/api/auth/sessions/{other_session.id}/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self._user_info(tablet).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_purge_expired_sessions(self):
+        for device in range(5):
+            tokens.issue(self.user, device_id=f'old-{device}')
+        DeviceSession.objects.filter(device_id__startswith='old-').update(expires_at=timezone.now() - timedelta(days=1))
+
+        out = io.StringIO()
+        call_command('purge_device_sessions', batch_size=2, stdout=out)
+        self.assertIn('Deleted 5 expired device sessions', out.getvalue())
+        self.assertEqual(list(DeviceSession.objects.values_list('device_id', flat=True)), ['phone'])
+
+
+@override_settings(LOGIN_THROTTLE_RATES={'ip': (5, 60), 'username': (3, 900), 'method': (4, 600),
+                                         'method-ip': (2, 600)})
+class LoginThrottleTestCase(TestCase):
+    """Test that login attempts are throttled per address, username and method before any query"""
+
+    def setUp(self):
+        caches['login-throttle'].clear()
+        self.user = User.objects.create_user(username='throttle_nurse', password='testpass123',
+                                             login_code_hash=lookup_hash('login_code', '135790'))
+        self.api_client = APIClient()
+
+    def _post(self, path, data, address='10.0.0.1'):
+        return self.api_client.post(path, data, format='json', REMOTE_ADDR=address)
+
+    @override_settings(LOGIN_THROTTLE_RATES={'ip': (5, 60), 'method': (100, 600)})
+    def test_address_limit_rejects_before_the_database(self):
+        for attempt in range(5):
+            response = self._post('/api/auth/login/code/', {'login_code': f'{attempt:06d}'})
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with self.assertNumQueries(0):
+            response = self._post('/api/auth/login/code/', {'login_code': '135790'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        response = self._post('/api/auth/login/code/', {'login_code': '135790'}, address='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_username_lockout(self):
+        for address in ('10.0.1.1', '10.0.1.2', '10.0.1.3'):
+            response = self._post('/api/auth/login/', {'username': 'Throttle_Nurse', 'password': 'wrong'}, address)
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self._post('/api/auth/login/', {'username': 'throttle_nurse', 'password': 'testpass123'}, '10.0.1.4')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self._post('/api/auth/check-user/', {'username': 'throttle_nurse'}, '10.0.1.4')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self._post('/api/auth/check-user/', {'username': 'someone_else'}, '10.0.1.4')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_method_limit_tightens_the_address_limit_and_ignores_successes(self):
+        for attempt in range(6):
+            response = self._post('/api/auth/login/code/', {'login_code': '135790'}, f'10.0.2.{attempt}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for attempt in range(2):
+            self._post('/api/auth/login/code/', {'login_code': f'{attempt:06d}'}, '10.0.4.1')
+        # Under the method limit, an address's failures only meet the address limit
+        response = self._post('/api/auth/login/code/', {'login_code': '135790'}, '10.0.4.1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for attempt in range(2):
+            self._post('/api/auth/login/', {'login_code': f'{attempt:06d}'}, f'10.0.3.{attempt}')
+
+        # Over it, clients without failures still get in and the guessing address is refused
+        with self.assertLogs('authentication.throttling', 'WARNING') as logs:
+            response = self._post('/api/auth/login/code/', {'login_code': '135790'}, '10.0.5.1')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self._post('/api/auth/login/code/', {'login_code': '135790'}, '10.0.4.1')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(len(logs.records), 1)
+        response = self._post('/api/auth/login/biometric/', {'biometric_id': 'unknown'}, '10.0.4.1')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(LOGIN_THROTTLE_RATES={'username': (2, 60)})
+    def test_sliding_window(self):
+        request = SimpleNamespace(data={'username': 'throttle_nurse'}, headers={}, META={'REMOTE_ADDR': '10.0.5.1'})
+        with mock.patch('authentication.throttling.time.time', return_value=6000 + 59):
+            for _ in range(3):
+                LoginThrottle(request, 'password').failed()
+        # 7 s into the next window, 53/60 of the previous one still counts
+        with mock.patch('authentication.throttling.time.time', return_value=6060 + 7):
+            self.assertEqual(LoginThrottle(request, 'password').wait(), 53)
+        with mock.patch('authentication.throttling.time.time', return_value=6060 + 40):
+            self.assertEqual(LoginThrottle(request, 'password').wait(), 0)
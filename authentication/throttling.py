@@ -0,0 +1,159 @@
+"""
+Login throttling.
+
+The login, PIN/biometric setup and user lookup endpoints are open to anyone,
+and a 6-digit PIN has only 10^6 values, so every attempt passes through
+sliding-window counters before any database work:
+
+- 'ip': attempts from one client address (all methods), bounding the load a
+  single client can put on the database;
+- 'username': failed attempts naming one username, locking it out of
+  password logins and lookups for a while;
+- 'method': failed attempts per authentication method from all clients
+  together. Going over it rejects no one by itself, which would lock every
+  carer out: it logs a warning (once per window) and switches on
+- 'method-ip': failed attempts per authentication method from one client
+  address, a much tighter limit a distributed PIN or biometric guesser runs
+  into while the method is under attack.
+
+Limits are LOGIN_THROTTLE_RATES (scope -> (attempts, window seconds)).
+Successful logins only count towards 'ip', so a shift-start login storm is
+never locked out. A sliding window is approximated from two fixed windows:
+the current count plus the previous window's, weighted by how much of it
+still overlaps. Counters live in the LOGIN_THROTTLE_CACHE alias - local
+memory per process by default, shared across workers when CACHE_URL is set.
+"""
+import functools
+import hashlib
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+DEFAULT_RATES = {
+    'ip': (60, 60),
+    'username': (10, 900),
+    'method': (500, 600),
+    'method-ip': (5, 600),
+}
+KEY = 'login-throttle:{}:{}:{}'
+ALERT_KEY = 'login-throttle-alert:{}:{}'
+
+logger = logging.getLogger(__name__)
+
+
+def _cache():
+    return caches[getattr(settings, 'LOGIN_THROTTLE_CACHE', 'default')]
+
+
+def _rates():
+    return {**DEFAULT_RATES, **getattr(settings, 'LOGIN_THROTTLE_RATES', {})}
+
+
+def login_method(data):
+    """Authentication method a login_view request uses"""
+    if data.get('biometric_id'):
+        return 'biometric'
+    if data.get('login_code'):
+        return 'pin'
+    return 'password'
+
+
+class LoginThrottle:
+    """The counters one login attempt is checked against and recorded in"""
+
+    def __init__(self, request, method):
+        self.method = method
+        username = request.data.get('username')
+        ip = BaseThrottle().get_ident(request)
+        self.idents = {
+            'ip': ip,
+            'username': hashlib.sha256(username.lower().encode()).hexdigest()
+            if isinstance(username, str) and username else None,
+            'method': method,
+            'method-ip': f'{method}:{ip}',
+        }
+        self.now = time.time()
+
+    def _keys(self, scope):
+        window = _rates()[scope][1]
+        current = int(self.now // window)
+        return (KEY.format(scope, self.idents[scope], current),
+                KEY.format(scope, self.idents[scope], current - 1))
+
+    def wait(self):
+        """
+        Seconds until every counter is back under its limit, or 0 if this
+        attempt is allowed. Counts the attempt towards 'ip' when allowed.
+        """
+        rates = _rates()
+        scopes = [scope for scope in rates if self.idents.get(scope)]
+        keys = {scope: self._keys(scope) for scope in scopes}
+        counts = _cache().get_many([key for pair in keys.values() for key in pair])
+        waits = {}
+        for scope in scopes:
+            limit, window = rates[scope]
+            current, previous = (counts.get(key, 0) for key in keys[scope])
+            elapsed = (self.now % window) / window
+            if current + previous * (1 - elapsed) >= limit:
+                # Past the window's end the previous count drops out; wait at least until then
+                waits[scope] = math.ceil(window * (1 - elapsed))
+        if 'method' in waits:
+            self._alert()
+        else:
+            waits.pop('method-ip', None)
+        waits.pop('method', None)
+        wait = max(waits.values(), default=0)
+        if not wait:
+            self._count('ip')
+        return wait
+
+    def _alert(self):
+        window = _rates()['method'][1]
+        if _cache().add(ALERT_KEY.format(self.method, int(self.now // window)), 1, window):
+            logger.warning('Failed %s logins are over the limit across all clients; '
+                           'tightening the per-address limit', self.method)
+
+    def _count(self, scope):
+        if not self.idents.get(scope):
+            return
+        cache = _cache()
+        key = self._keys(scope)[0]
+        if not cache.add(key, 1, 2 * _rates()[scope][1]):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, 2 * _rates()[scope][1])
+
+    def failed(self):
+        self._count('username')
+        self._count('method')
+        self._count('method-ip')
+
+
+def throttled(method):
+    """
+    Throttle a login view. `method` names its authentication method, or is a
+    function of the request data. Responses with status 401 or 404 (unknown
+    user) count as failures.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            throttle = LoginThrottle(request, method(request.data) if callable(method) else method)
+            wait = throttle.wait()
+            if wait:
+                return Response({
+                    'error': f'Too many login attempts. Try again in {wait} seconds.'
+                }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(wait)})
+            response = view(request, *args, **kwargs)
+            if response.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_404_NOT_FOUND):
+                throttle.failed()
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,236 @@
+"""
+Device session tokens and their cached authentication.
+
+Each login issues a token for the device it came from (a DeviceSession, one
+per user and device_id) that expires after DEVICE_SESSION_LIFETIME_DAYS.
+Logging in again from the device, or rotating the token, replaces it; logging
+out revokes that device only. A login that names no device gets a session of
+its own, so it never replaces the token of another device. Only a SHA-256 digest of a token is stored, so a
+request is validated with one lookup on the unique key_digest index, or
+without touching the database at all:
+
+The mobile app makes dozens of requests per visit, so CachedTokenAuthentication
+keeps recently seen sessions (with their user) in two tiers:
+
+- a bounded LRU in each process (TOKEN_AUTH_LOCAL_SIZE entries, each trusted
+  for TOKEN_AUTH_LOCAL_TIMEOUT seconds);
+- optionally the shared cache alias named by TOKEN_AUTH_CACHE (Redis when
+  CACHE_URL is set), for TOKEN_AUTH_CACHE_TIMEOUT seconds.
+
+Entries are keyed by the token digest, so raw tokens never reach the shared
+cache, and their expiry is checked on every hit. They are dropped from the
+shared tier and this process's LRU when the token is revoked or replaced
+(logout, rotation, a new login) or its user is saved (e.g. deactivation, role
+change, remove_pin) - see authentication.signals. The LRUs
+of other processes only learn of it when their entry times out, so
+TOKEN_AUTH_LOCAL_TIMEOUT bounds how long a revoked token can still be used
+there; queryset update() bypasses the signals and is bounded by the shared
+timeout as well.
+"""
+import copy
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .models import DeviceSession
+
+CACHE_KEY = 'token-auth:{}'
+UNNAMED_DEVICE = 'unnamed-{}'
+DEFAULT_LIFETIME_DAYS = 30
+PURGE_BATCH_SIZE = 1000
+DEFAULT_LOCAL_SIZE = 10000
+DEFAULT_LOCAL_TIMEOUT = 30  # seconds
+DEFAULT_CACHE_TIMEOUT = 300  # seconds
+
+
+class LRUCache:
+    """Thread-safe mapping of at most `size` entries, each kept for `timeout` seconds"""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.timeout)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+_local = None
+
+
+def local_tier():
+    global _local
+    if _local is None:
+        _local = LRUCache(
+            getattr(settings, 'TOKEN_AUTH_LOCAL_SIZE', DEFAULT_LOCAL_SIZE),
+            getattr(settings, 'TOKEN_AUTH_LOCAL_TIMEOUT', DEFAULT_LOCAL_TIMEOUT),
+        )
+    return _local
+
+
+def shared_tier():
+    alias = getattr(settings, 'TOKEN_AUTH_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def clear():
+    """Empty this process's LRU (it is rebuilt from the current settings)"""
+    global _local
+    _local = None
+
+
+def digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def forget(*digests):
+    """Drop cached sessions, by token digest, from the shared tier and this process's LRU"""
+    for key in digests:
+        local_tier().delete(key)
+    shared = shared_tier()
+    if shared is not None and digests:
+        shared.delete_many([CACHE_KEY.format(key) for key in digests])
+
+
+def forget_user(user_id):
+    """Drop every cached session of a user"""
+    forget(*DeviceSession.objects.filter(user_id=user_id).values_list('key_digest', flat=True))
+
+
+def lifetime():
+    return timedelta(days=getattr(settings, 'DEVICE_SESSION_LIFETIME_DAYS', DEFAULT_LIFETIME_DAYS))
+
+
+def _renew(session):
+    """Give a session a new token and expiry; returns the token"""
+    key = secrets.token_hex(20)
+    session.key_digest = digest(key)
+    session.rotated_at = timezone.now()
+    session.expires_at = session.rotated_at + lifetime()
+    return key
+
+
+def issue(user, device_id=None, device_name=''):
+    """
+    Start the session of a user's device, replacing its previous token if it
+    had one, or a new session under a generated device_id when `device_id` is
+    None. Returns (session, token).
+    """
+    if device_id is None:
+        session = DeviceSession(user=user, device_id=UNNAMED_DEVICE.format(secrets.token_hex(8)),
+                                device_name=device_name)
+        key = _renew(session)
+        session.save()
+        return session, key
+    session = DeviceSession.objects.filter(user=user, device_id=device_id).first()
+    if session is None:
+        session = DeviceSession(user=user, device_id=device_id, device_name=device_name)
+        key = _renew(session)
+        try:
+            with transaction.atomic():
+                session.save()
+            return session, key
+        except IntegrityError:
+            # The same device logged in concurrently; take over its session
+            session = DeviceSession.objects.get(user=user, device_id=device_id)
+    if device_name:
+        session.device_name = device_name
+    return session, rotate(session)
+
+
+def rotate(session):
+    """Replace the token of a session (the old one stops working at once); returns the new token"""
+    old_digest = session.key_digest
+    key = _renew(session)
+    session.save(update_fields=['key_digest', 'device_name', 'rotated_at', 'expires_at'])
+    forget(old_digest)
+    return key
+
+
+def revoke(sessions):
+    """Delete sessions (a queryset); their tokens are dropped from the caches by the post_delete signal"""
+    return sessions.delete()[0]
+
+
+def purge_expired(batch_size=PURGE_BATCH_SIZE, pause=0.0):
+    """
+    Delete sessions that have expired, a batch of ids at a time, each batch in
+    its own short transaction (sleeping `pause` seconds between batches), so a
+    purge can run alongside logins. Returns the number deleted.
+    """
+    now = timezone.now()
+    deleted = 0
+    while True:
+        ids = list(DeviceSession.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += DeviceSession.objects.filter(pk__in=ids).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication against device sessions, answered from the caches
+    when possible. request.auth is the DeviceSession.
+    """
+
+    def authenticate_credentials(self, key):
+        key_digest = digest(key)
+        local = local_tier()
+        session = local.get(key_digest)
+        if session is None:
+            shared = shared_tier()
+            session = shared.get(CACHE_KEY.format(key_digest)) if shared is not None else None
+            if session is None:
+                try:
+                    session = DeviceSession.objects.select_related('user').get(key_digest=key_digest)
+                except DeviceSession.DoesNotExist:
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+                if not session.user.is_active:
+                    raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+                if shared is not None:
+                    shared.set(CACHE_KEY.format(key_digest), session,
+                               getattr(settings, 'TOKEN_AUTH_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT))
+            local.set(key_digest, session)
+        if session.is_expired:
+            raise exceptions.AuthenticationFailed(_('Token expired.'))
+        # Requests get their own copies, so a view changing request.user leaves the cached one alone
+        session = copy.copy(session)
+        session.user = copy.copy(session.user)
+        return session.user, session
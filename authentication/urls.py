@@ -19,5 +19,8 @@ urlpatterns = [
     
     # Standard endpoints
     path('logout/', views.logout_view, name='auth_logout'),
+    path('token/rotate/', views.rotate_token, name='auth_rotate_token'),
+    path('sessions/', views.device_sessions, name='auth_device_sessions'),
+    path('sessions/<int:session_id>/', views.revoke_device_session, name='auth_revoke_device_session'),
     path('user/', views.user_info, name='auth_user_info'),
 ] 
\ No newline at end of file
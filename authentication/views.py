@@ -2,16 +2,20 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ValidationError
+
+from .credentials import credential_taken, find_user, login_data, lookup_hash, user_data, valid_login_code
+from .models import DeviceSession
+from .throttling import login_method, throttled
+from .tokens import revoke, rotate
 
 User = get_user_model()
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttled('lookup')
 def check_user_status(request):
     """
     Check if user exists and what authentication methods they have configured
@@ -34,8 +38,8 @@ def check_user_status(request):
             'first_name': user.first_name,
             'last_name': user.last_name,
             'full_name': user.full_name,
-            'has_login_code': bool(user.login_code),
-            'has_biometric': bool(user.biometric_id),
+            'has_login_code': user.has_login_code,
+            'has_biometric': user.has_biometric,
             'available_methods': []
         }
         
@@ -58,6 +62,7 @@ def check_user_status(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttled('password')
 def setup_pin(request):
     """
     Setup PIN/login code for a user
@@ -72,7 +77,7 @@ def setup_pin(request):
             'error': 'Username, password, and login_code are required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    if len(login_code) != 6:
+    if not valid_login_code(login_code):
         return Response({
             'error': 'Login code must be exactly 6 digits'
         }, status=status.HTTP_400_BAD_REQUEST)
@@ -85,14 +90,14 @@ def setup_pin(request):
         }, status=status.HTTP_401_UNAUTHORIZED)
     
     # Check if login code is already taken
-    if User.objects.filter(login_code=login_code).exclude(id=user.id).exists():
+    if credential_taken('login_code', login_code, user):
         return Response({
             'error': 'Login code is already in use by another user'
         }, status=status.HTTP_400_BAD_REQUEST)
     
     # Set the login code
-    user.login_code = login_code
-    user.save()
+    user.login_code_hash = lookup_hash('login_code', login_code)
+    user.save(update_fields=['login_code_hash'])
     
     return Response({
         'message': 'PIN setup successful',
@@ -104,6 +109,7 @@ def setup_pin(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttled('password')
 def setup_biometric(request):
     """
     Setup biometric authentication for a user
@@ -126,14 +132,14 @@ def setup_biometric(request):
         }, status=status.HTTP_401_UNAUTHORIZED)
     
     # Check if biometric ID is already taken
-    if User.objects.filter(biometric_id=biometric_id).exclude(id=user.id).exists():
+    if credential_taken('biometric', biometric_id, user):
         return Response({
             'error': 'Biometric ID is already in use by another user'
         }, status=status.HTTP_400_BAD_REQUEST)
     
     # Set the biometric ID
-    user.biometric_id = biometric_id
-    user.save()
+    user.biometric_hash = lookup_hash('biometric', biometric_id)
+    user.save(update_fields=['biometric_hash'])
     
     return Response({
         'message': 'Biometric setup successful',
@@ -158,14 +164,14 @@ def update_biometric(request):
     user = request.user
     
     # Check if biometric ID is already taken by another user
-    if User.objects.filter(biometric_id=biometric_id).exclude(id=user.id).exists():
+    if credential_taken('biometric', biometric_id, user):
         return Response({
             'error': 'Biometric ID is already in use by another user'
         }, status=status.HTTP_400_BAD_REQUEST)
     
     # Update the biometric ID
-    user.biometric_id = biometric_id
-    user.save()
+    user.biometric_hash = lookup_hash('biometric', biometric_id)
+    user.save(update_fields=['biometric_hash'])
     
     return Response({
         'message': 'Biometric updated successfully',
@@ -183,8 +189,8 @@ def remove_biometric(request):
     user = request.user
     
     # Remove the biometric ID
-    user.biometric_id = None
-    user.save()
+    user.biometric_hash = None
+    user.save(update_fields=['biometric_hash'])
     
     return Response({
         'message': 'Biometric removed successfully',
@@ -202,8 +208,8 @@ def remove_pin(request):
     user = request.user
     
     # Remove the login code
-    user.login_code = None
-    user.save()
+    user.login_code_hash = None
+    user.save(update_fields=['login_code_hash'])
     
     return Response({
         'message': 'PIN removed successfully',
@@ -215,6 +221,7 @@ def remove_pin(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttled(login_method)
 def login_view(request):
     """
     Login endpoint for mobile app authentication
@@ -227,79 +234,29 @@ def login_view(request):
     
     # Check if using biometric authentication
     if biometric_id:
-        if not biometric_id:
-            return Response({
-                'error': 'Biometric ID is required'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        try:
-            user = User.objects.get(biometric_id=biometric_id, is_staff_member=True, is_active=True)
-        except User.DoesNotExist:
-            return Response({
-                'error': 'Invalid biometric ID or user is not a staff member'
-            }, status=status.HTTP_401_UNAUTHORIZED)
+        return _biometric_login(request, biometric_id)
     
     # Check if using login code authentication
-    elif login_code:
-        if not login_code or len(login_code) != 6:
-            return Response({
-                'error': 'Login code must be exactly 6 digits'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        try:
-            user = User.objects.get(login_code=login_code, is_staff_member=True, is_active=True)
-        except User.DoesNotExist:
-            return Response({
-                'error': 'Invalid login code or user is not a staff member'
-            }, status=status.HTTP_401_UNAUTHORIZED)
+    if login_code:
+        return _code_login(request, login_code)
     
     # Traditional username/password authentication
-    elif username and password:
+    if username and password:
         user = authenticate(username=username, password=password)
         if user is None or not user.is_staff_member:
             return Response({
                 'error': 'Invalid username or password, or user is not a staff member'
             }, status=status.HTTP_401_UNAUTHORIZED)
-    else:
-        return Response({
-            'error': 'Either username/password, login_code, or biometric_id is required'
-        }, status=status.HTTP_400_BAD_REQUEST)
-    
-    # Get or create token for the user
-    token, created = Token.objects.get_or_create(user=user)
+        return Response(login_data(user, request.data))
     
-    # Prepare user data with role information
-    user_data = {
-        'id': user.id,
-        'username': user.username,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'full_name': user.full_name,
-        'email': user.email,
-        'phone': user.phone,
-        'role': user.role,
-        'role_display': user.get_role_display(),
-        'is_active': user.is_active,
-        'is_staff_member': user.is_staff_member,
-        'has_login_code': bool(user.login_code),
-        'has_biometric': bool(user.biometric_id),
-    }
-    
-    response_data = {
-        'token': token.key,
-        'user_id': user.id,
-        'username': user.username,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'email': user.email,
-        'staff': user_data  # Include staff information in the response
-    }
-    
-    return Response(response_data)
+    return Response({
+        'error': 'Either username/password, login_code, or biometric_id is required'
+    }, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttled('pin')
 def login_with_code_view(request):
     """
     Dedicated endpoint for login code authentication
@@ -311,53 +268,12 @@ def login_with_code_view(request):
             'error': 'Login code is required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    if len(login_code) != 6:
-        return Response({
-            'error': 'Login code must be exactly 6 digits'
-        }, status=status.HTTP_400_BAD_REQUEST)
-    
-    try:
-        user = User.objects.get(login_code=login_code, is_staff_member=True, is_active=True)
-    except User.DoesNotExist:
-        return Response({
-            'error': 'Invalid login code or user is not a staff member'
-        }, status=status.HTTP_401_UNAUTHORIZED)
-    
-    # Get or create token for the user
-    token, created = Token.objects.get_or_create(user=user)
-    
-    # Prepare user data with role information
-    user_data = {
-        'id': user.id,
-        'username': user.username,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'full_name': user.full_name,
-        'email': user.email,
-        'phone': user.phone,
-        'role': user.role,
-        'role_display': user.get_role_display(),
-        'is_active': user.is_active,
-        'is_staff_member': user.is_staff_member,
-        'has_login_code': bool(user.login_code),
-        'has_biometric': bool(user.biometric_id),
-    }
-    
-    response_data = {
-        'token': token.key,
-        'user_id': user.id,
-        'username': user.username,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'email': user.email,
-        'staff': user_data  # Include staff information in the response
-    }
-    
-    return Response(response_data)
+    return _code_login(request, login_code)
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttled('biometric')
 def login_with_biometric_view(request):
     """
     Dedicated endpoint for biometric authentication
@@ -369,61 +285,99 @@ def login_with_biometric_view(request):
             'error': 'Biometric ID is required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    try:
-        user = User.objects.get(biometric_id=biometric_id, is_staff_member=True, is_active=True)
-    except User.DoesNotExist:
+    return _biometric_login(request, biometric_id)
+
+
+def _code_login(request, login_code):
+    if not valid_login_code(login_code):
+        return Response({
+            'error': 'Login code must be exactly 6 digits'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    user = find_user('login_code', login_code)
+    if user is None:
+        return Response({
+            'error': 'Invalid login code or user is not a staff member'
+        }, status=status.HTTP_401_UNAUTHORIZED)
+    return Response(login_data(user, request.data))
+
+
+def _biometric_login(request, biometric_id):
+    user = find_user('biometric', biometric_id)
+    if user is None:
         return Response({
             'error': 'Invalid biometric ID or user is not a staff member'
         }, status=status.HTTP_401_UNAUTHORIZED)
-    
-    # Get or create token for the user
-    token, created = Token.objects.get_or_create(user=user)
-    
-    # Prepare user data with role information
-    user_data = {
-        'id': user.id,
-        'username': user.username,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'full_name': user.full_name,
-        'email': user.email,
-        'phone': user.phone,
-        'role': user.role,
-        'role_display': user.get_role_display(),
-        'is_active': user.is_active,
-        'is_staff_member': user.is_staff_member,
-        'has_login_code': bool(user.login_code),
-        'has_biometric': bool(user.biometric_id),
-    }
-    
-    response_data = {
-        'token': token.key,
-        'user_id': user.id,
-        'username': user.username,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'email': user.email,
-        'staff': user_data  # Include staff information in the response
-    }
-    
-    return Response(response_data)
+    return Response(login_data(user, request.data))
 
 
 @api_view(['POST'])
 def logout_view(request):
     """
-    Logout endpoint - delete the user's token
+    Logout endpoint - revoke this device's token, or every device's with all_devices
     """
-    try:
-        # Delete the user's token
-        request.user.auth_token.delete()
+    sessions = DeviceSession.objects.filter(user=request.user)
+    if not request.data.get('all_devices'):
+        if not isinstance(request.auth, DeviceSession):
+            return Response({
+                'message': 'Successfully logged out'
+            })
+        sessions = sessions.filter(pk=request.auth.pk)
+    revoke(sessions)
+    return Response({
+        'message': 'Successfully logged out'
+    })
+
+
+@api_view(['POST'])
+def rotate_token(request):
+    """
+    Replace the token of the calling device; the old token stops working
+    """
+    if not isinstance(request.auth, DeviceSession):
         return Response({
-            'message': 'Successfully logged out'
-        })
-    except:
+            'error': 'Token authentication is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    session = request.auth
+    token = rotate(session)
+    return Response({
+        'token': token,
+        'expires_at': session.expires_at,
+    })
+
+
+def _session_data(session, current):
+    return {
+        'id': session.id,
+        'device_id': session.device_id,
+        'device_name': session.device_name,
+        'created_at': session.created_at,
+        'rotated_at': session.rotated_at,
+        'expires_at': session.expires_at,
+        'current': session.pk == current,
+    }
+
+
+@api_view(['GET'])
+def device_sessions(request):
+    """
+    List the devices the user is signed in on
+    """
+    current = request.auth.pk if isinstance(request.auth, DeviceSession) else None
+    sessions = DeviceSession.objects.filter(user=request.user).order_by('-rotated_at')
+    return Response([_session_data(session, current) for session in sessions])
+
+
+@api_view(['DELETE'])
+def revoke_device_session(request, session_id):
+    """
+    Sign the user out on one device
+    """
+    if not revoke(DeviceSession.objects.filter(user=request.user, pk=session_id)):
         return Response({
-            'message': 'Successfully logged out'
-        })
+            'error': 'Device session not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 @api_view(['GET'])
@@ -431,32 +385,4 @@ def user_info(request):
     """
     Get current user information
     """
-    user = request.user
-    
-    # Prepare user data with role information
-    user_data = {
-        'id': user.id,
-        'username': user.username,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'full_name': user.full_name,
-        'email': user.email,
-        'phone': user.phone,
-        'role': user.role,
-        'role_display': user.get_role_display(),
-        'is_active': user.is_active,
-        'is_staff_member': user.is_staff_member,
-        'has_login_code': bool(user.login_code),
-        'has_biometric': bool(user.biometric_id),
-    }
-    
-    response_data = {
-        'user_id': user.id,
-        'username': user.username,
-        'first_name': user.first_name,
-        'last_name': user.last_name,
-        'email': user.email,
-        'staff': user_data  # Include staff information in the response
-    }
-    
-    return Response(response_data)
+    return Response(user_data(request.user))
@@ -49,11 +49,15 @@ INSTALLED_APPS = [
     'invoice_group',
     'appointment_management',
     'visit_notes',
+    'profiling',
+    'reference_cache',
+    'search',
 
     'widget_tweaks',
 ]
 
 MIDDLEWARE = [
+    'profiling.middleware.RequestProfilingMiddleware',  # First, so it times the whole stack
     'corsheaders.middleware.CorsMiddleware',  # Re-enabled for CORS support
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Temporarily disabled
@@ -170,7 +174,7 @@ AUTH_USER_MODEL = 'authentication.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'authentication.tokens.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -180,6 +184,113 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
 }
 
+# Cache - local memory by default, shared across workers when CACHE_URL points at Redis
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'care-backend',
+    },
+    'profiling': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'care-backend-profiling',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'login-throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'care-backend-login-throttle',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+CACHE_URL = os.environ.get('CACHE_URL')
+if CACHE_URL:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    }
+    CACHES['profiling'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+        'KEY_PREFIX': 'profiling',
+    }
+    CACHES['login-throttle'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+        'KEY_PREFIX': 'throttle',
+    }
+
+# Reference data cache (client summaries, staff profiles), see reference_cache/accessors.py.
+# REFERENCE_CACHE_BACKEND picks the backend: locmem (default), file or redis. Saves only refresh the cache
+# of the process that made them, so with locmem every other gunicorn worker serves its copy until it
+# times out; entries are therefore kept for 60 seconds there and an hour with a shared backend.
+REFERENCE_CACHE = 'reference'
+REFERENCE_CACHE_BACKEND = os.environ.get('REFERENCE_CACHE_BACKEND', 'redis' if CACHE_URL else 'locmem')
+REFERENCE_CACHE_TIMEOUT = int(os.environ.get(
+    'REFERENCE_CACHE_TIMEOUT', 60 if REFERENCE_CACHE_BACKEND == 'locmem' else 3600
+))
+if REFERENCE_CACHE_BACKEND == 'redis':
+    CACHES[REFERENCE_CACHE] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REFERENCE_CACHE_URL', CACHE_URL),
+        'KEY_PREFIX': 'reference',
+    }
+elif REFERENCE_CACHE_BACKEND == 'file':
+    CACHES[REFERENCE_CACHE] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('REFERENCE_CACHE_DIR', str(BASE_DIR / 'cache' / 'reference')),
+    }
+else:
+    CACHES[REFERENCE_CACHE] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'care-backend-reference',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+
+# Login throttling, see authentication/throttling.py: scope -> (attempts, window seconds). 'ip' counts
+# every attempt from one address; 'username' and 'method' count failures per username and, across all
+# clients, per authentication method (password, pin, biometric, lookup). Past the 'method' limit the
+# tighter 'method-ip' limit on one address's failures for that method applies
+LOGIN_THROTTLE_CACHE = 'login-throttle'
+LOGIN_THROTTLE_RATES = {
+    'ip': (int(os.environ.get('LOGIN_THROTTLE_IP', 60)), 60),
+    'username': (int(os.environ.get('LOGIN_THROTTLE_USERNAME', 10)), 900),
+    'method': (int(os.environ.get('LOGIN_THROTTLE_METHOD', 500)), 600),
+    'method-ip': (int(os.environ.get('LOGIN_THROTTLE_METHOD_IP', 5)), 600),
+}
+
+# Days a device's API token is valid after login or rotation, see authentication/tokens.py
+DEVICE_SESSION_LIFETIME_DAYS = int(os.environ.get('DEVICE_SESSION_LIFETIME_DAYS', 30))
+
+# API token cache, see authentication/tokens.py: a per-process LRU of recently used tokens, backed by
+# the TOKEN_AUTH_CACHE alias (shared across workers) when CACHE_URL is set
+TOKEN_AUTH_LOCAL_SIZE = int(os.environ.get('TOKEN_AUTH_LOCAL_SIZE', 10000))
+TOKEN_AUTH_LOCAL_TIMEOUT = int(os.environ.get('TOKEN_AUTH_LOCAL_TIMEOUT', 30))
+TOKEN_AUTH_CACHE = 'default' if CACHE_URL else None
+TOKEN_AUTH_CACHE_TIMEOUT = int(os.environ.get('TOKEN_AUTH_CACHE_TIMEOUT', 300))
+
+# Seconds a staff dashboard snapshot is served from cache before being rebuilt. Writes only drop the
+# snapshot in the process that made them unless CACHE_URL gives the workers a shared cache, so keep
+# the local-memory lifetime short
+STAFF_DASHBOARD_CACHE_TIMEOUT = int(os.environ.get('STAFF_DASHBOARD_CACHE_TIMEOUT', 300 if CACHE_URL else 60))
+
+# Average travel speed (straight-line km/h) the rota optimizer allows between visits
+ROTA_TRAVEL_SPEED_KMH = float(os.environ.get('ROTA_TRAVEL_SPEED_KMH', 30))
+
+# Seconds of recent changes the delta sync sends again on the next pull, covering rows committed late by
+# slow transactions (see appointment_management/delta.py)
+SYNC_COMMIT_LAG = int(os.environ.get('SYNC_COMMIT_LAG', 5))
+
+# Metres from a client's residence a visit may be started or ended, unless the client sets geofence_radius
+VISIT_GEOFENCE_RADIUS_M = float(os.environ.get('VISIT_GEOFENCE_RADIUS_M', 150))
+
+# Where uploaded GPS traces are stored: 'rows' (one VisitLocationLog per point) or 'packed'
+# (one delta-encoded VisitTrace blob per visit); pack existing rows with the pack_visit_traces command
+VISIT_TRACE_STORAGE = os.environ.get('VISIT_TRACE_STORAGE', 'rows')
+
+# Request profiling - per-route timings and query counts, see profiling/store.py
+REQUEST_PROFILING_ENABLED = os.environ.get('REQUEST_PROFILING_ENABLED', 'True').lower() == 'true'
+REQUEST_PROFILING_CACHE = 'profiling'
+REQUEST_PROFILING_FLUSH_INTERVAL = int(os.environ.get('REQUEST_PROFILING_FLUSH_INTERVAL', 10))
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000,http://localhost:8081,https://web-production-83ebd.up.railway.app').split(',')
 
@@ -46,6 +46,8 @@ urlpatterns = [
     path('appointments/<int:appointment_id>/', views.appointment_detail, name='appointment_detail'),
     path('appointments/<int:appointment_id>/edit/', views.appointment_edit, name='appointment_edit'),
     path('appointments/<int:appointment_id>/delete/', views.appointment_delete, name='appointment_delete'),
+    path('appointments/series/<int:series_id>/<str:action>/', views.appointment_occurrence,
+         name='appointment_occurrence'),
     
     # Invoice management
     path('invoices/', views.invoices_list, name='invoice_list'),
@@ -61,6 +63,8 @@ urlpatterns = [
     path('appointments/', include('appointment_management.urls')),
     path('api/', include('invoice_group.urls')),
     path('api/notes/', include('visit_notes.urls')),
+    path('api/profiling/', include('profiling.urls')),
+    path('api/search/', include('search.urls')),
 ]
 
 # Add static files serving in development
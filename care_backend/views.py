@@ -1,8 +1,16 @@
+import heapq
+from operator import attrgetter
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.db.models import Count, Q
 from datetime import datetime, timedelta
+from urllib.parse import urlencode
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
@@ -11,26 +19,53 @@ from django.contrib.auth.forms import UserCreationForm
 from django import forms
 
 from client_management.models import Client
-from appointment_management.models import Appointment
+from appointment_management.models import Appointment, AppointmentSeries
+from appointment_management.recurrence import (
+    build_occurrence, end_series, exclude_occurrence, expand, is_occurrence, split_series, start_series
+)
 from invoice_group.models import InvoiceGroup
 from appointment_management.forms import AppointmentForm
+from appointment_management.utils import today_bounds
 from client_management.forms import ClientForm
 
 User = get_user_model()
 
+# Series are expanded on read; the lists below show the occurrences of the next four weeks
+OCCURRENCE_HORIZON = timedelta(days=28)
+APPOINTMENT_ACTIONS = ('detail', 'edit', 'delete')
+
 def is_admin(user):
     return user.is_authenticated and (user.is_superuser or user.role == 'admin')
 
+def series_occurrences(series, window_start, window_end, **kwargs):
+    """Occurrences of the series (a queryset) in the window, see recurrence.expand, with client and staff loaded"""
+    series = list(
+        series.filter(start_time__lt=window_end).exclude(until__lt=window_start)
+        .select_related('client', 'assigned_staff')
+    )
+    occurrences = expand(series, window_start, window_end, **kwargs)
+    for occurrence in occurrences:
+        occurrence.client = occurrence.series.client
+        occurrence.assigned_staff = occurrence.series.assigned_staff
+    return occurrences
+
+def merge_occurrences(appointments, occurrences, reverse=False):
+    """One list of appointments and series occurrences, both sorted by start time"""
+    return list(heapq.merge(appointments, occurrences, key=attrgetter('start_time'), reverse=reverse))
+
+def active_appointment_count(today_start):
+    """Scheduled visits from today on, with the series occurrences within OCCURRENCE_HORIZON"""
+    rows = Appointment.objects.filter(start_time__gte=today_start, status='scheduled').count()
+    occurrences = series_occurrences(AppointmentSeries.objects.all(), today_start, today_start + OCCURRENCE_HORIZON)
+    return rows + len(occurrences)
+
 def dashboard(request):
     """Main dashboard view"""
-    today = timezone.now().date()
+    today_start, today_end = today_bounds()
     
     # Dashboard statistics
     total_clients = Client.objects.count()
-    active_appointments = Appointment.objects.filter(
-        Q(start_time__date__gte=today) & 
-        Q(status='scheduled')
-    ).count()
+    active_appointments = active_appointment_count(today_start)
     pending_invoices = InvoiceGroup.objects.filter(
         client__isnull=False
     ).distinct().count()
@@ -38,14 +73,18 @@ def dashboard(request):
     
     # Recent appointments
     seven_days_ago = timezone.now() - timedelta(days=7)
-    recent_appointments = Appointment.objects.filter(
-        start_time__gte=seven_days_ago
-    ).order_by('-start_time')[:5]
+    recent_appointments = merge_occurrences(
+        Appointment.objects.filter(start_time__gte=seven_days_ago).order_by('-start_time')[:5],
+        series_occurrences(AppointmentSeries.objects.all(), seven_days_ago, today_start + OCCURRENCE_HORIZON,
+                           reverse=True, limit=5),
+        reverse=True,
+    )[:5]
     
     # Today's appointments
-    today_appointments = Appointment.objects.filter(
-        start_time__date=today
-    ).order_by('start_time')[:5]
+    today_appointments = merge_occurrences(
+        Appointment.objects.filter(start_time__gte=today_start, start_time__lt=today_end).order_by('start_time')[:5],
+        series_occurrences(AppointmentSeries.objects.all(), today_start, today_end, limit=5),
+    )[:5]
     
     context = {
         'total_clients': total_clients,
@@ -126,7 +165,13 @@ def client_delete(request, client_id):
 def client_detail(request, client_id):
     """View client details"""
     client = get_object_or_404(Client, id=client_id)
-    appointments = Appointment.objects.filter(client=client).order_by('-start_time')
+    today_start, _ = today_bounds()
+    appointments = merge_occurrences(
+        Appointment.objects.filter(client=client).order_by('-start_time'),
+        series_occurrences(client.appointment_series.all(), today_start, today_start + OCCURRENCE_HORIZON,
+                           reverse=True),
+        reverse=True,
+    )
     invoices = InvoiceGroup.objects.filter(client=client).order_by('-created_at')
     
     context = {
@@ -142,16 +187,29 @@ def appointments_list(request):
     status_filter = request.GET.get('status', '')
     
     appointments = Appointment.objects.all().order_by('-start_time')
+    # Occurrences copy their series' title and client, and are always scheduled
+    series = AppointmentSeries.objects.all()
     
     if search:
-        appointments = appointments.filter(
+        search_q = (
             Q(title__icontains=search) |
             Q(client__first_name__icontains=search) |
             Q(client__last_name__icontains=search)
         )
+        appointments = appointments.filter(search_q)
+        series = series.filter(search_q)
     
     if status_filter:
         appointments = appointments.filter(status=status_filter)
+        if status_filter != 'scheduled':
+            series = series.none()
+    
+    today_start, _ = today_bounds()
+    appointments = merge_occurrences(
+        appointments,
+        series_occurrences(series, today_start, today_start + OCCURRENCE_HORIZON, reverse=True),
+        reverse=True,
+    )
     
     context = {
         'appointments': appointments,
@@ -165,35 +223,11 @@ def appointment_create(request):
     if request.method == 'POST':
         form = AppointmentForm(request.POST)
         if form.is_valid():
+            # Repeating visits become a series expanded on read, not copied rows
+            rule = form.repeat_rule()
             appointment = form.save()
-            # Automatically create repeated appointments if frequency is set and status is not completed
-            freq = appointment.frequency
-            status = appointment.status
-            if freq and status != 'completed':
-                occurrences = 5
-                delta = None
-                if freq == 'daily':
-                    delta = timedelta(days=1)
-                elif freq == 'weekly':
-                    delta = timedelta(weeks=1)
-                elif freq == 'monthly':
-                    # For monthly, add 30 days as a simple approximation
-                    delta = timedelta(days=30)
-                if delta:
-                    start = appointment.start_time
-                    end = appointment.end_time
-                    for i in range(1, occurrences+1):
-                        new_start = start + delta * i
-                        new_end = end + delta * i
-                        Appointment.objects.create(
-                            title=appointment.title,
-                            description=appointment.description,
-                            client=appointment.client,
-                            start_time=new_start,
-                            end_time=new_end,
-                            status=appointment.status,
-                            frequency=appointment.frequency,
-                        )
+            if rule is not None:
+                start_series(appointment, **rule)
             messages.success(request, 'Appointment created successfully!')
             return redirect('appointment_list')
         else:
@@ -205,14 +239,33 @@ def appointment_create(request):
     }
     return render(request, 'appointments/create.html', context)
 
-def appointment_edit(request, appointment_id):
-    """Edit an appointment"""
-    appointment = get_object_or_404(Appointment, id=appointment_id)
+def appointment_urls(appointment):
+    """Detail, edit and delete URLs of an appointment, or of a series occurrence without a row yet"""
+    if appointment.pk:
+        return {action: reverse(f'appointment_{action}', args=[appointment.pk]) for action in APPOINTMENT_ACTIONS}
+    query = urlencode({'start': appointment.occurrence_start.isoformat()})
+    return {
+        action: f"{reverse('appointment_occurrence', args=[appointment.series_id, action])}?{query}"
+        for action in APPOINTMENT_ACTIONS
+    }
+
+def edit_appointment(request, appointment):
+    """Edit form of an appointment; saving an unsaved series occurrence materializes it"""
     if request.method == 'POST':
         form = AppointmentForm(request.POST, instance=appointment)
         if form.is_valid():
-            form.save()
-            messages.success(request, 'Appointment updated successfully!')
+            try:
+                with transaction.atomic():
+                    appointment = form.save()
+            except IntegrityError:
+                # The occurrence was materialized by another request meanwhile
+                messages.error(request, 'This visit was changed meanwhile. Please try again.')
+                return redirect('appointment_list')
+            if form.applies_to_following():
+                split_series(appointment)
+                messages.success(request, 'Appointment and its later visits updated successfully!')
+            else:
+                messages.success(request, 'Appointment updated successfully!')
             return redirect('appointment_list')
         else:
             messages.error(request, 'Please correct the errors below.')
@@ -224,17 +277,60 @@ def appointment_edit(request, appointment_id):
     }
     return render(request, 'appointments/edit.html', context)
 
-def appointment_delete(request, appointment_id):
-    """Delete an appointment"""
-    appointment = get_object_or_404(Appointment, id=appointment_id)
+def delete_appointment(request, appointment):
+    """Delete an appointment, or an unsaved series occurrence (recorded as excluded from its series)"""
     if request.method == 'POST':
-        appointment.delete()
-        messages.success(request, 'Appointment deleted successfully!')
+        if appointment.series_id and request.POST.get('apply_to') == 'following':
+            # Ends the series here; started visits are kept unless this is one of them
+            end_series(appointment.series, appointment.occurrence_start)
+            if appointment.pk:
+                Appointment.objects.filter(pk=appointment.pk).delete()
+            messages.success(request, 'Appointment and its later visits deleted successfully!')
+        else:
+            if appointment.pk:
+                appointment.delete()
+            else:
+                exclude_occurrence(appointment.series_id, appointment.occurrence_start)
+            messages.success(request, 'Appointment deleted successfully!')
         return redirect('appointment_list')
     
-    context = {'appointment': appointment}
+    context = {'appointment': appointment, 'urls': appointment_urls(appointment)}
     return render(request, 'appointments/delete.html', context)
 
+def appointment_edit(request, appointment_id):
+    """Edit an appointment"""
+    return edit_appointment(request, get_object_or_404(Appointment, id=appointment_id))
+
+def appointment_delete(request, appointment_id):
+    """Delete an appointment"""
+    return delete_appointment(request, get_object_or_404(Appointment, id=appointment_id))
+
+def appointment_occurrence(request, series_id, action):
+    """
+    Detail, edit or delete view of a series occurrence (?start=) that has no
+    row yet. Nothing is written until an edit or deletion is submitted.
+    """
+    series = get_object_or_404(AppointmentSeries, id=series_id)
+    occurrence_start = parse_datetime(request.GET.get('start', ''))
+    if action not in APPOINTMENT_ACTIONS or occurrence_start is None:
+        raise Http404
+    existing = series.occurrences.filter(occurrence_start=occurrence_start).first()
+    if existing is not None:
+        return redirect(f'appointment_{action}', existing.id)
+    if not is_occurrence(series, occurrence_start):
+        raise Http404('Not an occurrence of this series')
+    occurrence = build_occurrence(series, occurrence_start)
+    if action == 'edit':
+        return edit_appointment(request, occurrence)
+    if action == 'delete':
+        return delete_appointment(request, occurrence)
+    context = {
+        'appointment': occurrence,
+        'notes': [],
+        'urls': appointment_urls(occurrence),
+    }
+    return render(request, 'appointments/detail.html', context)
+
 def appointment_detail(request, appointment_id):
     """View appointment details"""
     appointment = get_object_or_404(Appointment, id=appointment_id)
@@ -242,6 +338,7 @@ def appointment_detail(request, appointment_id):
     context = {
         'appointment': appointment,
         'notes': notes,
+        'urls': appointment_urls(appointment),
     }
     return render(request, 'appointments/detail.html', context)
 
@@ -330,16 +427,13 @@ def invoice_detail(request, invoice_id):
 @api_view(['GET'])
 def dashboard_stats(request):
     """Get dashboard statistics"""
-    today = timezone.now().date()
+    today_start, _ = today_bounds()
     
     # Total clients
     total_clients = Client.objects.count()
     
     # Active appointments (scheduled for today or future)
-    active_appointments = Appointment.objects.filter(
-        Q(start_time__date__gte=today) & 
-        Q(status='scheduled')
-    ).count()
+    active_appointments = active_appointment_count(today_start)
     
     # Pending invoices (invoice groups with clients)
     pending_invoices = InvoiceGroup.objects.filter(
@@ -412,7 +506,13 @@ def user_create(request):
 def user_detail(request, user_id):
     """View user details"""
     user = get_object_or_404(User, id=user_id)
-    appointments = Appointment.objects.filter(assigned_staff=user).order_by('-start_time')
+    today_start, _ = today_bounds()
+    appointments = merge_occurrences(
+        Appointment.objects.filter(assigned_staff=user).order_by('-start_time'),
+        series_occurrences(user.appointment_series.all(), today_start, today_start + OCCURRENCE_HORIZON,
+                           reverse=True),
+        reverse=True,
+    )
     
     context = {
         'user_detail': user,
@@ -13,7 +13,7 @@ class ClientAdmin(admin.ModelAdmin):
             'fields': ('first_name', 'last_name', 'email', 'phone')
         }),
         ('Address Information', {
-            'fields': ('address',)
+            'fields': ('address', 'latitude', 'longitude', 'geofence_radius')
         }),
         ('Care Plan', {
             'fields': ('care_checklist',)
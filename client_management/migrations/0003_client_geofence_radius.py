@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('client_management', '0002_client_latitude_client_longitude'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='geofence_radius',
+            field=models.PositiveIntegerField(blank=True, help_text='Distance in metres from the residence within which visits are logged (default VISIT_GEOFENCE_RADIUS_M)', null=True),
+        ),
+    ]
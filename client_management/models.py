@@ -27,6 +27,11 @@ class Client(models.Model):
     
     latitude = models.FloatField(blank=True, null=True, help_text="Latitude of the client's residence")
     longitude = models.FloatField(blank=True, null=True, help_text="Longitude of the client's residence")
+    geofence_radius = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Distance in metres from the residence within which visits are logged (default VISIT_GEOFENCE_RADIUS_M)"
+    )
 
     # Client care checklist
     care_checklist = models.JSONField(
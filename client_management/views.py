@@ -2,9 +2,13 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from search.query import SearchError, search
 from .models import Client
 from .serializers import ClientSerializer
 
+SEARCH_LIMIT = 100
+
+
 class ClientViewSet(viewsets.ModelViewSet):
     queryset = Client.objects.all().order_by('last_name', 'first_name')
     serializer_class = ClientSerializer
@@ -52,19 +56,18 @@ class ClientViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def search(self, request):
-        """Search clients by name or email"""
+        """Search clients by name, email, phone or address"""
         query = request.query_params.get('q', '')
         if not query:
             return Response({'error': 'Query parameter "q" is required'}, 
                           status=status.HTTP_400_BAD_REQUEST)
         
-        clients = Client.objects.filter(
-            first_name__icontains=query
-        ) | Client.objects.filter(
-            last_name__icontains=query
-        ) | Client.objects.filter(
-            email__icontains=query
-        )
-        
-        serializer = self.get_serializer(clients, many=True)
+        # Ranked matches from the search index (see the search app)
+        try:
+            results, _ = search(query, kinds=['client'], limit=SEARCH_LIMIT)
+        except SearchError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        ids = [result['id'] for result in results]
+        clients = Client.objects.in_bulk(ids)
+        serializer = self.get_serializer([clients[pk] for pk in ids if pk in clients], many=True)
         return Response(serializer.data)
@@ -7,7 +7,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'care_backend.settings')
 django.setup()
 
 from django.contrib.auth import get_user_model
-from rest_framework.authtoken.models import Token
+from authentication.tokens import issue
 
 User = get_user_model()
 
@@ -42,12 +42,9 @@ def check_and_fix_user():
         user.save()
         print("User updated successfully!")
         
-        # Create token if it doesn't exist
-        token, created = Token.objects.get_or_create(user=user)
-        if created:
-            print(f"Created new token: {token.key}")
-        else:
-            print(f"Existing token: {token.key}")
+        # Issue a token for this script's device
+        _, token = issue(user, device_id='fix_user')
+        print(f"Issued token: {token}")
             
     except User.DoesNotExist:
         print("\nUser test_staff does not exist. Creating...")
@@ -64,8 +61,8 @@ def check_and_fix_user():
         print(f"Created user: {user.username}")
         
         # Create token
-        token = Token.objects.create(user=user)
-        print(f"Created token: {token.key}")
+        _, token = issue(user, device_id='fix_user')
+        print(f"Issued token: {token}")
     
     print("\nTest credentials:")
     print("Username: test_staff")
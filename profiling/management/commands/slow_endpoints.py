@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from profiling.store import store
+from profiling.views import SORT_FIELDS, sorted_stats
+
+
+class Command(BaseCommand):
+    help = 'Report the slowest routes recorded by the request profiling middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=SORT_FIELDS, default='total_ms', help='Field to rank routes by')
+        parser.add_argument('--limit', type=int, default=20, help='Number of routes to show (0 for all)')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--reset', action='store_true', help='Clear the statistics after reporting')
+
+    def handle(self, *args, **options):
+        stats = sorted_stats(options['sort'], options['limit'] or None)
+
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2))
+        elif not stats:
+            self.stdout.write(self.style.WARNING(
+                'No requests recorded. The report reads REQUEST_PROFILING_CACHE, which must be a '
+                'shared cache backend for statistics from the web workers to be visible here.'
+            ))
+        else:
+            self.stdout.write(
+                f"{'METHOD':<7} {'ROUTE':<55} {'REQS':>7} {'AVG ms':>9} {'P95 ms':>8} {'MAX ms':>9} "
+                f"{'DB ms':>8} {'QUERIES':>8} {'DUPES':>6}"
+            )
+            for row in stats:
+                p95 = f"{row['p95_ms']:g}" if row['p95_ms'] is not None else '>5000'
+                self.stdout.write(
+                    f"{row['method']:<7} {row['route'][:55]:<55} {row['requests']:>7} {row['avg_ms']:>9.1f} "
+                    f"{p95:>8} {row['max_ms']:>9.1f} {row['avg_db_ms']:>8.1f} {row['avg_queries']:>8.1f} "
+                    f"{row['avg_duplicate_queries']:>6.1f}"
+                )
+
+        if options['reset']:
+            store.reset()
+            self.stdout.write(self.style.SUCCESS('Statistics reset.'))
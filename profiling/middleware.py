@@ -0,0 +1,58 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from .store import store
+
+
+class QueryRecorder:
+    """Execute wrapper that times queries and counts exact repeats (same SQL and parameters)"""
+
+    def __init__(self):
+        self.count = 0
+        self.duplicates = 0
+        self.time = 0.0
+        self._seen = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        signature = (sql, repr(params))
+        if signature in self._seen:
+            self.duplicates += 1
+        else:
+            self._seen.add(signature)
+        self.count += 1
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+
+
+class RequestProfilingMiddleware:
+    """
+    Record wall time, database time, query count and duplicate query count per
+    resolved route. Requests that do not resolve to a view (static files, 404s)
+    are ignored.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            store.record(
+                request.method, '/' + match.route, match.view_name, elapsed,
+                recorder.time, recorder.count, recorder.duplicates, response.status_code
+            )
+        return response
@@ -0,0 +1,168 @@
+"""
+Per-route request statistics.
+
+Each process aggregates its requests in memory and every
+REQUEST_PROFILING_FLUSH_INTERVAL seconds adds them to counters in the
+REQUEST_PROFILING_CACHE cache alias. Recording never touches the database.
+Point that alias at a shared backend (Redis or file based) so every worker
+and the slow_endpoints command see the same numbers; with the default
+local-memory backend only the process serving the request does.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = 'request-profile'
+INDEX_KEY = f'{KEY_PREFIX}:index'
+
+# Upper bounds (ms) of the latency histogram used for percentile estimates
+LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf')]
+
+COUNTERS = ['requests', 'errors', 'total_us', 'db_us', 'queries', 'duplicate_queries']
+MAXIMUMS = ['max_us', 'max_queries']
+
+
+def _cache():
+    return caches[getattr(settings, 'REQUEST_PROFILING_CACHE', 'default')]
+
+
+def _route_key(method, route):
+    return hashlib.md5(f'{method} {route}'.encode()).hexdigest()
+
+
+def _new_entry():
+    entry = dict.fromkeys(COUNTERS + MAXIMUMS, 0)
+    entry['buckets'] = [0] * len(LATENCY_BUCKETS)
+    return entry
+
+
+class StatsStore:
+    """Buffers request samples per (method, route) and flushes them to the cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = {}
+        self._routes = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, method, route, view_name, elapsed, db_time, queries, duplicates, status_code):
+        elapsed_us = int(elapsed * 1000000)
+        elapsed_ms = elapsed * 1000
+        key = _route_key(method, route)
+        with self._lock:
+            entry = self._buffer.setdefault(key, _new_entry())
+            self._routes[key] = {'method': method, 'route': route, 'view_name': view_name}
+            entry['requests'] += 1
+            entry['errors'] += status_code >= 500
+            entry['total_us'] += elapsed_us
+            entry['db_us'] += int(db_time * 1000000)
+            entry['queries'] += queries
+            entry['duplicate_queries'] += duplicates
+            entry['max_us'] = max(entry['max_us'], elapsed_us)
+            entry['max_queries'] = max(entry['max_queries'], queries)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed_ms <= bound:
+                    entry['buckets'][i] += 1
+                    break
+            due = time.monotonic() - self._last_flush >= getattr(settings, 'REQUEST_PROFILING_FLUSH_INTERVAL', 10)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the buffered samples to the shared counters"""
+        with self._lock:
+            buffer, routes = self._buffer, self._routes
+            self._buffer, self._routes = {}, {}
+            self._last_flush = time.monotonic()
+        if not buffer:
+            return
+        cache = _cache()
+
+        index = cache.get(INDEX_KEY) or {}
+        if any(key not in index for key in routes):
+            index.update(routes)
+            cache.set(INDEX_KEY, index, None)
+
+        for key, entry in buffer.items():
+            for name in COUNTERS:
+                _incr(cache, f'{KEY_PREFIX}:{key}:{name}', entry[name])
+            for i, count in enumerate(entry['buckets']):
+                if count:
+                    _incr(cache, f'{KEY_PREFIX}:{key}:bucket:{i}', count)
+            for name in MAXIMUMS:
+                cache_key = f'{KEY_PREFIX}:{key}:{name}'
+                if entry[name] > (cache.get(cache_key) or 0):
+                    cache.set(cache_key, entry[name], None)
+
+    def reset(self):
+        """Forget every recorded sample, locally and in the cache"""
+        with self._lock:
+            self._buffer, self._routes = {}, {}
+        cache = _cache()
+        index = cache.get(INDEX_KEY) or {}
+        keys = [INDEX_KEY]
+        for key in index:
+            keys += [f'{KEY_PREFIX}:{key}:{name}' for name in COUNTERS + MAXIMUMS]
+            keys += [f'{KEY_PREFIX}:{key}:bucket:{i}' for i in range(len(LATENCY_BUCKETS))]
+        cache.delete_many(keys)
+
+
+def _incr(cache, key, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # First sample for this counter; fall back to incr if another worker created it meanwhile
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def _percentile(buckets, requests, pct):
+    """Upper bound (ms) of the histogram bucket containing the given percentile"""
+    if not requests:
+        return None
+    threshold = requests * pct / 100
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, buckets):
+        seen += count
+        if seen >= threshold:
+            return bound if bound != float('inf') else None
+    return None
+
+
+def load_stats():
+    """Return the aggregated statistics of every recorded route"""
+    cache = _cache()
+    index = cache.get(INDEX_KEY) or {}
+    stats = []
+    for key, route in index.items():
+        names = COUNTERS + MAXIMUMS
+        values = cache.get_many([f'{KEY_PREFIX}:{key}:{name}' for name in names])
+        entry = {name: values.get(f'{KEY_PREFIX}:{key}:{name}', 0) for name in names}
+        bucket_values = cache.get_many([f'{KEY_PREFIX}:{key}:bucket:{i}' for i in range(len(LATENCY_BUCKETS))])
+        buckets = [bucket_values.get(f'{KEY_PREFIX}:{key}:bucket:{i}', 0) for i in range(len(LATENCY_BUCKETS))]
+        requests = entry['requests']
+        if not requests:
+            continue
+        stats.append({
+            **route,
+            'requests': requests,
+            'errors': entry['errors'],
+            'avg_ms': round(entry['total_us'] / requests / 1000, 2),
+            'max_ms': round(entry['max_us'] / 1000, 2),
+            'p50_ms': _percentile(buckets, requests, 50),
+            'p95_ms': _percentile(buckets, requests, 95),
+            'total_ms': round(entry['total_us'] / 1000, 2),
+            'avg_db_ms': round(entry['db_us'] / requests / 1000, 2),
+            'avg_queries': round(entry['queries'] / requests, 2),
+            'max_queries': entry['max_queries'],
+            'avg_duplicate_queries': round(entry['duplicate_queries'] / requests, 2),
+        })
+    return stats
+
+
+store = StatsStore()
@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APIClient
+from io import StringIO
+
+from .store import store
+
+User = get_user_model()
+
+
+@override_settings(REQUEST_PROFILING_FLUSH_INTERVAL=0)
+class RequestProfilingTestCase(TestCase):
+    """Test the profiling middleware, report endpoint and report command"""
+
+    url = '/api/profiling/routes/'
+
+    def setUp(self):
+        caches['profiling'].clear()
+        store.reset()
+        self.admin = User.objects.create_user(username='profiling_admin', password='testpass123', role='admin')
+        self.nurse = User.objects.create_user(username='profiling_nurse', password='testpass123')
+        self.api_client = APIClient()
+
+    def test_requests_are_recorded_per_route(self):
+        self.api_client.force_authenticate(user=self.nurse)
+        for _ in range(3):
+            self.api_client.get('/appointments/api/staff/appointments/in_progress/')
+
+        self.api_client.force_authenticate(user=self.admin)
+        response = self.api_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        routes = {row['route']: row for row in response.json()['routes']}
+        in_progress = routes['/appointments/api/staff/appointments/in_progress/$']
+        self.assertEqual(in_progress['method'], 'GET')
+        self.assertEqual(in_progress['requests'], 3)
+        self.assertEqual(in_progress['avg_queries'], 1)
+        self.assertIsNotNone(in_progress['p95_ms'])
+
+    def test_endpoint_is_admin_only(self):
+        self.api_client.force_authenticate(user=self.nurse)
+        self.assertEqual(self.api_client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_reset_and_report_command(self):
+        self.api_client.force_authenticate(user=self.nurse)
+        self.api_client.get('/api/auth/user/')
+        out = StringIO()
+        call_command('slow_endpoints', stdout=out)
+        self.assertIn('/api/auth/user/', out.getvalue())
+
+        self.api_client.force_authenticate(user=self.admin)
+        self.assertEqual(self.api_client.delete(self.url).status_code, status.HTTP_204_NO_CONTENT)
+        # Only the reset request itself, recorded after the counters were dropped, remains
+        routes = [row['route'] for row in self.api_client.get(self.url).json()['routes']]
+        self.assertEqual(routes, [self.url])
@@ -0,0 +1,6 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('routes/', views.RouteStatsAPIView.as_view(), name='profiling-routes'),
+]
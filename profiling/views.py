@@ -0,0 +1,42 @@
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .permissions import IsAdminRole
+from .store import load_stats, store
+
+SORT_FIELDS = ['total_ms', 'avg_ms', 'p95_ms', 'max_ms', 'avg_db_ms', 'avg_queries', 'avg_duplicate_queries', 'requests']
+
+
+def sorted_stats(sort='total_ms', limit=None):
+    """Route statistics, slowest first by the given field"""
+    stats = sorted(load_stats(), key=lambda row: row[sort] or 0, reverse=True)
+    return stats[:limit] if limit else stats
+
+
+class RouteStatsAPIView(APIView):
+    """
+    API endpoint exposing per-route latency and query statistics (admins only)
+    """
+    permission_classes = [IsAdminRole]
+
+    def get(self, request):
+        """Get route statistics, sorted by ?sort= (default total_ms) and cut to ?limit="""
+        sort = request.query_params.get('sort', 'total_ms')
+        if sort not in SORT_FIELDS:
+            return Response(
+                {'error': f"sort must be one of: {', '.join(SORT_FIELDS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = int(request.query_params.get('limit', 0)) or None
+        except ValueError:
+            return Response({'error': 'limit must be a whole number'}, status=status.HTTP_400_BAD_REQUEST)
+        # Include this worker's samples that have not been flushed yet
+        store.flush()
+        return Response({'sort': sort, 'routes': sorted_stats(sort, limit)})
+
+    def delete(self, request):
+        """Reset all recorded statistics"""
+        store.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
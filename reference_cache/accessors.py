@@ -0,0 +1,156 @@
+"""
+Cached reference data: client summaries and staff profiles.
+
+These rows are read on nearly every request (every serialized appointment shows
+the client name, address and care checklist, and the assigned carer) but change
+rarely, so they are kept in the REFERENCE_CACHE cache alias. The alias can be a
+local-memory, file based or Redis backend (see REFERENCE_CACHE_BACKEND in the
+settings). Entries are refreshed by the signal handlers in
+reference_cache.signals whenever a Client or User is saved or deleted, but only
+in the process that saved it: with a local-memory cache the other workers see
+the change after REFERENCE_CACHE_TIMEOUT (60 seconds by default for locmem).
+queryset update() and bulk_create() bypass those signals, so entries written
+that way are likewise only picked up after REFERENCE_CACHE_TIMEOUT. Values that
+are written back to the database must not be derived from this cache.
+"""
+from typing import Dict, Iterable, List, Optional, TypedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from client_management.models import Client
+
+User = get_user_model()
+
+CLIENT_KEY = 'client:{}'
+STAFF_KEY = 'staff:{}'
+DEFAULT_TIMEOUT = 3600  # seconds
+
+
+class ClientSummary(TypedDict):
+    id: int
+    full_name: str
+    address: str
+    care_checklist: List[str]
+    latitude: Optional[float]
+    longitude: Optional[float]
+
+
+class StaffProfile(TypedDict):
+    id: int
+    username: str
+    first_name: str
+    last_name: str
+    full_name: str
+    email: str
+    phone: Optional[str]
+    role: str
+    role_display: str
+    is_active: bool
+    is_staff_member: bool
+
+
+CLIENT_FIELDS = ['id', 'first_name', 'last_name', 'address', 'care_checklist', 'latitude', 'longitude']
+STAFF_FIELDS = ['id', 'username', 'first_name', 'last_name', 'email', 'phone', 'role', 'is_active', 'is_staff_member']
+
+
+def _cache():
+    return caches[getattr(settings, 'REFERENCE_CACHE', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'REFERENCE_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def client_summary(client: Client) -> ClientSummary:
+    """Build the summary of a loaded client"""
+    return {
+        'id': client.id,
+        'full_name': client.full_name,
+        'address': client.full_address,
+        'care_checklist': list(client.care_checklist or []),
+        'latitude': client.latitude,
+        'longitude': client.longitude,
+    }
+
+
+def staff_profile(user) -> StaffProfile:
+    """Build the profile of a loaded user, as shown by the auth and dashboard APIs"""
+    return {
+        'id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'full_name': user.full_name,
+        'email': user.email,
+        'phone': user.phone,
+        'role': user.role,
+        'role_display': user.get_role_display(),
+        'is_active': user.is_active,
+        'is_staff_member': user.is_staff_member,
+    }
+
+
+def _get_many(key_format, ids, load, build):
+    """Look ids up in the cache and load the misses with a single query"""
+    ids = {pk for pk in ids if pk is not None}
+    if not ids:
+        return {}
+    cache = _cache()
+    keys = {key_format.format(pk): pk for pk in ids}
+    found = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = ids - found.keys()
+    if missing:
+        loaded = {obj.pk: build(obj) for obj in load(missing)}
+        cache.set_many({key_format.format(pk): value for pk, value in loaded.items()}, _timeout())
+        found.update(loaded)
+    return found
+
+
+def get_client_summaries(client_ids: Iterable[int]) -> Dict[int, ClientSummary]:
+    """Summaries of the given clients keyed by id; unknown ids are left out"""
+    return _get_many(
+        CLIENT_KEY, client_ids,
+        lambda ids: Client.objects.filter(pk__in=ids).only(*CLIENT_FIELDS),
+        client_summary,
+    )
+
+
+def get_client_summary(client_id: int) -> Optional[ClientSummary]:
+    return get_client_summaries([client_id]).get(client_id)
+
+
+def get_care_checklist(client_id: int) -> List[str]:
+    """Care checklist of a client, empty for unknown clients"""
+    summary = get_client_summary(client_id)
+    return summary['care_checklist'] if summary else []
+
+
+def get_staff_profiles(user_ids: Iterable[int]) -> Dict[int, StaffProfile]:
+    """Profiles of the given users keyed by id; unknown ids are left out"""
+    return _get_many(
+        STAFF_KEY, user_ids,
+        lambda ids: User.objects.filter(pk__in=ids).only(*STAFF_FIELDS),
+        staff_profile,
+    )
+
+
+def get_staff_profile(user_id: int) -> Optional[StaffProfile]:
+    return get_staff_profiles([user_id]).get(user_id)
+
+
+def refresh_client(client: Client) -> None:
+    _cache().set(CLIENT_KEY.format(client.pk), client_summary(client), _timeout())
+
+
+def refresh_staff(user) -> None:
+    _cache().set(STAFF_KEY.format(user.pk), staff_profile(user), _timeout())
+
+
+def invalidate_clients(*client_ids: int) -> None:
+    _cache().delete_many([CLIENT_KEY.format(pk) for pk in client_ids])
+
+
+def invalidate_staff(*user_ids: int) -> None:
+    _cache().delete_many([STAFF_KEY.format(pk) for pk in user_ids])
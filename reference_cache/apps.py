@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class ReferenceCacheConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'reference_cache'
+
+    def ready(self):
+        from . import signals  # noqa: F401
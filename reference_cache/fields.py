@@ -0,0 +1,71 @@
+"""
+Serializer fields reading client and staff data from the reference cache.
+
+Use ReferenceListSerializer as the list_serializer_class of serializers with
+these fields, so a whole page is resolved with one cache round trip per kind of
+reference instead of one per row.
+"""
+from operator import attrgetter
+
+from rest_framework import serializers
+
+from .accessors import get_client_summaries, get_staff_profiles
+
+LOADERS = {
+    'clients': get_client_summaries,
+    'staff': get_staff_profiles,
+}
+
+
+class ReferenceField(serializers.Field):
+    """Read-only value taken from a cached client summary or staff profile"""
+
+    kind = None
+
+    def __init__(self, key, id_path, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self.key = key
+        self.get_id = attrgetter(id_path)
+
+    def lookup(self, instance):
+        reference_id = self.get_id(instance)
+        preloaded = getattr(self.parent, '_references', None)
+        if preloaded is not None and self.kind in preloaded:
+            return preloaded[self.kind].get(reference_id)
+        return LOADERS[self.kind]([reference_id]).get(reference_id)
+
+    def to_representation(self, instance):
+        data = self.lookup(instance)
+        return data[self.key] if data else None
+
+
+class ClientReferenceField(ReferenceField):
+    kind = 'clients'
+
+    def __init__(self, key, id_path='client_id', **kwargs):
+        super().__init__(key, id_path, **kwargs)
+
+
+class StaffReferenceField(ReferenceField):
+    kind = 'staff'
+
+    def __init__(self, key, id_path='assigned_staff_id', **kwargs):
+        super().__init__(key, id_path, **kwargs)
+
+
+class ReferenceListSerializer(serializers.ListSerializer):
+    """Loads the references of every item up front, one cache round trip per kind"""
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        ids = {}
+        for field in self.child.fields.values():
+            if isinstance(field, ReferenceField):
+                ids.setdefault(field.kind, set()).update(field.get_id(item) for item in items)
+        self.child._references = {kind: LOADERS[kind](kind_ids) for kind, kind_ids in ids.items()}
+        try:
+            return super().to_representation(items)
+        finally:
+            self.child._references = None
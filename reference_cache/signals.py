@@ -0,0 +1,43 @@
+"""
+Keep the reference cache in step with Client and User writes.
+
+Full saves rewrite the cached entry from the saved instance (no extra query).
+Partial saves (update_fields) drop the entry if they touch a cached field, so it
+is reloaded on the next read, and leave it alone otherwise (e.g. last_login).
+"""
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from client_management.models import Client
+from .accessors import (
+    CLIENT_FIELDS, STAFF_FIELDS, invalidate_clients, invalidate_staff, refresh_client, refresh_staff,
+)
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Client)
+def client_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None:
+        refresh_client(instance)
+    elif set(update_fields) & set(CLIENT_FIELDS):
+        invalidate_clients(instance.pk)
+
+
+@receiver(post_delete, sender=Client)
+def client_deleted(sender, instance, **kwargs):
+    invalidate_clients(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None:
+        refresh_staff(instance)
+    elif set(update_fields) & set(STAFF_FIELDS):
+        invalidate_staff(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_staff(instance.pk)
@@ -0,0 +1,93 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from appointment_management.models import Appointment
+from client_management.models import Client
+from .accessors import get_care_checklist, get_client_summaries, get_client_summary, get_staff_profile
+
+User = get_user_model()
+
+
+class ReferenceCacheTestCase(TestCase):
+    """Test the cached client and staff accessors and their signal driven refresh"""
+
+    def setUp(self):
+        self.cache = caches['reference']
+        self.cache.clear()
+        self.user = User.objects.create_user(
+            username='reference_staff', password='testpass123', first_name='Ada', last_name='Carer'
+        )
+        self.clients = [
+            Client.objects.create(first_name=f'Client{i}', last_name='Cached', address=f'{i} Cache Lane',
+                                  care_checklist=['hygiene', 'nutrition'])
+            for i in range(3)
+        ]
+
+    def test_saves_populate_the_cache(self):
+        with self.assertNumQueries(0):
+            summary = get_client_summary(self.clients[0].id)
+            profile = get_staff_profile(self.user.id)
+        self.assertEqual(summary['full_name'], 'Client0 Cached')
+        self.assertEqual(summary['care_checklist'], ['hygiene', 'nutrition'])
+        self.assertEqual(profile['full_name'], 'Ada Carer')
+
+    def test_misses_are_loaded_in_one_query(self):
+        self.cache.clear()
+        ids = [client.id for client in self.clients]
+        with self.assertNumQueries(1):
+            summaries = get_client_summaries(ids + [999999])
+        self.assertEqual(set(summaries), set(ids))
+        with self.assertNumQueries(0):
+            get_client_summaries(ids)
+
+    def test_client_changes_are_visible(self):
+        client = self.clients[0]
+        client.care_checklist = ['mobility']
+        client.save()
+        self.assertEqual(get_care_checklist(client.id), ['mobility'])
+
+        client_id = client.id
+        client.delete()
+        self.assertIsNone(get_client_summary(client_id))
+
+    def test_partial_user_saves(self):
+        self.user.first_name = 'Grace'
+        self.user.save(update_fields=['first_name'])
+        self.assertEqual(get_staff_profile(self.user.id)['first_name'], 'Grace')
+
+        # Saves not touching cached fields keep the entry
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            get_staff_profile(self.user.id)
+
+    def test_appointment_list_reads_references_from_cache(self):
+        now = timezone.now()
+        for i, client in enumerate(self.clients):
+            Appointment.objects.create(
+                title='Visit', client=client, assigned_staff=self.user,
+                start_time=now + timedelta(hours=1 + i), end_time=now + timedelta(hours=2 + i),
+                checklist_items=['hygiene'],
+            )
+        api_client = APIClient()
+        api_client.force_authenticate(user=self.user)
+        url = '/appointments/api/staff/appointments/upcoming/'
+
+        # Appointment rows and the staff member's recurring series; no reference lookups
+        with self.assertNumQueries(2):
+            response = api_client.get(url)
+        row = response.json()['results'][0]
+        self.assertEqual(row['client_name'], 'Client0 Cached')
+        self.assertEqual(row['assigned_staff_name'], 'reference_staff')
+        self.assertEqual(row['available_checklist_items'], ['hygiene', 'nutrition'])
+        self.assertEqual(row['checklist_completion_percentage'], 50)
+
+        # A cold cache costs one query per kind of reference, not one per row
+        self.cache.clear()
+        with self.assertNumQueries(4):
+            api_client.get(url)
@@ -0,0 +1,107 @@
+"""
+Database full-text indexes over SearchEntry.title and body.
+
+PostgreSQL: a GIN index on a weighted tsvector (title A, body B) with the
+'simple' configuration, so names are not stemmed; queries rank by ts_rank.
+SQLite: an external-content FTS5 table kept in step by triggers; queries rank
+by bm25 with titles weighted 10:1. Other databases fall back to icontains
+over the entries table.
+
+Every term matches as a prefix and all terms must match, so "smi ja" finds
+"Jane Smith". install() and uninstall() are run by the search migrations.
+"""
+from django.db import connection
+from django.db.models import Q
+
+from .models import SearchEntry
+
+TABLE = 'search_searchentry'
+FTS_TABLE = 'search_entry_fts'
+
+POSTGRES_VECTOR = (
+    "(setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', body), 'B'))"
+)
+
+SQLITE_INSTALL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    f"title, body, content='{TABLE}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER search_entry_ai AFTER INSERT ON {TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    f"CREATE TRIGGER search_entry_ad AFTER DELETE ON {TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    f"CREATE TRIGGER search_entry_au AFTER UPDATE OF title, body ON {TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS search_entry_ai',
+    'DROP TRIGGER IF EXISTS search_entry_ad',
+    'DROP TRIGGER IF EXISTS search_entry_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+POSTGRES_INSTALL = [f'CREATE INDEX search_entry_fts_idx ON {TABLE} USING GIN ({POSTGRES_VECTOR})']
+POSTGRES_UNINSTALL = ['DROP INDEX IF EXISTS search_entry_fts_idx']
+
+
+def _statements(vendor, install):
+    if vendor == 'sqlite':
+        return SQLITE_INSTALL if install else SQLITE_UNINSTALL
+    if vendor == 'postgresql':
+        return POSTGRES_INSTALL if install else POSTGRES_UNINSTALL
+    return []
+
+
+def install(apps, schema_editor):
+    for statement in _statements(schema_editor.connection.vendor, install=True):
+        schema_editor.execute(statement)
+
+
+def uninstall(apps, schema_editor):
+    for statement in _statements(schema_editor.connection.vendor, install=False):
+        schema_editor.execute(statement)
+
+
+def _scope(kinds, staff_id):
+    """SQL condition and parameters restricting entries to kinds and, for a carer, what they may see"""
+    sql = f"e.kind IN ({', '.join(['%s'] * len(kinds))})"
+    params = list(kinds)
+    if staff_id is not None:
+        sql += " AND (e.kind = 'client' OR e.staff_id = %s)"
+        params.append(staff_id)
+    return sql, params
+
+
+def match_ids(terms, kinds, staff_id=None, limit=20, offset=0):
+    """
+    Ids of the entries matching every term, best first.
+
+    `terms` are lowercase word tokens; `staff_id`, when given, limits visit
+    records to that carer's.
+    """
+    scope, params = _scope(kinds, staff_id)
+    if connection.vendor == 'sqlite':
+        sql = (
+            f"SELECT e.id FROM {FTS_TABLE} f JOIN {TABLE} e ON e.id = f.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s AND {scope} "
+            f"ORDER BY bm25({FTS_TABLE}, 10.0, 1.0), e.id LIMIT %s OFFSET %s"
+        )
+        params = [' '.join(f'"{term}"*' for term in terms)] + params + [limit, offset]
+    elif connection.vendor == 'postgresql':
+        sql = (
+            f"SELECT e.id FROM {TABLE} e, to_tsquery('simple', %s) query "
+            f"WHERE {POSTGRES_VECTOR} @@ query AND {scope} "
+            f"ORDER BY ts_rank({POSTGRES_VECTOR}, query) DESC, e.id LIMIT %s OFFSET %s"
+        )
+        params = [' & '.join(f'{term}:*' for term in terms)] + params + [limit, offset]
+    else:
+        queryset = SearchEntry.objects.filter(kind__in=kinds)
+        if staff_id is not None:
+            queryset = queryset.filter(Q(kind='client') | Q(staff_id=staff_id))
+        for term in terms:
+            queryset = queryset.filter(Q(title__icontains=term) | Q(body__icontains=term))
+        return list(queryset.order_by('-date', 'id').values_list('id', flat=True)[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
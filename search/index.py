@@ -0,0 +1,134 @@
+"""
+Search documents.
+
+Each indexed object becomes one SearchEntry: a client's name (title) with its
+email, phone and address; an appointment's title with its description; a
+note's content; an incident's details. Visit records carry their visit's
+client and carer so results can be scoped to the carer's own visits.
+
+Entries are written with one upsert per batch (bulk_create with
+update_conflicts): by the signal handlers for single saves, by index() from
+the engines that write visits and visit records in bulk, and by rebuild() for
+everything else.
+"""
+from collections import defaultdict
+
+from django.db.models import Exists, OuterRef
+
+from appointment_management.models import Appointment, Incident
+from client_management.models import Client
+from visit_notes.models import Note
+from .models import SearchEntry
+
+BATCH_SIZE = 1000
+UPDATE_FIELDS = ['title', 'body', 'client_id', 'appointment_id', 'staff_id', 'date']
+
+
+def _text(*parts):
+    return '\n'.join(part for part in parts if part)
+
+
+def client_entry(client):
+    return SearchEntry(
+        kind='client', object_id=client.pk, title=client.full_name[:255],
+        body=_text(client.email, client.phone, client.address), client_id=client.pk,
+    )
+
+
+def appointment_entry(appointment):
+    return SearchEntry(
+        kind='appointment', object_id=appointment.pk, title=appointment.title[:255], body=appointment.description or '',
+        client_id=appointment.client_id, appointment_id=appointment.pk, staff_id=appointment.assigned_staff_id,
+        date=appointment.start_time,
+    )
+
+
+def note_entry(note):
+    return SearchEntry(
+        kind='note', object_id=note.pk, body=note.content, client_id=note.appointment.client_id,
+        appointment_id=note.appointment_id, staff_id=note.appointment.assigned_staff_id, date=note.created_at,
+    )
+
+
+def incident_entry(incident):
+    return SearchEntry(
+        kind='incident', object_id=incident.pk, body=incident.incident_details,
+        client_id=incident.appointment.client_id, appointment_id=incident.appointment_id,
+        staff_id=incident.appointment.assigned_staff_id, date=incident.time,
+    )
+
+
+# kind -> (model, entry builder, fields the entry is built from, rows for a rebuild)
+DOCUMENTS = {
+    'client': (Client, client_entry, {'first_name', 'last_name', 'email', 'phone', 'address'},
+               lambda: Client.objects.only('first_name', 'last_name', 'email', 'phone', 'address')),
+    'appointment': (Appointment, appointment_entry,
+                    {'title', 'description', 'client', 'assigned_staff', 'start_time'},
+                    lambda: Appointment.objects.only(
+                        'title', 'description', 'client_id', 'assigned_staff_id', 'start_time')),
+    'note': (Note, note_entry, {'content', 'appointment'},
+             lambda: Note.objects.select_related('appointment').only(
+                 'content', 'created_at', 'appointment__client', 'appointment__assigned_staff')),
+    'incident': (Incident, incident_entry, {'incident_details', 'time', 'appointment'},
+                 lambda: Incident.objects.select_related('appointment').only(
+                     'incident_details', 'time', 'appointment__client', 'appointment__assigned_staff')),
+}
+KINDS = {model: kind for kind, (model, *_) in DOCUMENTS.items()}
+
+
+def write(entries):
+    """Insert or refresh entries, one statement per batch"""
+    for start in range(0, len(entries), BATCH_SIZE):
+        SearchEntry.objects.bulk_create(
+            entries[start:start + BATCH_SIZE], update_conflicts=True,
+            unique_fields=['kind', 'object_id'], update_fields=UPDATE_FIELDS,
+        )
+
+
+def move_visit_records(appointments):
+    """Point the entries of the appointments and their notes and incidents at the visits' current carers"""
+    by_staff = defaultdict(list)
+    for appointment in appointments:
+        by_staff[appointment.assigned_staff_id].append(appointment.pk)
+    for staff_id, ids in by_staff.items():
+        SearchEntry.objects.filter(appointment_id__in=ids).exclude(staff_id=staff_id).update(staff_id=staff_id)
+
+
+def index(model, objects, fields=None, created=False):
+    """
+    Write the entries of objects that were just saved, unless `fields` (the
+    fields written) includes none of the indexed ones. Bulk writers call this
+    themselves, as bulk_create() and bulk_update() send no signals.
+    """
+    _, build, indexed, _ = DOCUMENTS[KINDS[model]]
+    if fields is not None and not indexed & set(fields):
+        return
+    write([build(obj) for obj in objects])
+    if model is Appointment and not created:
+        move_visit_records(objects)
+
+
+def remove(kind, ids):
+    return SearchEntry.objects.filter(kind=kind, object_id__in=ids).delete()[0]
+
+
+def rebuild(kinds=None, batch_size=BATCH_SIZE):
+    """
+    Re-index every object of the given kinds (default all) in id batches and
+    drop entries whose object is gone. Returns {kind: entries written}.
+    """
+    written = {}
+    for kind in kinds or DOCUMENTS:
+        model, build, _, rows = DOCUMENTS[kind]
+        written[kind] = last = 0
+        while True:
+            batch = list(rows().filter(pk__gt=last).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            write([build(obj) for obj in batch])
+            written[kind] += len(batch)
+            last = batch[-1].pk
+        SearchEntry.objects.filter(kind=kind).filter(
+            ~Exists(model.objects.filter(pk=OuterRef('object_id')))
+        ).delete()
+    return written
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from search.index import BATCH_SIZE, DOCUMENTS, rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-index clients, appointments, notes and incidents for search; run once after migrating '
+        'and after bulk changes made with update() or bulk_create()'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=list(DOCUMENTS), action='append', dest='kinds',
+                            help='Only re-index this type (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Objects indexed per statement')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        written = rebuild(options['kinds'], batch_size=options['batch_size'])
+        for kind, count in written.items():
+            self.stdout.write(f'{kind}: {count} indexed')
+        self.stdout.write(self.style.SUCCESS(f'Indexed {sum(written.values())} objects'))
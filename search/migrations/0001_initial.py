@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:39
+
+from django.db import migrations, models
+
+import search.backends
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('client', 'Client'), ('appointment', 'Appointment'), ('note', 'Note'), ('incident', 'Incident')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('body', models.TextField(blank=True)),
+                ('client_id', models.BigIntegerField(blank=True, null=True)),
+                ('appointment_id', models.BigIntegerField(blank=True, null=True)),
+                ('staff_id', models.BigIntegerField(blank=True, help_text='Carer who may see the entry', null=True)),
+                ('date', models.DateTimeField(blank=True, help_text='Visit start, note or incident time', null=True)),
+            ],
+            options={
+                'verbose_name': 'Search entry',
+                'verbose_name_plural': 'Search entries',
+                'indexes': [models.Index(fields=['appointment_id'], name='search_entry_appt_idx')],
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='search_entry_object_uniq')],
+            },
+        ),
+        migrations.RunPython(search.backends.install, search.backends.uninstall),
+    ]
@@ -0,0 +1,71 @@
+"""
+Index the clients, appointments, notes and incidents that existed before the
+search index did. Entries are built like search.index builds them, but from
+the historical models, so later changes to the app code leave this alone.
+"""
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def _text(*parts):
+    return '\n'.join(part for part in parts if part)
+
+
+def _batches(queryset):
+    last = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last).order_by('pk')[:BATCH_SIZE])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
+
+
+def fill_index(apps, schema_editor):
+    SearchEntry = apps.get_model('search', 'SearchEntry')
+    Client = apps.get_model('client_management', 'Client')
+    Appointment = apps.get_model('appointment_management', 'Appointment')
+    Incident = apps.get_model('appointment_management', 'Incident')
+    Note = apps.get_model('visit_notes', 'Note')
+
+    documents = [
+        (Client.objects.all(), lambda client: SearchEntry(
+            kind='client', object_id=client.pk, title=f'{client.first_name} {client.last_name}'[:255],
+            body=_text(client.email, client.phone, client.address), client_id=client.pk,
+        )),
+        (Appointment.objects.all(), lambda appointment: SearchEntry(
+            kind='appointment', object_id=appointment.pk, title=appointment.title[:255],
+            body=appointment.description or '', client_id=appointment.client_id, appointment_id=appointment.pk,
+            staff_id=appointment.assigned_staff_id, date=appointment.start_time,
+        )),
+        (Note.objects.select_related('appointment'), lambda note: SearchEntry(
+            kind='note', object_id=note.pk, body=note.content, client_id=note.appointment.client_id,
+            appointment_id=note.appointment_id, staff_id=note.appointment.assigned_staff_id, date=note.created_at,
+        )),
+        (Incident.objects.select_related('appointment'), lambda incident: SearchEntry(
+            kind='incident', object_id=incident.pk, body=incident.incident_details,
+            client_id=incident.appointment.client_id, appointment_id=incident.appointment_id,
+            staff_id=incident.appointment.assigned_staff_id, date=incident.time,
+        )),
+    ]
+    for queryset, build in documents:
+        for batch in _batches(queryset):
+            SearchEntry.objects.bulk_create(
+                [build(obj) for obj in batch], update_conflicts=True, unique_fields=['kind', 'object_id'],
+                update_fields=['title', 'body', 'client_id', 'appointment_id', 'staff_id', 'date'],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+        ('client_management', '0003_client_geofence_radius'),
+        ('appointment_management', '0011_appointmentseries_excluded_starts'),
+        ('visit_notes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+from django.db import models
+
+
+class SearchEntry(models.Model):
+    """
+    One searchable document: the text of a client, appointment, note or
+    incident, with the ids used to scope and link results.
+
+    The full-text index over title and body is kept by the database (see
+    search.backends); rows are maintained by search.signals and the
+    rebuild_search_index command.
+    """
+    KIND_CHOICES = [
+        ('client', 'Client'),
+        ('appointment', 'Appointment'),
+        ('note', 'Note'),
+        ('incident', 'Incident'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    title = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)
+    # Plain ids rather than foreign keys: entries are derived data, written in bulk
+    client_id = models.BigIntegerField(blank=True, null=True)
+    appointment_id = models.BigIntegerField(blank=True, null=True)
+    staff_id = models.BigIntegerField(blank=True, null=True, help_text="Carer who may see the entry")
+    date = models.DateTimeField(blank=True, null=True, help_text="Visit start, note or incident time")
+
+    class Meta:
+        verbose_name = "Search entry"
+        verbose_name_plural = "Search entries"
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_entry_object_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['appointment_id'], name='search_entry_appt_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
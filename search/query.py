@@ -0,0 +1,61 @@
+import re
+
+from reference_cache.accessors import get_client_summaries
+from .backends import match_ids
+from .index import DOCUMENTS
+from .models import SearchEntry
+
+MAX_TERMS = 8
+EXCERPT_LENGTH = 160
+
+
+class SearchError(ValueError):
+    pass
+
+
+def terms(query):
+    """Lowercase word tokens of a query, at most MAX_TERMS"""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_TERMS]
+
+
+def excerpt(text, words):
+    """About EXCERPT_LENGTH characters of `text` around the first word found"""
+    lower = text.lower()
+    positions = [position for position in (lower.find(word) for word in words) if position >= 0]
+    start = max(min(positions, default=0) - EXCERPT_LENGTH // 4, 0)
+    snippet = ' '.join(text[start:start + EXCERPT_LENGTH].split())
+    return ('…' if start else '') + snippet + ('…' if start + EXCERPT_LENGTH < len(text) else '')
+
+
+def search(query, kinds=None, staff_id=None, limit=20, offset=0):
+    """
+    Ranked results for `query` as dicts, plus whether more follow. Carers
+    (`staff_id` set) see every client but only their own visits' records.
+    """
+    words = terms(query)
+    if not words:
+        raise SearchError('Enter at least one word to search for.')
+    kinds = kinds or list(DOCUMENTS)
+    unknown = set(kinds) - set(DOCUMENTS)
+    if unknown:
+        raise SearchError(f'type must be one of {", ".join(DOCUMENTS)}')
+
+    ids = match_ids(words, kinds, staff_id=staff_id, limit=limit + 1, offset=offset)
+    has_more = len(ids) > limit
+    entries = SearchEntry.objects.in_bulk(ids[:limit])
+    ranked = [entries[pk] for pk in ids[:limit] if pk in entries]
+    clients = get_client_summaries({entry.client_id for entry in ranked})
+    results = []
+    for entry in ranked:
+        client = clients.get(entry.client_id)
+        results.append({
+            'type': entry.kind,
+            'id': entry.object_id,
+            'title': entry.title,
+            'excerpt': excerpt(entry.body, words),
+            'client': entry.client_id,
+            'client_name': client['full_name'] if client else None,
+            'appointment': entry.appointment_id,
+            'date': entry.date,
+        })
+    return results, has_more
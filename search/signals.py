@@ -0,0 +1,32 @@
+"""
+Keep search entries in step with the indexed models.
+
+Saves re-index the object with one upsert, unless update_fields shows none of
+its indexed fields changed; reassigning an appointment also moves its notes
+and incidents to the new carer. Queryset update(), bulk_create() and
+bulk_update() bypass these signals: the bulk and mobile sync engines call
+index() themselves, and the rebuild_search_index command covers the rest.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from appointment_management.models import Appointment, Incident
+from client_management.models import Client
+from visit_notes.models import Note
+from .index import KINDS, index, remove
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Appointment)
+@receiver(post_save, sender=Note)
+@receiver(post_save, sender=Incident)
+def object_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    index(sender, [instance], update_fields, created)
+
+
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_delete, sender=Note)
+@receiver(post_delete, sender=Incident)
+def object_deleted(sender, instance, **kwargs):
+    remove(KINDS[sender], [instance.pk])
@@ -0,0 +1,163 @@
+import io
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from appointment_management.bulk import BulkAppointmentEngine
+from appointment_management.models import Appointment, Incident
+from appointment_management.sync import MobileSyncEngine
+from client_management.models import Client
+from visit_notes.models import Note
+from .models import SearchEntry
+
+User = get_user_model()
+
+
+class SearchTestCase(TestCase):
+    """Test the search index and the unified search endpoint"""
+
+    url = '/api/search/'
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='search_admin', password='testpass123', role='admin',
+                                              is_staff_member=False)
+        self.carers = [User.objects.create_user(username=f'search_carer{i}', password='testpass123')
+                       for i in range(2)]
+        self.jane = Client.objects.create(first_name='Jane', last_name='Smithson', address='4 Mill Lane',
+                                          email='jane@example.com')
+        self.other = Client.objects.create(first_name='Peter', last_name='Jones', address='9 Smithy Road')
+        start = timezone.now() + timedelta(days=1)
+        self.visits = [
+            Appointment.objects.create(title=title, client=client, assigned_staff=carer, start_time=start,
+                                       end_time=start + timedelta(hours=1))
+            for title, client, carer in [
+                ('Medication round', self.jane, self.carers[0]),
+                ('Lunch call', self.other, self.carers[1]),
+            ]
+        ]
+        self.note = Note.objects.create(appointment=self.visits[0], uploaded_by=self.carers[0],
+                                        content='Jane refused her medication at breakfast')
+        self.incident = Incident.objects.create(
+            appointment=self.visits[1], time=start, persons_involved='Carer', addresses_of_persons_involved='-',
+            incident_details='Found on the floor, medication spilled', remediation_taken='GP called',
+        )
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(user=self.admin)
+
+    def _search(self, **params):
+        response = self.api_client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return response.json()
+
+    def test_ranked_prefix_matches_across_types(self):
+        results = self._search(q='medic')['results']
+        self.assertEqual(
+            {(result['type'], result['id']) for result in results},
+            {('appointment', self.visits[0].id), ('note', self.note.id), ('incident', self.incident.id)},
+        )
+        # Title matches rank first
+        self.assertEqual(results[0]['type'], 'appointment')
+        note = next(result for result in results if result['type'] == 'note')
+        self.assertEqual((note['client'], note['client_name'], note['appointment']),
+                         (self.jane.id, 'Jane Smithson', self.visits[0].id))
+        self.assertIn('medication', note['excerpt'])
+
+        # Every word must match, in any field
+        results = self._search(q='smith mill')['results']
+        self.assertEqual([(result['type'], result['id']) for result in results], [('client', self.jane.id)])
+        self.assertEqual(self._search(q='medication', type='note,incident')['results'][0]['type'], 'note')
+
+    def test_index_follows_saves_deletes_and_reassignment(self):
+        self.note.content = 'Declined lunch'
+        self.note.save()
+        self.assertEqual(self._search(q='breakfast')['results'], [])
+        self.assertEqual(len(self._search(q='declined')['results']), 1)
+
+        # A carer sees every client but only their own visits' records
+        self.api_client.force_authenticate(user=self.carers[1])
+        self.assertEqual({result['type'] for result in self._search(q='medication')['results']}, {'incident'})
+        self.assertEqual(len(self._search(q='jane')['results']), 1)
+        self.visits[0].assigned_staff = self.carers[1]
+        self.visits[0].save()
+        self.assertEqual(
+            {result['type'] for result in self._search(q='medication')['results']}, {'appointment', 'incident'}
+        )
+        self.assertEqual(len(self._search(q='declined')['results']), 1)
+
+        self.incident.delete()
+        self.assertFalse(SearchEntry.objects.filter(kind='incident').exists())
+
+    def test_bulk_and_sync_writes_are_indexed(self):
+        start = timezone.now() + timedelta(days=2)
+        results = BulkAppointmentEngine(None, 'create', [{
+            'title': 'Wound dressing', 'client': self.other.id, 'assigned_staff': self.carers[1].id,
+            'start_time': start, 'end_time': start + timedelta(hours=1),
+        }]).run()
+        self.assertEqual(results['applied'], 1, results)
+        self.assertEqual(len(self._search(q='wound')['results']), 1)
+
+        relief = User.objects.create_user(username='search_relief', password='testpass123')
+        results = BulkAppointmentEngine(None, 'reassign', [{'id': self.visits[0].id, 'assigned_staff': relief.id}]).run()
+        self.assertEqual(results['applied'], 1, results)
+        self.assertEqual(set(SearchEntry.objects.filter(appointment_id=self.visits[0].id)
+                             .values_list('kind', 'staff_id')), {('appointment', relief.id), ('note', relief.id)})
+
+        results = MobileSyncEngine(self.carers[1], {'incidents': [{
+            'appointment': self.visits[1].id, 'time': start.isoformat(), 'persons_involved': 'Carer',
+            'addresses_of_persons_involved': '-', 'incident_details': 'Bruise on the left wrist',
+            'remediation_taken': 'Logged',
+        }]}).run()
+        self.assertEqual(results['incidents_created'], 1, results)
+        self.api_client.force_authenticate(user=self.carers[1])
+        self.assertEqual([result['type'] for result in self._search(q='bruise')['results']], ['incident'])
+
+    def test_pagination_and_errors(self):
+        start = timezone.now() + timedelta(days=2)
+        Appointment.objects.bulk_create([
+            Appointment(title=f'Evening call {i}', client=self.jane, assigned_staff=self.carers[0],
+                        start_time=start + timedelta(hours=i), end_time=start + timedelta(hours=i, minutes=30))
+            for i in range(5)
+        ])
+        # bulk_create bypasses the signals
+        self.assertEqual(self._search(q='evening')['results'], [])
+        call_command('rebuild_search_index', '--type', 'appointment', stdout=io.StringIO())
+
+        page = self._search(q='evening', page_size=2)
+        self.assertEqual(len(page['results']), 2)
+        self.assertIsNone(page['previous'])
+        seen = [result['id'] for result in page['results']]
+        while page['next']:
+            page = self.api_client.get(page['next']).json()
+            seen += [result['id'] for result in page['results']]
+        self.assertEqual(len(set(seen)), 5)
+
+        for params in ({}, {'q': '!!'}, {'q': 'x', 'type': 'invoice'}, {'q': 'x', 'page': '0'}, {'q': 'x', 'page': 'a'}):
+            self.assertEqual(self.api_client.get(self.url, params).status_code, status.HTTP_400_BAD_REQUEST)
+        self.api_client.force_authenticate(user=None)
+        self.assertEqual(self.api_client.get(self.url, {'q': 'jane'}).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_client_search_endpoint_uses_index(self):
+        response = self.api_client.get('/api/api/clients/search/', {'q': 'jones'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([client['id'] for client in response.json()], [self.other.id])
+
+    def test_migration_indexes_existing_rows(self):
+        from importlib import import_module
+        from django.apps import apps
+        from django.db import connection
+        # Rows written before the search index existed have no entries
+        SearchEntry.objects.all().delete()
+        self.assertEqual(self._search(q='medic')['results'], [])
+
+        import_module('search.migrations.0002_fill_search_index').fill_index(apps, connection.schema_editor())
+        self.assertEqual({result['type'] for result in self._search(q='medic')['results']},
+                         {'appointment', 'note', 'incident'})
+        response = self.api_client.get('/api/api/clients/search/', {'q': 'jones'})
+        self.assertEqual([client['id'] for client in response.json()], [self.other.id])
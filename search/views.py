@@ -0,0 +1,55 @@
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework.views import APIView
+
+from appointment_management.bulk import is_admin
+from .query import SearchError, search
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_OFFSET = 1000
+
+
+class SearchAPIView(APIView):
+    """
+    Ranked full-text search over clients, appointments, notes and incidents
+
+    Query: ?q=words&type=client,appointment,note,incident&page=1&page_size=20.
+    Words match as prefixes and all must match. Admins search everything;
+    carers search every client but only the records of their own visits.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            page = int(params.get('page', 1))
+            page_size = min(int(params.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'error': 'page and page_size must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        offset = (page - 1) * page_size
+        if page < 1 or page_size < 1 or offset > MAX_OFFSET:
+            return Response(
+                {'error': f'page and page_size must be positive and cover the first {MAX_OFFSET} results'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        kinds = [kind for value in params.getlist('type') for kind in value.split(',') if kind]
+        staff_id = None if is_admin(request.user) else request.user.pk
+        try:
+            results, has_more = search(params.get('q'), kinds=kinds, staff_id=staff_id, limit=page_size, offset=offset)
+        except SearchError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        url = request.build_absolute_uri()
+        previous = None
+        if page > 2:
+            previous = replace_query_param(url, 'page', page - 1)
+        elif page == 2:
+            previous = remove_query_param(url, 'page')
+        return Response({
+            'next': replace_query_param(url, 'page', page + 1) if has_more else None,
+            'previous': previous,
+            'results': results,
+        })
@@ -8,8 +8,22 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db.models import Count, Max
+from appointment_management.conditional import collection_state, conditional_get
 from .serializers import NoteSerializer
 
+
+def _by_appointment_state(view, request):
+    appointment_id = request.query_params.get('appointment_id')
+    if not appointment_id:
+        return None
+    return collection_state(
+        view.get_queryset().filter(appointment_id=appointment_id),
+        count=Count('pk'),
+        latest=Max('updated_at'),
+    )
+
+
 @login_required
 def note_create(request, appointment_id):
     appointment = get_object_or_404(Appointment, id=appointment_id)
@@ -75,6 +89,7 @@ class NoteViewSet(viewsets.ModelViewSet):
         return queryset
 
     @action(detail=False, methods=['get'])
+    @conditional_get(_by_appointment_state)
     def by_appointment(self, request):
         appointment_id = request.query_params.get('appointment_id')
         if not appointment_id: